@@ -0,0 +1,144 @@
+"""
+Admission control for the password-hashing endpoints (login, register).
+
+Each of those requests costs a full sha256_crypt computation, so a
+credential-stuffing burst can tie up the CPU for everyone. Before any
+hashing starts, a request must get a token from its client IP's bucket
+and from its email's bucket, and there must be room under a global cap on
+concurrent hash work. Otherwise it is turned away with a Retry-After.
+
+Buckets are kept in an LRU-ordered dict capped at AUTH_BUCKETS_MAX
+entries. A bucket that has been idle long enough to refill completely is
+the same as no bucket, so those entries are dropped as they expire.
+
+The IP is the connection's peer address. Behind a reverse proxy every
+request shares the proxy's address; list the proxy in AUTH_TRUSTED_PROXIES
+and the client address is taken from X-Forwarded-For instead (the
+rightmost entry not added by a trusted proxy, since anything left of it
+is client-supplied).
+"""
+import os
+import math
+import time
+from collections import OrderedDict
+
+AUTH_IP_RATE_PER_MINUTE = float(os.getenv("AUTH_IP_RATE_PER_MINUTE", "30"))
+AUTH_IP_BURST = float(os.getenv("AUTH_IP_BURST", "10"))
+AUTH_EMAIL_RATE_PER_MINUTE = float(os.getenv("AUTH_EMAIL_RATE_PER_MINUTE", "6"))
+AUTH_EMAIL_BURST = float(os.getenv("AUTH_EMAIL_BURST", "5"))
+AUTH_MAX_CONCURRENT = int(os.getenv("AUTH_MAX_CONCURRENT", "8"))
+AUTH_BUCKETS_MAX = int(os.getenv("AUTH_BUCKETS_MAX", "100000"))
+AUTH_TRUSTED_PROXIES = frozenset(filter(None, (proxy.strip() for proxy in os.getenv("AUTH_TRUSTED_PROXIES", "").split(","))))
+
+def client_ip(peer, forwarded_for=None, trusted_proxies=AUTH_TRUSTED_PROXIES):
+    """Address to rate-limit: the peer, or the X-Forwarded-For client when the peer is a trusted proxy"""
+    if peer not in trusted_proxies or not forwarded_for:
+        return peer
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if hop not in trusted_proxies:
+            return hop
+    return hops[0] if hops else peer
+
+class Rejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(f"{reason}; retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBuckets:
+    """Token buckets by key: `burst` tokens, refilled at `rate` per second"""
+    def __init__(self, rate, burst, maxsize=AUTH_BUCKETS_MAX):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        # key -> (tokens, last update), least recently used first
+        self.buckets = OrderedDict()
+        # Seconds for an empty bucket to refill completely
+        self.idle_seconds = burst / rate if rate > 0 else math.inf
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def take(self, key, now=None):
+        """Take a token; returns 0 if one was available, else the seconds until one will be"""
+        if now is None:
+            now = time.monotonic()
+        self._expire(now)
+        tokens, updated = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            wait = 0
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate if self.rate > 0 else math.inf
+        self.buckets[key] = (tokens, now)
+        while len(self.buckets) > self.maxsize:
+            self.buckets.popitem(last=False)
+            self.evictions += 1
+        return wait
+
+    def _expire(self, now):
+        # Oldest first, so stop at the first bucket that may still be partly drained
+        while self.buckets:
+            key, (tokens, updated) = next(iter(self.buckets.items()))
+            if now - updated < self.idle_seconds:
+                break
+            del self.buckets[key]
+
+class Ticket:
+    """Holds a place under the concurrency cap until released; releasing twice is harmless"""
+    def __init__(self, control):
+        self.control = control
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.control.in_flight -= 1
+
+class AdmissionControl:
+    def __init__(self, ip_rate=AUTH_IP_RATE_PER_MINUTE / 60, ip_burst=AUTH_IP_BURST,
+                 email_rate=AUTH_EMAIL_RATE_PER_MINUTE / 60, email_burst=AUTH_EMAIL_BURST,
+                 max_concurrent=AUTH_MAX_CONCURRENT):
+        self.by_ip = TokenBuckets(ip_rate, ip_burst)
+        self.by_email = TokenBuckets(email_rate, email_burst)
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = {"concurrency": 0, "ip": 0, "email": 0}
+
+    def admit(self, ip, email):
+        """A Ticket to release once the password work is done, or Rejected"""
+        if self.max_concurrent > 0 and self.in_flight >= self.max_concurrent:
+            self._reject("concurrency", 1, "Too many sign-ins in progress")
+        wait = self.by_ip.take(ip)
+        if wait:
+            self._reject("ip", wait, "Too many attempts from this address")
+        wait = self.by_email.take(email.casefold())
+        if wait:
+            self._reject("email", wait, "Too many attempts for this account")
+        self.in_flight += 1
+        self.admitted += 1
+        return Ticket(self)
+
+    def _reject(self, limit, wait, reason):
+        self.rejected[limit] += 1
+        raise Rejected(reason, max(1, math.ceil(min(wait, 3600))))
+
+    def stats(self, cost_seconds=0.0):
+        """Counters; `cost_seconds` is the CPU one request would have spent hashing, to estimate CPU shed"""
+        rejected = sum(self.rejected.values())
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "shed_cpu_seconds": round(rejected * cost_seconds, 2),
+            "ip_buckets": len(self.by_ip),
+            "email_buckets": len(self.by_email),
+            "bucket_evictions": self.by_ip.evictions + self.by_email.evictions,
+        }
+
+auth_admission = AdmissionControl()
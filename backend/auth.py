@@ -1,13 +1,17 @@
 import os
+import time
+import uuid
 import logging
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import jwt, JWTError
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from passlib.context import CryptContext
 from database import db
-from models import TokenData, UserOut, User
+from models import TokenData, UserOut, User, UserClaims
+from user_cache import user_cache, MISS
+from password_hashing import pwd_context
+from token_cache import token_cache
 
 logger = logging.getLogger(__name__)
 
@@ -20,10 +24,9 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24  # 24 hours
 REFRESH_TOKEN_EXPIRE_DAYS = 7   # 7 days
 
-# Password hashing
-pwd_context = CryptContext(schemes=["sha256_crypt"], deprecated="auto")
 security = HTTPBearer()
 
+# Synchronous hashing for scripts; request handlers use password_hashing's async API instead
 def get_password_hash(password: str) -> str:
     """Hash a password"""
     return pwd_context.hash(password)
@@ -40,7 +43,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
     
-    to_encode.update({"exp": expire, "type": "access"})
+    # iat is fractional so a revocation can tell tokens issued in the same second apart
+    to_encode.update({"exp": expire, "iat": time.time(), "type": "access"})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -52,20 +56,39 @@ def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None)
     else:
         expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     
-    to_encode.update({"exp": expire, "type": "refresh"})
+    to_encode.update({"exp": expire, "iat": time.time(), "type": "refresh"})
     encoded_jwt = jwt.encode(to_encode, REFRESH_SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def new_token_family() -> str:
+    """Id shared by the access and refresh tokens descending from one login, so they can be revoked together"""
+    return uuid.uuid4().hex
+
+def revoked_token_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Token has been revoked. Please log in again.",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def revoke_user_tokens(user_id: str):
+    """Reject every token issued to a user so far"""
+    token_cache.revoke_user(user_id, until=time.time() + REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+
+def revoke_token_family(family: str):
+    """Reject the access and refresh tokens descending from one login"""
+    token_cache.revoke_family(family, until=time.time() + REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+
 def verify_access_token(token: str) -> TokenData:
-    """Verify and decode an access token"""
+    """Verify and decode an access token; verified tokens are cached until they expire"""
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
-        logger.info(f"Verifying access token: {token[:20]}...")
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         token_type: str = payload.get("type")
         
-        logger.info(f"Token payload - user_id: {user_id}, type: {token_type}")
-        
         if user_id is None:
             logger.error("Token missing user_id")
             raise HTTPException(
@@ -82,8 +105,14 @@ def verify_access_token(token: str) -> TokenData:
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        logger.info(f"Token verified successfully for user: {user_id}")
-        return TokenData(user_id=user_id)
+        family = payload.get("fam")
+        if token_cache.is_revoked(user_id, family, payload.get("iat")):
+            raise revoked_token_error()
+        
+        token_data = TokenData(user_id=user_id, family=family, name=payload.get("name"), email=payload.get("email"))
+        if payload.get("exp") is not None:
+            token_cache.put(token, token_data, payload["exp"], user_id, family)
+        return token_data
     except JWTError as e:
         error_msg = str(e)
         logger.error(f"JWT decode error: {error_msg}")
@@ -129,7 +158,11 @@ def verify_refresh_token(token: str) -> TokenData:
                 headers={"WWW-Authenticate": "Bearer"},
             )
         
-        return TokenData(user_id=user_id)
+        family = payload.get("fam")
+        if token_cache.is_revoked(user_id, family, payload.get("iat")):
+            raise revoked_token_error()
+        
+        return TokenData(user_id=user_id, family=family)
     except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -139,49 +172,52 @@ def verify_refresh_token(token: str) -> TokenData:
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     """Get the current authenticated user"""
-    logger.info(f"Attempting to authenticate user with token")
-    
     try:
         token_data = verify_access_token(credentials.credentials)
-        logger.info(f"Token verified, user_id: {token_data.user_id}")
     except Exception as e:
         logger.error(f"Token verification failed: {e}")
         raise
     
+    cached = user_cache.get(token_data.user_id)
+    if cached is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if cached is not MISS:
+        return cached
+    
     # Try to convert user_id to ObjectId if it's a valid MongoDB ObjectId
     from bson import ObjectId
     try:
         if len(token_data.user_id) == 24:  # MongoDB ObjectId is 24 characters
             user_id = ObjectId(token_data.user_id)
-            logger.info(f"Converted user_id to ObjectId: {user_id}")
         else:
             user_id = token_data.user_id
-            logger.info(f"Using user_id as string: {user_id}")
     except Exception as e:
         user_id = token_data.user_id
         logger.warning(f"ObjectId conversion failed, using as string: {user_id}, error: {e}")
     
-    logger.info(f"Looking up user with _id: {user_id}")
+    start = time.perf_counter()
     user = await db.users.find_one({"_id": user_id})
+    user_cache.record_lookup(time.perf_counter() - start)
     
     if user is None:
         logger.error(f"User not found in database for user_id: {user_id}")
+        user_cache.put(token_data.user_id, None)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    logger.info(f"User found: {user.get('email', 'No email')}")
-    
     # Convert ObjectId to string for the User model
     user["_id"] = str(user["_id"])
     
     # Create User object with the correct data structure
     try:
         user_obj = User(**user)
-        logger.info(f"User object created successfully for: {user_obj.email}")
-        return user_obj
     except Exception as e:
         logger.error(f"Error creating User object: {e}")
         raise HTTPException(
@@ -189,6 +225,20 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Invalid user data",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    user_cache.put(token_data.user_id, user_obj)
+    return user_obj
+
+async def get_current_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> UserClaims:
+    """
+    The current user's id, name and email from the access token, without a database lookup.
+    Use get_current_user when the route needs the rest of the user or must see changes to it.
+    """
+    token_data = verify_access_token(credentials.credentials)
+    if token_data.name is not None and token_data.email is not None:
+        return UserClaims(id=token_data.user_id, name=token_data.name, email=token_data.email)
+    # Tokens issued before they carried these claims
+    user = await get_current_user(credentials)
+    return UserClaims(id=user.id, name=user.name, email=user.email)
 
 async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     """Get the current user ID from token"""
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark: authenticated GET throughput with the full-user dependency
+(get_current_user, which loads the user document) vs. the claims-only
+dependency (get_current_claims, which reads the access token), with the
+token and user caches on and off.
+
+Both routes return the same small body, so the difference is the cost of
+authenticating. The database is the in-memory backend, so the user lookup
+here is a lower bound on what a MongoDB round trip costs.
+
+Run from the backend/ directory:
+    python -m benchmarks.bench_auth_dependency [seconds_per_case]
+"""
+import sys
+import time
+import asyncio
+import logging
+
+async def throughput(client, path, headers, budget):
+    done = 0
+    start = time.perf_counter()
+    while True:
+        response = await client.get(path, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}")
+        done += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= budget:
+            return done / elapsed
+
+async def main(budget):
+    import httpx
+    from fastapi import FastAPI, Depends
+    from auth import create_access_token, get_current_user, get_current_claims, new_token_family
+    from database import InMemoryDB, db
+    from token_cache import token_cache
+    from user_cache import user_cache
+
+    database = InMemoryDB()
+    result = await database.users.insert_one({"name": "Bench User", "email": "bench@example.com", "password": "x"})
+    db.bind(database)
+    user_id = str(result.inserted_id)
+    token = create_access_token({"sub": user_id, "fam": new_token_family(), "name": "Bench User",
+                                 "email": "bench@example.com"})
+    headers = {"Authorization": f"Bearer {token}"}
+
+    app = FastAPI()
+
+    @app.get("/full")
+    async def full(current_user=Depends(get_current_user)):
+        return {"id": current_user.id, "name": current_user.name, "email": current_user.email}
+
+    @app.get("/claims")
+    async def claims(current_user=Depends(get_current_claims)):
+        return {"id": current_user.id, "name": current_user.name, "email": current_user.email}
+
+    cases = [
+        ("full user, no caches", "/full", False, False),
+        ("full user, token cache", "/full", True, False),
+        ("full user, token + user cache", "/full", True, True),
+        ("claims, no token cache", "/claims", False, False),
+        ("claims, token cache", "/claims", True, False),
+    ]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        baseline = None
+        for label, path, token_caching, user_caching in cases:
+            token_cache.maxsize = 10000 if token_caching else 0
+            user_cache.maxsize = 4096 if user_caching else 0
+            token_cache.clear()
+            user_cache.clear()
+            rps = await throughput(client, path, headers, budget)
+            baseline = baseline or rps
+            print(f"{label:<32} {rps:9.0f} req/s  {rps / baseline:5.2f}x")
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    asyncio.run(main(float(sys.argv[1]) if len(sys.argv) > 1 else 3.0))
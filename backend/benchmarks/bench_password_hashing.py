@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark: login throughput and event-loop lag under a burst of concurrent
+logins, hashing inline on the event loop (the old login handler) vs. on the
+password hashing process pool.
+
+While the logins run, a ticker coroutine asks to wake every 5 ms and
+records how late it actually wakes: that lateness is what every other
+request on the worker waits on top of its own work.
+
+Run from the backend/ directory:
+    python -m benchmarks.bench_password_hashing [concurrent_logins] [workers ...]
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+
+TICK = 0.005
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+async def ticker(lags, done):
+    loop = asyncio.get_running_loop()
+    while not done.is_set():
+        expected = loop.time() + TICK
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - expected)
+
+async def burst(client, logins):
+    lags = []
+    done = asyncio.Event()
+    tick = asyncio.ensure_future(ticker(lags, done))
+    start = time.perf_counter()
+    responses = await asyncio.gather(*[
+        client.post("/api/users/login", json={"email": f"user{i}@example.com", "password": "correct horse"})
+        for i in range(logins)
+    ])
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick
+    ok = sum(response.status_code == 200 for response in responses)
+    return ok, elapsed, sorted(lags)
+
+async def run(logins, workers):
+    # routes.users imports the mail configuration; login never sends mail
+    for name, value in [("MAIL_USERNAME", "bench"), ("MAIL_PASSWORD", "bench"), ("MAIL_FROM", "bench@example.com"),
+                        ("MAIL_SERVER", "localhost")]:
+        os.environ.setdefault(name, value)
+    import httpx
+    from fastapi import FastAPI
+    from auth import get_password_hash
+    from database import InMemoryDB, db
+    from admission import AdmissionControl
+    from password_hashing import password_hasher
+    from routes import users
+
+    database = InMemoryDB()
+    hashed = get_password_hash("correct horse")
+    await database.users.insert_many([{"name": f"User {i}", "email": f"user{i}@example.com", "password": hashed}
+                                      for i in range(logins)])
+    db.bind(database)
+    password_hasher.workers = workers
+    password_hasher.max_pending = logins
+    await password_hasher.start()
+    # Every login comes from one test client; measure hashing, not the rate limits, with fresh buckets each run
+    users.auth_admission = AdmissionControl(ip_burst=logins, email_burst=logins, max_concurrent=0)
+
+    app = FastAPI()
+    app.include_router(users.router, prefix="/api/users")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        ok, elapsed, lags = await burst(client, logins)
+    password_hasher.stop()
+
+    label = "inline (event loop)" if workers == 0 else f"process pool, {workers} worker{'s' if workers != 1 else ''}"
+    print(f"{label:<28} {ok / elapsed:9.1f} logins/s   loop lag p50 {percentile(lags, 0.5) * 1000:7.1f} ms"
+          f"  p99 {percentile(lags, 0.99) * 1000:7.1f} ms  max {lags[-1] * 1000:7.1f} ms  ({ok}/{logins} ok)")
+
+def main(logins, worker_counts):
+    logging.disable(logging.INFO)
+    print(f"{logins} concurrent logins\n")
+    for workers in worker_counts:
+        asyncio.run(run(logins, workers))
+
+if __name__ == "__main__":
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    worker_counts = [int(arg) for arg in sys.argv[2:]] or [0, min(4, os.cpu_count() or 1)]
+    main(logins, worker_counts)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Benchmark: latency, throughput and memory of the provider endpoints
+(filtered list, match and get-by-id) as the directory grows.
+
+Each directory size runs in a fresh process: a synthetic directory is
+loaded into the in-memory backend, the provider routes are served in
+process over ASGI, and a fixed query workload is replayed one request at a
+time. Results are printed and written to a JSON file so runs can be
+compared.
+
+Run from the backend/ directory:
+    python -m benchmarks.bench_provider_endpoints [provider_count ...] [--output results.json]
+"""
+import sys
+import json
+import logging
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import multiprocessing
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+OPERATIONS = ("list", "match", "get")
+
+def peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summarize(latencies, elapsed):
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "throughput_rps": round(len(ordered) / elapsed, 1),
+        "peak_rss_mib": peak_rss_mib(),
+    }
+
+async def replay(client, path, params, max_requests, budget):
+    """Send requests one at a time until max_requests or `budget` seconds; returns the summary"""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(max_requests):
+        sent = time.perf_counter()
+        response = await client.get(path(i), params=params(i))
+        latencies.append(time.perf_counter() - sent)
+        if response.status_code != 200:
+            raise RuntimeError(f"{response.request.url} returned {response.status_code}")
+        if time.perf_counter() - start >= budget and i >= 10:
+            break
+    return summarize(latencies, time.perf_counter() - start)
+
+async def run_size(count, max_requests, budget, cache):
+    import httpx
+    from fastapi import FastAPI
+    from database import InMemoryDB, db
+    from match_cache import match_cache
+    from provider_index import provider_index
+    from provider_normalization import normalize_provider
+    from routes import providers
+    from benchmarks.synthetic_directory import make_providers, make_match_queries, make_list_queries
+
+    if not cache:
+        match_cache.maxsize = 0
+
+    start = time.perf_counter()
+    database = InMemoryDB()
+    await database.providers.insert_many([normalize_provider(p) for p in make_providers(count)])
+    db.bind(database)
+    await provider_index.start(database)
+    load_seconds = time.perf_counter() - start
+    result = {"providers": count, "load_seconds": round(load_seconds, 2), "rss_after_load_mib": peak_rss_mib()}
+
+    app = FastAPI()
+    app.include_router(providers.router, prefix="/api/providers")
+    match_queries = make_match_queries(1000, seed=1)
+    list_queries = make_list_queries(1000, seed=2)
+    rng = random.Random(3)
+    ids = [f"prov_{rng.randrange(count):07d}" for _ in range(1000)]
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        result["list"] = await replay(client, lambda i: "/api/providers/",
+                                      lambda i: list_queries[i % len(list_queries)], max_requests, budget)
+        result["match"] = await replay(client, lambda i: "/api/providers/match/",
+                                       lambda i: match_queries[i % len(match_queries)], max_requests, budget)
+        result["get"] = await replay(client, lambda i: f"/api/providers/{ids[i % len(ids)]}",
+                                     lambda i: None, max_requests, budget)
+    await provider_index.stop()
+    return result
+
+def run_size_in_process(count, max_requests, budget, cache):
+    # Per-request INFO logging (httpx, the index) would dominate the timings
+    logging.disable(logging.INFO)
+    return asyncio.run(run_size(count, max_requests, budget, cache))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--output", default="provider_endpoints_benchmark.json", help="JSON results file")
+    parser.add_argument("--requests", type=int, default=2000, help="Most requests per operation")
+    parser.add_argument("--budget", type=float, default=10.0, help="Seconds per operation before stopping early")
+    parser.add_argument("--cache", action="store_true", help="Keep the match cache on (off by default)")
+    args = parser.parse_args()
+
+    report = {
+        "benchmark": "provider_endpoints",
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "match_cache": args.cache,
+        "max_requests": args.requests,
+        "budget_seconds": args.budget,
+        "runs": [],
+    }
+    print(f"{'providers':>10} {'op':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9} {'peak RSS MiB':>13}")
+    # A fresh process per size, so peak RSS belongs to that size alone
+    context = multiprocessing.get_context("spawn")
+    for count in args.sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            run = pool.submit(run_size_in_process, count, args.requests, args.budget, args.cache).result()
+        report["runs"].append(run)
+        for op in OPERATIONS:
+            stats = run[op]
+            print(f"{count:>10} {op:>6} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} "
+                  f"{stats['throughput_rps']:>9.1f} {stats['peak_rss_mib']:>13.1f}")
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Benchmark: symptom extraction throughput over a corpus of intake
+descriptions, comparing the Aho-Corasick matcher with checking every phrase
+separately and with one big regex alternation.
+
+Run from the backend/ directory:
+    python -m benchmarks.bench_symptom_extraction [description_count]
+"""
+import re
+import sys
+import time
+import random
+
+from symptoms import SYMPTOMS, extract_symptoms, normalize_text
+
+FILLER = ("i have been feeling unwell for the past few days and it gets worse at night after meals "
+          "when i walk to work my doctor said to come in since the medicine did not help much").split()
+
+PHRASES = [(phrase, code) for code, (name, synonyms) in SYMPTOMS.items() for phrase in [name] + synonyms]
+
+def make_corpus(count, rng):
+    corpus = []
+    for _ in range(count):
+        words = rng.choices(FILLER, k=rng.randint(20, 80))
+        for _ in range(rng.randint(1, 3)):
+            words.insert(rng.randrange(len(words)), rng.choice(PHRASES)[0])
+        corpus.append(" ".join(words).capitalize() + ".")
+    return corpus
+
+def per_phrase(text):
+    # Look for every phrase on its own: one pass over the text per phrase
+    padded = f" {normalize_text(text)} "
+    codes = []
+    for phrase, code in PHRASES:
+        if f" {phrase} " in padded and code not in codes:
+            codes.append(code)
+    return codes
+
+_ALTERNATION = re.compile(r"\b(?:" + "|".join(re.escape(p) for p, _ in sorted(PHRASES, key=lambda p: -len(p[0]))) + r")\b")
+_CODES = dict(PHRASES)
+
+def regex_alternation(text):
+    codes = []
+    for found in _ALTERNATION.findall(normalize_text(text)):
+        if _CODES[found] not in codes:
+            codes.append(_CODES[found])
+    return codes
+
+def measure(label, fn, corpus):
+    total_bytes = sum(len(text) for text in corpus)
+    start = time.perf_counter()
+    found = sum(len(fn(text)) for text in corpus)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(corpus) / elapsed:12,.0f} desc/s {total_bytes / elapsed / 1e6:8.2f} MB/s  ({found} symptoms)")
+
+def main(count):
+    corpus = make_corpus(count, random.Random(7))
+    print(f"{count} descriptions, {len(PHRASES)} phrases\n")
+    measure("aho-corasick (extract)", extract_symptoms, corpus)
+    measure("regex alternation", regex_alternation, corpus)
+    measure("every phrase separately", per_phrase, corpus)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark: provider matching throughput, scoring every raw provider document
+in a Python loop (the original match_providers, copied below) vs. the NumPy
+feature arrays.
+
+Run from the backend/ directory:
+    python -m benchmarks.bench_vectorized_matching [provider_count ...]
+"""
+import re
+import sys
+import time
+
+from matching import match
+from provider_index import ProviderIndex
+from provider_normalization import normalize_provider
+from benchmarks.synthetic_directory import make_providers, make_match_queries
+
+GENERALIST_TERMS = ["general physician", "internal medicine", "family medicine"]
+SYMPTOM_SPECIALTY_MAP = {
+    "rash": ["dermatology", "general physician", "internal medicine"],
+    "diarrhea": ["gastroenterology", "internal medicine", "general physician", "family medicine"],
+    "fever": ["internal medicine", "general physician", "family medicine", "pediatrics"],
+    "cough": ["pulmonologist", "internal medicine", "general physician", "family medicine"],
+    "headache": ["neurology", "internal medicine", "general physician"],
+    "chest pain": ["cardiology", "internal medicine", "general physician"],
+    "back pain": ["orthopedics", "general physician", "internal medicine"],
+    "joint pain": ["orthopedics", "rheumatology", "general physician"],
+    "fatigue": ["internal medicine", "general physician", "family medicine"],
+    "shortness of breath": ["pulmonologist", "cardiology", "internal medicine"],
+    "abdominal pain": ["gastroenterology", "internal medicine", "general physician"],
+    "dizziness": ["neurology", "internal medicine", "general physician"],
+    "sore throat": ["ent", "internal medicine", "general physician"],
+    "vomiting": ["gastroenterology", "internal medicine", "general physician"],
+    "nausea": ["gastroenterology", "internal medicine", "general physician"],
+}
+
+def loop_match(providers, symptoms=None, insurance=None, location=None, limit=3):
+    # The original match_providers: lowercase and regex-parse every provider on every query, sort, take the top
+    scored = []
+    for provider in providers:
+        reasons = []
+        insurance_score = 0
+        location_score = 0
+        symptom_score = 0
+        if insurance and provider.get("accepted_insurances"):
+            insurance_lower = insurance.lower()
+            provider_insurances = [ins.lower() for ins in provider["accepted_insurances"]]
+            if any(insurance_lower in ins for ins in provider_insurances):
+                insurance_score = 35
+                reasons.append(f"Accepts {insurance}")
+        if location and provider.get("city"):
+            if location.lower() == provider.get("city").lower():
+                location_score = 20
+                reasons.append(f"Located in {provider['city']}")
+        if symptoms and provider.get("specialty"):
+            if isinstance(symptoms, str):
+                symptoms_list = [s.strip().lower() for s in symptoms.split(",")]
+            else:
+                symptoms_list = [s.strip().lower() for s in symptoms]
+            specialty_lower = provider["specialty"].lower()
+            for symptom in symptoms_list:
+                if symptom in SYMPTOM_SPECIALTY_MAP:
+                    if specialty_lower in SYMPTOM_SPECIALTY_MAP[symptom]:
+                        symptom_score = max(symptom_score, 35)
+                        reasons.append(f"Specializes in {symptom} treatment")
+                    elif any(term in specialty_lower for term in GENERALIST_TERMS):
+                        symptom_score = max(symptom_score, 30)
+                        reasons.append(f"Can treat {symptom}")
+        base_score = insurance_score + location_score + symptom_score
+        bonus_points = 0
+        if provider.get("rating"):
+            try:
+                bonus_points += min(float(provider["rating"]) * 2, 6)
+                reasons.append(f"High rating: {provider['rating']}")
+            except Exception:
+                pass
+        if provider.get("wait_time"):
+            wait_minutes = re.findall(r'\d+', str(provider["wait_time"]))
+            if wait_minutes and int(wait_minutes[0]) <= 10:
+                bonus_points += 2
+                reasons.append("Quick wait time")
+        if provider.get("experience"):
+            exp_years = re.findall(r'\d+', str(provider["experience"]))
+            if exp_years and int(exp_years[0]) >= 15:
+                bonus_points += 2
+                reasons.append("Highly experienced")
+        percent_score = round(base_score + min(bonus_points, max(0, 100 - base_score)), 2)
+        if percent_score > 0:
+            scored.append({**provider, "match_score": percent_score, "match_reasons": reasons})
+    scored.sort(key=lambda p: p["match_score"], reverse=True)
+    return scored[:limit]
+
+def throughput(fn, queries, budget=2.0):
+    """Queries per second, running through the workload until about `budget` seconds have passed"""
+    done = 0
+    start = time.perf_counter()
+    while True:
+        fn(**queries[done % len(queries)])
+        done += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= budget and done >= 3:
+            return done / elapsed
+
+def main(counts):
+    queries = make_match_queries(200, seed=42)
+    print(f"{'providers':>10} {'loop q/s':>12} {'numpy q/s':>12} {'speedup':>9}")
+    for count in counts:
+        providers = make_providers(count, seed=42)
+        index = ProviderIndex()
+        for provider in providers:
+            index.upsert(normalize_provider(provider))
+        loop_qps = throughput(lambda **q: loop_match(providers, **q), queries)
+        numpy_qps = throughput(lambda **q: match(index, **q), queries)
+        print(f"{count:>10} {loop_qps:>12.2f} {numpy_qps:>12.1f} {numpy_qps / loop_qps:>8.1f}x")
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    main(counts)
@@ -0,0 +1,91 @@
+"""
+Synthetic provider directory and query workload for benchmarks.
+
+Providers have the same fields and value shapes as seed_providers.providers:
+specialties are drawn from the seed data's own spellings, insurances from
+ALLOWED_INSURANCES, and each provider sits somewhere around a real city.
+Everything is generated from a seeded random.Random, so a given size and
+seed always produce the same directory.
+"""
+import random
+
+from seed_providers import ALLOWED_INSURANCES, providers as SEED_PROVIDERS
+from specialties import SYMPTOM_SPECIALTIES
+
+# City, state, pincode, latitude, longitude
+CITIES = [
+    ("Guntur", "AP", "522001", 16.3067, 80.4365),
+    ("Vijayawada", "AP", "520008", 16.5062, 80.6480),
+    ("Mangalagiri", "AP", "522503", 16.4300, 80.5686),
+    ("Tadepalli", "AP", "522501", 16.4800, 80.6000),
+    ("Tenali", "AP", "522201", 16.2390, 80.6400),
+    ("Narasaraopet", "AP", "522601", 16.2350, 80.0490),
+    ("Ongole", "AP", "523001", 15.5057, 80.0499),
+    ("Eluru", "AP", "534001", 16.7107, 81.0952),
+    ("Visakhapatnam", "AP", "530001", 17.6868, 83.2185),
+    ("Hyderabad", "TS", "500001", 17.3850, 78.4867),
+    ("Chennai", "TN", "600001", 13.0827, 80.2707),
+    ("Bengaluru", "KA", "560001", 12.9716, 77.5946),
+]
+
+SPECIALTIES = sorted({p["specialty"] for p in SEED_PROVIDERS})
+HOSPITALS = sorted({p["hospital"].split(",")[0] for p in SEED_PROVIDERS if p.get("hospital")})
+EDUCATION = sorted({p["education"] for p in SEED_PROVIDERS if p.get("education")})
+FIRST_NAMES = ["Jayanth", "Priya", "Ravi", "Anjali", "Suresh", "Lakshmi", "Kiran", "Divya", "Venkat", "Sravani",
+               "Arjun", "Meena", "Naveen", "Swathi", "Rahul", "Keerthi"]
+LAST_NAMES = ["Reddy", "Kotte", "Rao", "Bollapalli", "Naidu", "Chowdary", "Sharma", "Varma", "Prasad", "Gupta"]
+
+def make_provider(i, rng):
+    city, state, pincode, lat, lng = rng.choice(CITIES)
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    hospital = rng.choice(HOSPITALS)
+    return {
+        "_id": f"prov_{i:07d}",
+        "name": f"Dr. {first} {last}",
+        "specialty": rng.choice(SPECIALTIES),
+        "accepted_insurances": rng.sample(ALLOWED_INSURANCES, rng.randint(1, 4)),
+        "location_lat": round(lat + rng.uniform(-0.05, 0.05), 4),
+        "location_lng": round(lng + rng.uniform(-0.05, 0.05), 4),
+        "address": f"{hospital}, {city}",
+        "rating": rng.choice([3.8, 4.0, 4.2, 4.4, 4.5, 4.6, 4.7, 4.8, 4.9]),
+        "wait_time": f"{rng.choice([5, 10, 15, 20, 25, 30, 45])} mins",
+        "phone": f"+91 {rng.randint(800, 899)} {rng.randint(100, 999)} {rng.randint(1000, 9999)}",
+        "email": f"dr.{first.lower()}{i}@example.com",
+        "experience": f"{rng.randint(2, 30)} years",
+        "education": rng.choice(EDUCATION),
+        "hospital": f"{hospital}, {city}",
+        "city": city,
+        "state": state,
+        "pincode": pincode,
+    }
+
+def make_providers(count, seed=0):
+    rng = random.Random(seed)
+    return [make_provider(i, rng) for i in range(count)]
+
+def make_match_queries(count, seed=0):
+    """Query params for /api/providers/match/: one to three symptoms, usually an insurance and a city"""
+    rng = random.Random(seed)
+    symptoms = sorted(SYMPTOM_SPECIALTIES)
+    queries = []
+    for _ in range(count):
+        query = {"symptoms": ",".join(rng.sample(symptoms, rng.randint(1, 3))), "limit": rng.choice([3, 5, 10])}
+        if rng.random() < 0.8:
+            query["insurance"] = rng.choice(ALLOWED_INSURANCES)
+        if rng.random() < 0.7:
+            query["location"] = rng.choice(CITIES)[0]
+        queries.append(query)
+    return queries
+
+def make_list_queries(count, seed=0):
+    """Query params for /api/providers/: a city and a specialty, sometimes with an insurance or minimum rating"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        query = {"city": rng.choice(CITIES)[0], "specialty": rng.choice(SPECIALTIES)}
+        if rng.random() < 0.5:
+            query["insurance"] = rng.choice(ALLOWED_INSURANCES)
+        if rng.random() < 0.3:
+            query["min_rating"] = rng.choice([4.0, 4.5])
+        queries.append(query)
+    return queries
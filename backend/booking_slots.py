@@ -0,0 +1,339 @@
+"""
+In-process index of booked appointment slots, per provider.
+
+Each provider's bookings are kept as a list of (start, end) intervals
+sorted by start time, so checking whether a new appointment overlaps an
+existing one is a binary search plus a look at its neighbours, however
+much booking history the provider has.
+
+The booking routes claim a slot in the index before writing the booking
+and release it if the write doesn't happen, so two requests racing for the
+same slot on one worker can't both get through. The index only knows about
+other workers' bookings once their writes reach it (through the data
+server's change feed, a MongoDB change stream or a periodic rebuild), so
+after claiming, the routes also query the database for overlapping
+bookings right before writing. That query is what catches another
+worker's booking. Two workers that run it at the same moment for the same
+slot can still both pass, within the few milliseconds before either write
+lands.
+"""
+import asyncio
+import logging
+import os
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+# Length of an appointment when the booking doesn't say
+APPOINTMENT_MINUTES = int(os.getenv("APPOINTMENT_MINUTES", "30"))
+
+# Seconds between full rebuilds when booking writes can't be observed directly
+REFRESH_SECONDS = float(os.getenv("BOOKING_SLOTS_REFRESH_SECONDS", "60"))
+# Seconds between attempts to resubscribe to a lost change feed
+RESUBSCRIBE_SECONDS = 1.0
+
+# Longest appointment a booking can ask for, which bounds the database overlap query
+MAX_APPOINTMENT_MINUTES = max(24 * 60, APPOINTMENT_MINUTES)
+
+class SlotConflict(Exception):
+    """The requested time overlaps one of the provider's existing appointments"""
+    def __init__(self, slot):
+        super().__init__(f"Provider already has an appointment from {slot.start} to {slot.end}")
+        self.slot = slot
+
+class Slot:
+    __slots__ = ("provider_id", "start", "end", "booking_id")
+
+    def __init__(self, provider_id, start, end, booking_id=None):
+        self.provider_id = provider_id
+        self.start = start
+        self.end = end
+        self.booking_id = booking_id
+
+def slot_time(value):
+    """Appointment time as a naive UTC datetime, comparable whatever form it was stored in"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def slot_end(start, duration_minutes=None):
+    return start + timedelta(minutes=duration_minutes or APPOINTMENT_MINUTES)
+
+class ProviderSchedule:
+    """One provider's slots, sorted by start time; `starts` mirrors `slots` for bisecting"""
+    def __init__(self):
+        self.starts = []
+        self.slots = []
+        # Longest appointment seen, which bounds how far back an overlapping slot can start
+        self.longest = timedelta(0)
+
+    def add(self, slot):
+        i = bisect_left(self.starts, slot.start)
+        self.starts.insert(i, slot.start)
+        self.slots.insert(i, slot)
+        self.longest = max(self.longest, slot.end - slot.start)
+
+    def remove(self, slot):
+        i = bisect_left(self.starts, slot.start)
+        while i < len(self.slots) and self.starts[i] == slot.start:
+            if self.slots[i] is slot:
+                del self.starts[i]
+                del self.slots[i]
+                return
+            i += 1
+
+    def overlapping(self, start, end, ignore=None):
+        """First slot overlapping [start, end), other than those of booking `ignore`"""
+        # Only slots starting after start - longest can still be running at `start`
+        i = bisect_left(self.starts, start - self.longest)
+        while i < len(self.slots) and self.starts[i] < end:
+            slot = self.slots[i]
+            if slot.end > start and (ignore is None or slot.booking_id != ignore):
+                return slot
+            i += 1
+        return None
+
+class SlotIndex:
+    def __init__(self):
+        self.schedules = {}
+        self.by_booking = {}
+        # Claimed slots whose bookings haven't been written yet; kept across rebuilds
+        self.pending = set()
+        # While build() scans the database: this worker's changes to replay over the scanned bookings
+        self._changes = None
+        self.built = False
+        self._build_lock = None
+        self._sync_task = None
+
+    def __len__(self):
+        return len(self.by_booking)
+
+    def _add(self, slot):
+        self.schedules.setdefault(slot.provider_id, ProviderSchedule()).add(slot)
+
+    def _remove(self, slot):
+        schedule = self.schedules.get(slot.provider_id)
+        if schedule is not None:
+            schedule.remove(slot)
+            if not schedule.slots:
+                del self.schedules[slot.provider_id]
+
+    # Queries
+
+    def conflict(self, provider_id, start, duration_minutes=None, ignore=None):
+        """The slot a booking at `start` would overlap, or None if the time is free"""
+        schedule = self.schedules.get(provider_id)
+        if schedule is None:
+            return None
+        start = slot_time(start)
+        return schedule.overlapping(start, slot_end(start, duration_minutes), ignore)
+
+    def is_free(self, provider_id, start, duration_minutes=None, ignore=None):
+        return self.conflict(provider_id, start, duration_minutes, ignore) is None
+
+    # Claiming slots from the booking routes
+
+    def claim(self, provider_id, start, duration_minutes=None, booking_id=None):
+        """
+        Reserve a slot, raising SlotConflict if it overlaps another booking. When moving an
+        existing booking, pass its id so its current slot doesn't count as a conflict.
+        """
+        start = slot_time(start)
+        end = slot_end(start, duration_minutes)
+        schedule = self.schedules.get(provider_id)
+        if schedule is not None:
+            taken = schedule.overlapping(start, end, ignore=str(booking_id) if booking_id is not None else None)
+            if taken is not None:
+                raise SlotConflict(taken)
+        slot = Slot(provider_id, start, end)
+        self._add(slot)
+        self.pending.add(slot)
+        return slot
+
+    def commit(self, slot, booking_id):
+        """The booking for a claimed slot was written; it replaces the booking's previous slot, if any"""
+        booking_id = str(booking_id)
+        self.pending.discard(slot)
+        previous = self.by_booking.get(booking_id)
+        if previous is not None and previous is not slot:
+            self._remove(previous)
+        slot.booking_id = booking_id
+        self.by_booking[booking_id] = slot
+        self._record("restore", slot)
+
+    def release(self, slot):
+        """Give up a claimed slot whose booking wasn't written"""
+        self.pending.discard(slot)
+        if slot.booking_id is None:
+            self._remove(slot)
+
+    # Keeping up with booking documents
+
+    def upsert(self, booking):
+        if not booking.get("provider_id") or not booking.get("appointment_time"):
+            return
+        try:
+            start = slot_time(booking["appointment_time"])
+        except (TypeError, ValueError):
+            return
+        self._restore(Slot(booking["provider_id"], start, slot_end(start, booking.get("duration_minutes")),
+                           str(booking["_id"])))
+
+    def _restore(self, slot):
+        self.remove(slot.booking_id)
+        self._add(slot)
+        self.by_booking[slot.booking_id] = slot
+        self._record("restore", slot)
+
+    def remove(self, booking_id):
+        slot = self.by_booking.pop(str(booking_id), None)
+        if slot is not None:
+            self._remove(slot)
+        self._record("remove", booking_id)
+
+    def _record(self, change, arg):
+        if self._changes is not None:
+            self._changes.append((change, arg))
+
+    def clear(self):
+        self.schedules = {}
+        self.by_booking = {}
+        for slot in self.pending:
+            self._add(slot)
+
+    # Building and syncing
+
+    async def check_database(self, db, slot, booking_id=None):
+        """
+        Raise SlotConflict if the database has a booking, other than `booking_id`, overlapping a
+        claimed slot. Bookings found this way are added to the index.
+        """
+        earliest = slot.start - timedelta(minutes=MAX_APPOINTMENT_MINUTES)
+        utc = timezone.utc
+        query = {
+            "provider_id": slot.provider_id,
+            # Times are stored naive (UTC) or timezone-aware, as given; each only compares with its own kind
+            "$or": [
+                {"appointment_time": {"$gt": earliest, "$lt": slot.end}},
+                {"appointment_time": {"$gt": earliest.replace(tzinfo=utc), "$lt": slot.end.replace(tzinfo=utc)}},
+            ],
+        }
+        async for booking in db.bookings.find(query, {"provider_id": 1, "appointment_time": 1, "duration_minutes": 1}):
+            if booking_id is not None and str(booking["_id"]) == str(booking_id):
+                continue
+            start = slot_time(booking["appointment_time"])
+            end = slot_end(start, booking.get("duration_minutes"))
+            if start < slot.end and end > slot.start:
+                self.upsert(booking)
+                raise SlotConflict(Slot(slot.provider_id, start, end, str(booking["_id"])))
+
+    async def build(self, db):
+        """Load every booking from the database"""
+        self._changes = []
+        bookings = []
+        try:
+            async for b in db.bookings.find({}, {"provider_id": 1, "appointment_time": 1, "duration_minutes": 1}):
+                bookings.append(b)
+        finally:
+            changes, self._changes = self._changes, None
+        self.clear()
+        for b in bookings:
+            self.upsert(b)
+        # Bookings written or cancelled while the scan ran may be missing from it
+        for change, arg in changes:
+            if change == "restore":
+                self._restore(arg)
+            else:
+                self.remove(arg)
+        self.built = True
+        logger.info(f"Booking slot index built with {len(self.by_booking)} bookings")
+
+    async def ensure_built(self, db):
+        if self.built:
+            return
+        if self._build_lock is None:
+            self._build_lock = asyncio.Lock()
+        async with self._build_lock:
+            if not self.built:
+                await self.build(db)
+
+    async def start(self, db):
+        """Build the index and, when other processes can write bookings, follow their writes"""
+        from database import InMemoryCollection
+        from data_server import RemoteCollection
+        bookings = db.bookings
+        if isinstance(bookings, InMemoryCollection):
+            # Every booking write goes through this process's routes, which keep the index current
+            await self.build(db)
+        elif isinstance(bookings, RemoteCollection):
+            # Subscribe before building so no other worker's write is missed
+            stream = await bookings.watch().open()
+            await self.build(db)
+            self._sync_task = asyncio.ensure_future(self._follow(db, stream))
+        else:
+            await self.build(db)
+            self._sync_task = asyncio.ensure_future(self._watch(db))
+
+    async def stop(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    def apply_change(self, change):
+        """Apply a change stream event"""
+        if change["operationType"] in ("insert", "update", "replace") and change.get("fullDocument"):
+            self.upsert(change["fullDocument"])
+        elif change["operationType"] == "delete":
+            self.remove(change["documentKey"]["_id"])
+        elif change["operationType"] in ("drop", "invalidate"):
+            self.clear()
+
+    async def _watch(self, db):
+        try:
+            async with db.bookings.watch(full_document="updateLookup") as stream:
+                async for change in stream:
+                    self.apply_change(change)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Change streams need a replica set; a standalone server falls back to periodic rebuilds
+            logger.warning(f"Booking change stream unavailable ({e}); rebuilding every {REFRESH_SECONDS}s")
+            await self._refresh_periodically(db)
+
+    async def _follow(self, db, stream):
+        """Apply the data server's booking changes; if the feed drops, resubscribe and rebuild"""
+        while True:
+            try:
+                async with stream:
+                    async for change in stream:
+                        self.apply_change(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Booking change feed lost ({e}); resubscribing")
+            stream = None
+            while stream is None:
+                await asyncio.sleep(RESUBSCRIBE_SECONDS)
+                try:
+                    stream = await db.bookings.watch().open()
+                    await self.build(db)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Booking change feed resubscribe failed: {e}")
+                    if stream is not None:
+                        await stream.close()
+                        stream = None
+
+    async def _refresh_periodically(self, db):
+        while True:
+            await asyncio.sleep(REFRESH_SECONDS)
+            try:
+                await self.build(db)
+            except Exception as e:
+                logger.error(f"Booking slot index refresh failed: {e}")
+
+slot_index = SlotIndex()
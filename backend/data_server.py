@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+Shared data server: one InMemoryDB process that every API worker talks to.
+
+Without MongoDB each gunicorn/uvicorn worker would fall back to its own
+private InMemoryDB, so a user registered on one worker couldn't log in on
+another. Run this server once and point the workers at its socket:
+
+    python data_server.py --socket /tmp/mediconnect-data.sock
+    DATA_SERVER_SOCKET=/tmp/mediconnect-data.sock gunicorn -k uvicorn.workers.UvicornWorker -w 4 main:app
+
+The protocol is length-prefixed BSON frames over a Unix socket. Every
+request carries an id, so clients pipeline requests on one connection and
+match responses as they arrive. RemoteDB/RemoteCollection implement the
+same async collection interface as InMemoryDB and Motor.
+
+A client can also watch a collection: the server then pushes every write
+to it over the same connection, in the format of MongoDB change stream
+events, so workers can keep in-process indexes current.
+"""
+import os
+import time
+import struct
+import asyncio
+import logging
+import argparse
+import itertools
+from collections import OrderedDict
+import bson
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
+from bson.regex import Regex
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/tmp/mediconnect-data.sock"
+# Documents returned per find/getMore round trip, like MongoDB's default first batch
+DEFAULT_BATCH_SIZE = 101
+# Open cursors a connection may hold; past this the least recently used is closed
+MAX_CURSORS_PER_CONNECTION = 1000
+# Cursors left unread this long are closed, like MongoDB's 10 minute cursor timeout
+CURSOR_TIMEOUT_SECONDS = 600
+# insert_many payloads are split so no frame gets near BSON's 16MB limit
+INSERT_CHUNK_SIZE = 1000
+
+_FRAME_HEADER = struct.Struct("<I")
+
+class _RegexDecoder(TypeDecoder):
+    # Compiled patterns cross the socket as BSON regexes; turn them back so filters behave as in-process
+    bson_type = Regex
+
+    def transform_bson(self, value):
+        return value.try_compile()
+
+_CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry([_RegexDecoder()]))
+
+# Collection methods a client may call; anything else is rejected
+_COLLECTION_OPS = {
+    "insert_one", "insert_many", "find_one", "count_documents", "estimated_document_count",
+    "update_one", "update_many", "replace_one", "find_one_and_update",
+    "delete_one", "delete_many", "bulk_write", "create_index",
+}
+
+# Bulk write operations travel as plain documents: {"t": type, "filter", "doc", "upsert"}
+WRITE_OPS = {"InsertOne", "UpdateOne", "UpdateMany", "ReplaceOne", "DeleteOne", "DeleteMany"}
+
+def write_operation(request):
+    """A bulk write operation (pymongo InsertOne, UpdateOne, ... or its plain document form) as a plain document"""
+    if isinstance(request, dict):
+        kind = request.get("t")
+        operation = request
+    else:
+        # pymongo has no public accessors for an operation's contents; this is the one place that reads them
+        kind = type(request).__name__
+        for option in ("_collation", "_hint", "_array_filters", "_sort"):
+            if getattr(request, option, None) is not None:
+                raise NotImplementedError(f"{kind} with {option.lstrip('_')} is not supported")
+        operation = {
+            "t": kind,
+            "filter": getattr(request, "_filter", None),
+            "doc": getattr(request, "_doc", None),
+            "upsert": bool(getattr(request, "_upsert", False)),
+        }
+    if kind not in WRITE_OPS:
+        raise TypeError(f"{kind} is not a supported bulk write operation")
+    return operation
+
+def _result_to_dict(result):
+    """Flatten Motor-style result objects into the raw fields they were built from"""
+    if isinstance(result, (UpdateResult, DeleteResult)):
+        return result.raw_result
+    if isinstance(result, BulkWriteResult):
+        return result.bulk_api_result
+    if isinstance(result, InsertOneResult):
+        return {"inserted_id": result.inserted_id}
+    if isinstance(result, InsertManyResult):
+        return {"inserted_ids": result.inserted_ids}
+    if hasattr(result, "keys"):
+        return dict(result)
+    return result
+
+async def _read_frame(reader):
+    header = await reader.readexactly(_FRAME_HEADER.size)
+    (length,) = _FRAME_HEADER.unpack(header)
+    return bson.decode(await reader.readexactly(length), codec_options=_CODEC_OPTIONS)
+
+def _encode_frame(message):
+    payload = bson.encode(message)
+    return _FRAME_HEADER.pack(len(payload)) + payload
+
+class DataServer:
+    def __init__(self, db, socket_path=DEFAULT_SOCKET, batch_size=DEFAULT_BATCH_SIZE,
+                 max_cursors=MAX_CURSORS_PER_CONNECTION, cursor_timeout=CURSOR_TIMEOUT_SECONDS):
+        self.db = db
+        self.socket_path = socket_path
+        self.batch_size = batch_size
+        self.max_cursors = max_cursors
+        self.cursor_timeout = cursor_timeout
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = await asyncio.start_unix_server(self._handle_connection, path=self.socket_path)
+        # Only the user running the server (and the API workers) may connect
+        os.chmod(self.socket_path, 0o600)
+        logger.info(f"Data server listening on {self.socket_path}")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def _handle_connection(self, reader, writer):
+        # cursor id -> (generator, batch size, last used), least recently used first
+        cursors = OrderedDict()
+        cursor_ids = itertools.count(1)
+        # watch request id -> (collection, listener)
+        watches = {}
+        try:
+            while True:
+                try:
+                    request = await _read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                writer.write(_encode_frame(await self._dispatch(request, cursors, cursor_ids, watches, writer)))
+                # drain() only blocks when the client stops reading, so pipelined requests keep flowing
+                await writer.drain()
+        except ConnectionResetError:
+            pass
+        finally:
+            for watch_id in list(watches):
+                self._unwatch(watch_id, watches)
+            writer.close()
+
+    async def _dispatch(self, request, cursors, cursor_ids, watches, writer):
+        request_id = request.get("i")
+        try:
+            op = request["o"]
+            if op == "ping":
+                result = 1
+            elif op == "find":
+                result = self._open_cursor(request, cursors, cursor_ids)
+            elif op == "getMore":
+                result = self._next_batch(request["cursor"], cursors)
+            elif op == "killCursors":
+                cursors.pop(request["cursor"], None)
+                result = None
+            elif op == "watch":
+                result = self._watch(request, watches, writer)
+            elif op == "unwatch":
+                self._unwatch(request["watch"], watches)
+                result = None
+            elif op in _COLLECTION_OPS:
+                collection = self.db[request["c"]]
+                args = request.get("a", [])
+                result = _result_to_dict(await getattr(collection, op)(*args))
+            else:
+                raise OperationFailure(f"Unsupported operation: {op}")
+            return {"i": request_id, "ok": 1, "r": result}
+        except DuplicateKeyError as e:
+            return {"i": request_id, "ok": 0, "code": 11000, "err": str(e)}
+        except BulkWriteError as e:
+            return {"i": request_id, "ok": 0, "code": 65, "err": str(e), "details": e.details}
+        except Exception as e:
+            logger.error(f"Data server request failed: {e}")
+            return {"i": request_id, "ok": 0, "code": 0, "err": str(e)}
+
+    def _open_cursor(self, request, cursors, cursor_ids):
+        cursor = self.db[request["c"]].find(request.get("filter") or {}, request.get("projection"))
+        if request.get("sort"):
+            cursor.sort([tuple(pair) for pair in request["sort"]])
+        if request.get("skip"):
+            cursor.skip(request["skip"])
+        if request.get("limit"):
+            cursor.limit(request["limit"])
+        self._expire_cursors(cursors)
+        cursor_id = next(cursor_ids)
+        cursors[cursor_id] = (cursor._generate(), request.get("batch_size") or self.batch_size, time.monotonic())
+        return self._next_batch(cursor_id, cursors)
+
+    def _next_batch(self, cursor_id, cursors):
+        if cursor_id not in cursors:
+            raise OperationFailure(f"Cursor {cursor_id} not found; it was exhausted, killed or timed out")
+        generator, batch_size, _ = cursors.pop(cursor_id)
+        batch = list(itertools.islice(generator, batch_size))
+        if len(batch) < batch_size:
+            cursor_id = 0
+        else:
+            cursors[cursor_id] = (generator, batch_size, time.monotonic())
+        return {"batch": batch, "cursor": cursor_id}
+
+    def _watch(self, request, watches, writer):
+        # Changes are sent under the watch request's id, after its reply: nothing awaits between
+        # registering the listener and _handle_connection writing the reply
+        watch_id = request["i"]
+        collection = self.db[request["c"]]
+
+        def listener(puts, deletes):
+            if writer.is_closing():
+                return
+            changes = [{"operationType": "delete", "documentKey": {"_id": doc_id}} for doc_id in deletes]
+            changes += [{"operationType": "replace", "documentKey": {"_id": doc_id}, "fullDocument": doc}
+                        for doc_id, doc in puts]
+            writer.write(_encode_frame({"i": watch_id, "ok": 1, "changes": changes}))
+
+        collection.listeners.append(listener)
+        watches[watch_id] = (collection, listener)
+        return watch_id
+
+    def _unwatch(self, watch_id, watches):
+        collection, listener = watches.pop(watch_id, (None, None))
+        if collection is not None:
+            collection.listeners.remove(listener)
+
+    def _expire_cursors(self, cursors):
+        # Clients that stop reading without killCursors would otherwise pin their results forever
+        deadline = time.monotonic() - self.cursor_timeout
+        while cursors:
+            cursor_id, (_, _, last_used) = next(iter(cursors.items()))
+            if last_used > deadline and len(cursors) < self.max_cursors:
+                break
+            del cursors[cursor_id]
+
+class RemoteDB:
+    """Client for DataServer with the same attribute/item access as InMemoryDB"""
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        self.socket_path = socket_path
+        self.collections = {}
+        self._reader = None
+        self._writer = None
+        self._pending = {}
+        # watch request id -> queue of change frames (or the error that ended the stream)
+        self._streams = {}
+        self._request_ids = itertools.count(1)
+        self._connect_lock = None
+        self._receiver = None
+
+    def __getitem__(self, collection_name):
+        if collection_name not in self.collections:
+            self.collections[collection_name] = RemoteCollection(self, collection_name)
+        return self.collections[collection_name]
+
+    def __getattr__(self, collection_name):
+        if collection_name.startswith("_"):
+            raise AttributeError(collection_name)
+        return self.__getitem__(collection_name)
+
+    async def _connect(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+                self._receiver = asyncio.ensure_future(self._receive())
+
+    async def _receive(self):
+        try:
+            while True:
+                response = await _read_frame(self._reader)
+                future = self._pending.pop(response.get("i"), None)
+                if future is not None:
+                    if not future.done():
+                        future.set_result(response)
+                elif response.get("i") in self._streams:
+                    self._streams[response["i"]].put_nowait(response)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            error = ConnectionError(f"Lost connection to data server: {e}")
+        except asyncio.CancelledError:
+            error = ConnectionError("Data server connection closed")
+        self._writer = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+        for queue in self._streams.values():
+            queue.put_nowait(error)
+        self._streams.clear()
+
+    async def request(self, message, stream=None):
+        """Send a request and wait for its response; `stream` is a queue for the frames that follow it"""
+        if self._writer is None or self._writer.is_closing():
+            await self._connect()
+        request_id = next(self._request_ids)
+        message["i"] = request_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        if stream is not None:
+            self._streams[request_id] = stream
+        # No await between write and waiting on the future, so requests from
+        # concurrent tasks pipeline on the socket instead of queueing behind each other
+        self._writer.write(_encode_frame(message))
+        try:
+            response = await future
+        except BaseException:
+            self._streams.pop(request_id, None)
+            raise
+        if not response.get("ok"):
+            self._streams.pop(request_id, None)
+            if response.get("code") == 11000:
+                raise DuplicateKeyError(response.get("err"))
+            if response.get("code") == 65:
+                raise BulkWriteError(response.get("details"))
+            raise OperationFailure(response.get("err"))
+        return response.get("r")
+
+    def send(self, message):
+        """Send a request without waiting for (or checking) its response"""
+        if self._writer is None or self._writer.is_closing():
+            return
+        message["i"] = next(self._request_ids)
+        self._writer.write(_encode_frame(message))
+
+    async def ping(self):
+        return await self.request({"o": "ping"})
+
+    def close(self):
+        if self._receiver is not None:
+            self._receiver.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+class RemoteCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    async def _call(self, op, *args):
+        return await self.db.request({"o": op, "c": self.name, "a": list(args)})
+
+    async def insert_one(self, document):
+        result = await self._call("insert_one", document)
+        document["_id"] = result["inserted_id"]
+        return InsertOneResult(result["inserted_id"], True)
+
+    async def insert_many(self, documents):
+        documents = list(documents)
+        inserted_ids = []
+        for start in range(0, len(documents), INSERT_CHUNK_SIZE):
+            chunk = documents[start:start + INSERT_CHUNK_SIZE]
+            result = await self._call("insert_many", chunk)
+            for document, doc_id in zip(chunk, result["inserted_ids"]):
+                document["_id"] = doc_id
+            inserted_ids.extend(result["inserted_ids"])
+        return InsertManyResult(inserted_ids, True)
+
+    async def find_one(self, filter_dict, projection=None):
+        return await self._call("find_one", filter_dict, projection)
+
+    def find(self, filter_dict=None, projection=None):
+        return RemoteCursor(self, filter_dict or {}, projection)
+
+    async def count_documents(self, filter_dict=None):
+        return await self._call("count_documents", filter_dict)
+
+    async def estimated_document_count(self):
+        return await self._call("estimated_document_count")
+
+    async def update_one(self, filter_dict, update_dict, upsert=False):
+        return UpdateResult(await self._call("update_one", filter_dict, update_dict, upsert), True)
+
+    async def update_many(self, filter_dict, update_dict, upsert=False):
+        return UpdateResult(await self._call("update_many", filter_dict, update_dict, upsert), True)
+
+    async def replace_one(self, filter_dict, replacement, upsert=False):
+        return UpdateResult(await self._call("replace_one", filter_dict, replacement, upsert), True)
+
+    async def find_one_and_update(self, filter_dict, update_dict, projection=None, sort=None,
+                                  upsert=False, return_document=ReturnDocument.BEFORE):
+        if sort is not None:
+            sort = [list(pair) for pair in sort]
+        return await self._call("find_one_and_update", filter_dict, update_dict, projection, sort,
+                                upsert, bool(return_document))
+
+    async def delete_one(self, filter_dict):
+        return DeleteResult(await self._call("delete_one", filter_dict), True)
+
+    async def delete_many(self, filter_dict):
+        return DeleteResult(await self._call("delete_many", filter_dict), True)
+
+    async def bulk_write(self, requests, ordered=True):
+        writes = [write_operation(request) for request in requests]
+        return BulkWriteResult(await self._call("bulk_write", writes, ordered), True)
+
+    async def create_index(self, keys, unique=False, **kwargs):
+        if isinstance(keys, (list, tuple)):
+            keys = [list(pair) for pair in keys]
+        return await self._call("create_index", keys, unique)
+
+    def watch(self, pipeline=None, full_document=None, **kwargs):
+        """Stream of this collection's writes; events always carry the full document, as with updateLookup"""
+        return RemoteChangeStream(self)
+
+class RemoteChangeStream:
+    """Change events pushed by the DataServer, mirroring AsyncIOMotorChangeStream"""
+    def __init__(self, collection):
+        self.collection = collection
+        self._queue = None
+        self._watch_id = None
+        self._buffer = []
+
+    async def open(self):
+        """Start receiving changes; writes made after this returns are all delivered"""
+        if self._watch_id is None:
+            self._queue = asyncio.Queue()
+            self._watch_id = await self.collection.db.request({"o": "watch", "c": self.collection.name},
+                                                              stream=self._queue)
+        return self
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._watch_id is None:
+            raise StopAsyncIteration
+        while not self._buffer:
+            frame = await self._queue.get()
+            if isinstance(frame, Exception):
+                self._watch_id = None
+                raise frame
+            self._buffer = list(reversed(frame["changes"]))
+        return self._buffer.pop()
+
+    async def close(self):
+        if self._watch_id is not None:
+            watch_id, self._watch_id = self._watch_id, None
+            self.collection.db._streams.pop(watch_id, None)
+            self.collection.db.send({"o": "unwatch", "watch": watch_id})
+
+class RemoteCursor:
+    """Batching cursor over a DataServer find, mirroring AsyncIOMotorCursor"""
+    def __init__(self, collection, filter_dict, projection=None):
+        self.collection = collection
+        self.filter_dict = filter_dict
+        self.projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._batch_size = 0
+        self._buffer = None
+        self._cursor_id = None
+
+    def _check_not_started(self):
+        if self._buffer is not None:
+            raise RuntimeError("Cannot modify a cursor after iteration has started")
+
+    def sort(self, key_or_list, direction=None):
+        self._check_not_started()
+        if isinstance(key_or_list, str):
+            self._sort = [[key_or_list, direction if direction is not None else 1]]
+        else:
+            self._sort = [list(pair) for pair in key_or_list]
+        return self
+
+    def skip(self, skip):
+        self._check_not_started()
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._check_not_started()
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        self._check_not_started()
+        self._batch_size = batch_size
+        return self
+
+    async def _fetch(self):
+        db = self.collection.db
+        if self._buffer is None:
+            result = await db.request({
+                "o": "find", "c": self.collection.name, "filter": self.filter_dict,
+                "projection": self.projection, "sort": self._sort, "skip": self._skip,
+                "limit": self._limit, "batch_size": self._batch_size,
+            })
+        else:
+            result = await db.request({"o": "getMore", "cursor": self._cursor_id})
+        self._buffer = list(reversed(result["batch"]))
+        self._cursor_id = result["cursor"]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._buffer:
+            if self._buffer is not None and not self._cursor_id:
+                raise StopAsyncIteration
+            await self._fetch()
+            if not self._buffer:
+                raise StopAsyncIteration
+        return self._buffer.pop()
+
+    async def to_list(self, length=None):
+        results = []
+        async for doc in self:
+            results.append(doc)
+            if length and len(results) >= length:
+                await self.close()
+                break
+        return results
+
+    async def close(self):
+        if self._cursor_id:
+            cursor_id, self._cursor_id = self._cursor_id, 0
+            await self.collection.db.request({"o": "killCursors", "cursor": cursor_id})
+
+    def __del__(self):
+        # Dropped before it was read to the end: free the server-side cursor
+        if self._cursor_id:
+            try:
+                self.collection.db.send({"o": "killCursors", "cursor": self._cursor_id})
+            except Exception:
+                pass
+
+def main():
+    from database import InMemoryDB, ensure_indexes
+    from persistence import open_store_from_env
+
+    parser = argparse.ArgumentParser(description="Serve an InMemoryDB to API workers over a Unix socket")
+    parser.add_argument("--socket", default=os.getenv("DATA_SERVER_SOCKET", DEFAULT_SOCKET))
+    args = parser.parse_args()
+
+    async def run():
+        db = InMemoryDB(store=open_store_from_env())
+        await ensure_indexes(db)
+        try:
+            await DataServer(db, args.socket).serve_forever()
+        finally:
+            db.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,9 +1,20 @@
 import os
 import logging
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, monitoring
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
 from dotenv import load_dotenv
 from typing import Dict, List, Any
+from query_engine import compile_filter
+from persistence import open_store_from_env
+from data_server import RemoteDB, write_operation
 import uuid
+import time
+import asyncio
+import heapq
+from functools import cmp_to_key
+from collections.abc import MutableMapping
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,96 +28,870 @@ MONGODB_URI = os.getenv("MONGODB_URI")
 
 DB_NAME = os.getenv("MONGODB_DB", "smartcare")
 
-logger.info(f"Connecting to MongoDB: {MONGODB_URI}")
-logger.info(f"Database name: {DB_NAME}")
-
 # In-memory storage for development
 class InMemoryDB:
-    def __init__(self):
+    def __init__(self, store=None):
         self.collections = {}
+        # Optional persistence.DurableStore that journals every write
+        self.store = store
+        if store is not None:
+            store.open(self)
     
     def __getitem__(self, collection_name):
         if collection_name not in self.collections:
-            self.collections[collection_name] = InMemoryCollection()
+            collection = InMemoryCollection(collection_name, self.store)
+            if self.store is not None:
+                self.store.restore(collection)
+            self.collections[collection_name] = collection
         return self.collections[collection_name]
     
     def __getattr__(self, collection_name):
         # Allow attribute access for collections (e.g., db.users)
         return self.__getitem__(collection_name)
+    
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+class HashIndex:
+    """Equality-lookup index mapping a field value to the ids of matching documents"""
+    def __init__(self, field, unique=False):
+        self.field = field
+        self.unique = unique
+        self.entries = {}
+        # Documents whose value can't be hashed (lists, dicts) are always candidates
+        self.unhashable = set()
+    
+    def add(self, doc_id, doc):
+        value = doc.get(self.field)
+        try:
+            self.entries.setdefault(value, set()).add(doc_id)
+        except TypeError:
+            self.unhashable.add(doc_id)
+    
+    def remove(self, doc_id, doc):
+        value = doc.get(self.field)
+        try:
+            ids = self.entries.get(value)
+        except TypeError:
+            self.unhashable.discard(doc_id)
+            return
+        if ids is not None:
+            ids.discard(doc_id)
+            if not ids:
+                del self.entries[value]
+    
+    def lookup(self, value):
+        """Return the candidate ids for value, or None if value can't be looked up"""
+        try:
+            ids = self.entries.get(value, ())
+        except TypeError:
+            return None
+        if self.unhashable:
+            return set(ids) | self.unhashable
+        return ids
+    
+    def conflicts(self, doc_id, doc):
+        """Check whether doc would violate this index's uniqueness constraint"""
+        if not self.unique:
+            return False
+        try:
+            ids = self.entries.get(doc.get(self.field), ())
+        except TypeError:
+            return False
+        return any(other_id != doc_id for other_id in ids)
+
+class DocumentView(MutableMapping):
+    """Read-only view of a stored document that copies it on the first write
+
+    Reads go straight to the stored dict, so listing documents allocates one
+    small wrapper each instead of a full copy. Routes that rewrite fields
+    (e.g. p["_id"] = str(p["_id"])) get a private copy at that point.
+    """
+    __slots__ = ("_doc", "_owned")
+    
+    def __init__(self, doc):
+        self._doc = doc
+        self._owned = False
+    
+    def _own(self):
+        if not self._owned:
+            self._doc = self._doc.copy()
+            self._owned = True
+        return self._doc
+    
+    def __getitem__(self, key):
+        return self._doc[key]
+    
+    def get(self, key, default=None):
+        return self._doc.get(key, default)
+    
+    def __contains__(self, key):
+        return key in self._doc
+    
+    def __iter__(self):
+        return iter(self._doc)
+    
+    def __len__(self):
+        return len(self._doc)
+    
+    def keys(self):
+        return self._doc.keys()
+    
+    def items(self):
+        return self._doc.items()
+    
+    def values(self):
+        return self._doc.values()
+    
+    def __setitem__(self, key, value):
+        self._own()[key] = value
+    
+    def __delitem__(self, key):
+        del self._own()[key]
+    
+    def copy(self):
+        return self._doc.copy()
+    
+    def __eq__(self, other):
+        if isinstance(other, DocumentView):
+            other = other._doc
+        return self._doc == other
+    
+    def __repr__(self):
+        return repr(self._doc)
+
+def _apply_projection(doc, projection):
+    """Return a view of doc, or a copy limited to the fields selected by a Mongo-style projection"""
+    if not projection:
+        return DocumentView(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and any(fields.values()):
+        result = {k: doc[k] for k, v in fields.items() if v and k in doc}
+        if include_id and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    result = {k: v for k, v in doc.items() if k not in fields}
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+def _compare_values(a, b):
+    # Missing/None values sort before everything else, like MongoDB
+    if a is None or b is None:
+        return (a is not None) - (b is not None)
+    try:
+        return (a > b) - (a < b)
+    except TypeError:
+        return (str(type(a)) > str(type(b))) - (str(type(a)) < str(type(b)))
+
+class InMemoryCursor:
+    """Lazy cursor mirroring the parts of Motor's AsyncIOMotorCursor the routes use"""
+    def __init__(self, collection, filter_dict, projection=None):
+        self.collection = collection
+        self.filter_dict = filter_dict
+        self.projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._iterator = None
+    
+    def _check_not_started(self):
+        if self._iterator is not None:
+            raise RuntimeError("Cannot modify a cursor after iteration has started")
+    
+    def sort(self, key_or_list, direction=None):
+        self._check_not_started()
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction if direction is not None else 1)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+    
+    def skip(self, skip):
+        self._check_not_started()
+        self._skip = skip
+        return self
+    
+    def limit(self, limit):
+        self._check_not_started()
+        self._limit = limit
+        return self
+    
+    def _sort_cmp(self, a, b):
+        for field, direction in self._sort:
+            result = _compare_values(a.get(field), b.get(field))
+            if result:
+                return result if direction >= 0 else -result
+        return 0
+    
+    def _generate(self):
+        matches = (doc for doc_id, doc in self.collection._matching(self.filter_dict))
+        if self._sort:
+            key = cmp_to_key(self._sort_cmp)
+            if self._limit:
+                # Only keep the documents that can make it past skip + limit
+                matches = heapq.nsmallest(self._skip + self._limit, matches, key=key)
+            else:
+                matches = sorted(matches, key=key)
+        produced = 0
+        skipped = 0
+        for doc in matches:
+            if skipped < self._skip:
+                skipped += 1
+                continue
+            if self._limit and produced >= self._limit:
+                return
+            produced += 1
+            yield _apply_projection(doc, self.projection)
+    
+    def __aiter__(self):
+        return self
+    
+    async def __anext__(self):
+        if self._iterator is None:
+            self._iterator = self._generate()
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+    
+    async def to_list(self, length=None):
+        results = []
+        async for doc in self:
+            results.append(doc)
+            if length and len(results) >= length:
+                break
+        return results
+
+# Marks a document the batch hasn't touched, as opposed to one it deleted (None)
+_UNSTAGED = object()
+
+class WriteBatch:
+    """Writes staged against a collection: later operations see earlier ones, and nothing is applied until commit()"""
+    def __init__(self, collection):
+        self.collection = collection
+        # doc_id -> new document, or None once deleted
+        self.staged = {}
+        # (doc_id, what was staged before), so a failed operation can be undone
+        self.journal = []
+        # Unique field -> value -> staged ids that have held it
+        self.unique_values = {field: {} for field, index in collection.indexes.items() if index.unique}
+    
+    def get(self, doc_id):
+        if doc_id in self.staged:
+            return self.staged[doc_id]
+        return self.collection.documents.get(doc_id)
+    
+    def put(self, doc_id, doc):
+        self.journal.append((doc_id, self.staged.get(doc_id, _UNSTAGED)))
+        self.staged[doc_id] = doc
+        for field, values in self.unique_values.items():
+            try:
+                values.setdefault(doc.get(field), set()).add(doc_id)
+            except TypeError:
+                pass
+    
+    def delete(self, doc_id):
+        self.journal.append((doc_id, self.staged.get(doc_id, _UNSTAGED)))
+        self.staged[doc_id] = None
+    
+    def checkpoint(self):
+        return len(self.journal)
+    
+    def rollback(self, checkpoint):
+        while len(self.journal) > checkpoint:
+            doc_id, previous = self.journal.pop()
+            if previous is _UNSTAGED:
+                del self.staged[doc_id]
+            else:
+                self.staged[doc_id] = previous
+    
+    def check_unique(self, checkpoint):
+        """Raise DuplicateKeyError if a document staged since checkpoint shares a unique value with another"""
+        for doc_id in {doc_id for doc_id, previous in self.journal[checkpoint:]}:
+            doc = self.staged[doc_id]
+            if doc is None:
+                continue
+            for field, values in self.unique_values.items():
+                value = doc.get(field)
+                try:
+                    owners = set(self.collection.indexes[field].entries.get(value, ()))
+                    owners.update(values.get(value, ()))
+                except TypeError:
+                    continue
+                for other_id in owners:
+                    other = self.get(other_id) if other_id != doc_id else None
+                    if other is not None and other.get(field) == value:
+                        raise DuplicateKeyError(f"E11000 duplicate key error index: {field}_1 dup key: {{ {field}: {value!r} }}")
+    
+    def commit(self):
+        documents = self.collection.documents
+        puts = [(doc_id, doc) for doc_id, doc in self.staged.items() if doc is not None]
+        deletes = [doc_id for doc_id, doc in self.staged.items() if doc is None and doc_id in documents]
+        self.collection._commit(puts=puts, deletes=deletes)
 
 class InMemoryCollection:
-    def __init__(self):
+    def __init__(self, name=None, store=None):
+        self.name = name
+        self.store = store
         self.documents = {}
+        self.indexes = {}
+        # Callables notified with (puts, deletes) after every committed write
+        self.listeners = []
+    
+    async def create_index(self, keys, unique=False, **kwargs):
+        # Accept both "field" and Motor's [("field", 1)] form
+        if isinstance(keys, (list, tuple)):
+            if len(keys) != 1:
+                raise NotImplementedError("In-memory storage only supports single-field indexes")
+            keys = keys[0][0]
+        field = keys
+        name = kwargs.get("name", f"{field}_1")
+        if field == "_id" or field in self.indexes:
+            return name
+        self._build_index(field, unique)
+        self._log("index", field, unique)
+        return name
+    
+    def _build_index(self, field, unique=False):
+        index = HashIndex(field, unique=unique)
+        for doc_id, doc in self.documents.items():
+            if index.conflicts(doc_id, doc):
+                raise DuplicateKeyError(f"E11000 duplicate key error index: {field}_1 dup key: {{ {field}: {doc.get(field)!r} }}")
+            index.add(doc_id, doc)
+        self.indexes[field] = index
+    
+    def _log(self, op, *args):
+        if self.store is not None:
+            self.store.log(self.name, op, *args)
+    
+    def _commit(self, puts=(), deletes=()):
+        """Apply a batch of writes: validate unique indexes for the whole batch, then touch each index once
+        
+        puts is a list of (doc_id, new_document) and deletes a list of doc ids.
+        """
+        touched = {doc_id for doc_id, doc in puts}
+        touched.update(deletes)
+        for field, index in self.indexes.items():
+            if not index.unique:
+                continue
+            seen = {}
+            for doc_id, doc in puts:
+                value = doc.get(field)
+                try:
+                    owners = index.entries.get(value, ())
+                except TypeError:
+                    continue
+                if seen.get(value, doc_id) != doc_id or any(other not in touched for other in owners):
+                    raise DuplicateKeyError(f"E11000 duplicate key error index: {field}_1 dup key: {{ {field}: {value!r} }}")
+                seen[value] = doc_id
+        for field, index in self.indexes.items():
+            for doc_id, doc in puts:
+                old = self.documents.get(doc_id)
+                if old is not None:
+                    if field in old and field in doc and old[field] is doc[field]:
+                        continue
+                    index.remove(doc_id, old)
+                index.add(doc_id, doc)
+            for doc_id in deletes:
+                if doc_id in self.documents:
+                    index.remove(doc_id, self.documents[doc_id])
+        for doc_id, doc in puts:
+            self.documents[doc_id] = doc
+        for doc_id in deletes:
+            self.documents.pop(doc_id, None)
+        if puts or deletes:
+            self._log("write", list(puts), list(deletes))
+            for listener in self.listeners:
+                listener(puts, deletes)
+    
+    def _stage_insert(self, document, batch=None):
+        # Keep a caller-supplied _id like MongoDB does, otherwise generate one
+        if "_id" not in document:
+            document["_id"] = str(uuid.uuid4())
+        doc_id = document["_id"]
+        if (doc_id in self.documents) if batch is None else (batch.get(doc_id) is not None):
+            raise DuplicateKeyError(f"E11000 duplicate key error index: _id_ dup key: {{ _id: {doc_id!r} }}")
+        return doc_id, dict(document)
+    
+    def _candidates(self, query):
+        """Narrow down the documents to check using _id or a secondary index"""
+        best = None
+        for field, values in query.index_keys.items():
+            if field == "_id":
+                try:
+                    ids = [value for value in values if value in self.documents]
+                except TypeError:
+                    continue
+            else:
+                index = self.indexes.get(field)
+                if index is None:
+                    continue
+                ids = set()
+                for value in values:
+                    found = index.lookup(value)
+                    if found is None:
+                        ids = None
+                        break
+                    ids.update(found)
+                if ids is None:
+                    continue
+            if best is None or len(ids) < len(best):
+                best = ids
+        if best is None:
+            return self.documents.keys()
+        return best
+    
+    def _matching(self, filter_dict, batch=None):
+        query = compile_filter(filter_dict)
+        doc_ids = list(self._candidates(query))
+        get = self.documents.get
+        if batch is not None and batch.staged:
+            # The indexes don't reflect staged writes yet, so staged documents are always checked
+            listed = set(doc_ids)
+            doc_ids.extend(doc_id for doc_id in batch.staged if doc_id not in listed)
+            get = batch.get
+        for doc_id in doc_ids:
+            doc = get(doc_id)
+            if doc is not None and query.matches(doc):
+                yield doc_id, doc
     
     async def insert_one(self, document):
-        doc_id = str(uuid.uuid4())
-        document["_id"] = doc_id
-        self.documents[doc_id] = document.copy()
-        return type('InsertResult', (), {'inserted_id': doc_id})()
+        doc_id, stored = self._stage_insert(document)
+        self._commit(puts=[(doc_id, stored)])
+        return InsertOneResult(doc_id, True)
     
     async def insert_many(self, documents):
-        inserted_ids = []
+        puts = []
+        staged_ids = set()
         for document in documents:
-            doc_id = str(uuid.uuid4())
-            document["_id"] = doc_id
-            self.documents[doc_id] = document.copy()
-            inserted_ids.append(doc_id)
-        return type('InsertManyResult', (), {'inserted_ids': inserted_ids})()
+            doc_id, stored = self._stage_insert(document)
+            if doc_id in staged_ids:
+                raise DuplicateKeyError(f"E11000 duplicate key error index: _id_ dup key: {{ _id: {doc_id!r} }}")
+            staged_ids.add(doc_id)
+            puts.append((doc_id, stored))
+        self._commit(puts=puts)
+        return InsertManyResult([doc_id for doc_id, doc in puts], True)
     
-    async def find_one(self, filter_dict):
-        for doc_id, doc in self.documents.items():
-            if all(doc.get(k) == v for k, v in filter_dict.items()):
-                return doc.copy()
+    async def find_one(self, filter_dict, projection=None):
+        for doc_id, doc in self._matching(filter_dict):
+            return _apply_projection(doc, projection)
         return None
     
-    async def find(self, filter_dict=None):
-        if filter_dict is None:
-            return list(self.documents.values())
-        results = []
-        for doc in self.documents.values():
-            if all(doc.get(k) == v for k, v in filter_dict.items()):
-                results.append(doc.copy())
-        return results
+    def find(self, filter_dict=None, projection=None):
+        # Like Motor, find() returns a cursor right away; documents are produced while iterating
+        return InMemoryCursor(self, filter_dict or {}, projection)
+    
+    async def estimated_document_count(self):
+        return len(self.documents)
     
     async def count_documents(self, filter_dict=None):
         if filter_dict is None:
             return len(self.documents)
         count = 0
-        for doc in self.documents.values():
-            if all(doc.get(k) == v for k, v in filter_dict.items()):
-                count += 1
+        for doc_id, doc in self._matching(filter_dict):
+            count += 1
         return count
     
-    async def update_one(self, filter_dict, update_dict):
-        for doc_id, doc in self.documents.items():
-            if all(doc.get(k) == v for k, v in filter_dict.items()):
-                # Handle $set operations
-                if "$set" in update_dict:
-                    for key, value in update_dict["$set"].items():
-                        doc[key] = value
-                else:
-                    # Direct update
-                    doc.update(update_dict)
-                self.documents[doc_id] = doc
-                return type('UpdateResult', (), {'modified_count': 1})()
-        return type('UpdateResult', (), {'modified_count': 0})()
+    def _update(self, filter_dict, update_dict, upsert=False, multi=False, replace=False, batch=None):
+        """Shared implementation of the update/replace family; returns (matched, modified, upserted_id, before, after)
+        
+        With a batch the writes are staged in it; otherwise they are committed right away.
+        """
+        puts = []
+        matched = 0
+        before = after = None
+        for doc_id, doc in self._matching(filter_dict, batch):
+            matched += 1
+            if replace:
+                updated = _replacement(doc_id, update_dict)
+            else:
+                updated = _apply_update(doc, update_dict)
+            if before is None:
+                before, after = doc, updated
+            if updated != doc:
+                puts.append((doc_id, updated))
+            if not multi:
+                break
+        upserted_id = None
+        if not matched and upsert:
+            seed = _upsert_seed(filter_dict)
+            if replace:
+                new_doc = _replacement(seed.get("_id"), update_dict)
+                if new_doc["_id"] is None:
+                    del new_doc["_id"]
+            else:
+                new_doc = _apply_update(seed, update_dict, inserting=True)
+            upserted_id, new_doc = self._stage_insert(new_doc, batch)
+            puts.append((upserted_id, new_doc))
+            after = new_doc
+        if batch is None:
+            self._commit(puts=puts)
+        else:
+            for doc_id, doc in puts:
+                batch.put(doc_id, doc)
+        return matched, len(puts) - (upserted_id is not None), upserted_id, before, after
+    
+    @staticmethod
+    def _update_result(matched, modified, upserted_id):
+        raw = {"n": matched + (upserted_id is not None), "nModified": modified}
+        if upserted_id is not None:
+            raw["upserted"] = upserted_id
+        return UpdateResult(raw, True)
+    
+    async def update_one(self, filter_dict, update_dict, upsert=False):
+        matched, modified, upserted_id, before, after = self._update(filter_dict, update_dict, upsert=upsert)
+        return self._update_result(matched, modified, upserted_id)
+    
+    async def update_many(self, filter_dict, update_dict, upsert=False):
+        matched, modified, upserted_id, before, after = self._update(filter_dict, update_dict, upsert=upsert, multi=True)
+        return self._update_result(matched, modified, upserted_id)
+    
+    async def replace_one(self, filter_dict, replacement, upsert=False):
+        matched, modified, upserted_id, before, after = self._update(filter_dict, replacement, upsert=upsert, replace=True)
+        return self._update_result(matched, modified, upserted_id)
+    
+    async def find_one_and_update(self, filter_dict, update_dict, projection=None, sort=None,
+                                  upsert=False, return_document=ReturnDocument.BEFORE):
+        if sort:
+            # Resolve which document comes first, then update exactly that one
+            first = await InMemoryCursor(self, filter_dict).sort(sort).limit(1).to_list(1)
+            if first:
+                filter_dict = {"_id": first[0]["_id"]}
+        matched, modified, upserted_id, before, after = self._update(filter_dict, update_dict, upsert=upsert)
+        doc = after if return_document == ReturnDocument.AFTER else before
+        return None if doc is None else _apply_projection(doc, projection)
     
     async def delete_one(self, filter_dict):
-        for doc_id, doc in self.documents.items():
-            if all(doc.get(k) == v for k, v in filter_dict.items()):
-                del self.documents[doc_id]
-                return type('DeleteResult', (), {'deleted_count': 1})()
-        return type('DeleteResult', (), {'deleted_count': 0})()
-
-try:
-    client = AsyncIOMotorClient(MONGODB_URI)
-    # Test the connection
-    client.admin.command('ping')
-    logger.info("Successfully connected to MongoDB")
-    db = client[DB_NAME]
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB: {e}")
-    logger.info("Using in-memory storage for development")
-    # For development, we'll use a simple in-memory storage
-    client = None
-    db = InMemoryDB() 
\ No newline at end of file
+        for doc_id, doc in self._matching(filter_dict):
+            self._commit(deletes=[doc_id])
+            return DeleteResult({"n": 1}, True)
+        return DeleteResult({"n": 0}, True)
+    
+    async def delete_many(self, filter_dict):
+        if not filter_dict:
+            # Clearing the collection: drop everything and keep empty indexes
+            deleted_ids = list(self.documents)
+            deleted = len(deleted_ids)
+            self.documents = {}
+            for field, index in list(self.indexes.items()):
+                self.indexes[field] = HashIndex(field, unique=index.unique)
+            self._log("clear")
+            for listener in self.listeners:
+                listener([], deleted_ids)
+            return DeleteResult({"n": deleted}, True)
+        deletes = [doc_id for doc_id, doc in self._matching(filter_dict)]
+        self._commit(deletes=deletes)
+        return DeleteResult({"n": len(deletes)}, True)
+    
+    async def bulk_write(self, requests, ordered=True):
+        """Run pymongo write operations (InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany)
+        
+        The whole batch is staged first, each operation seeing the ones before it, and committed at
+        once: one index pass, one WAL record and one listener call. An operation that fails is left
+        out; when ordered, the ones after it are too.
+        """
+        operations = [write_operation(request) for request in requests]
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0, "nUpserted": 0,
+                  "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        batch = WriteBatch(self)
+        for position, operation in enumerate(operations):
+            kind, op_filter, op_doc = operation["t"], operation.get("filter"), operation.get("doc")
+            checkpoint = batch.checkpoint()
+            try:
+                if kind == "InsertOne":
+                    doc_id, stored = self._stage_insert(op_doc, batch)
+                    batch.put(doc_id, stored)
+                    batch.check_unique(checkpoint)
+                    result["nInserted"] += 1
+                    continue
+                if kind in ("DeleteOne", "DeleteMany"):
+                    for doc_id, doc in self._matching(op_filter, batch):
+                        batch.delete(doc_id)
+                        result["nRemoved"] += 1
+                        if kind == "DeleteOne":
+                            break
+                    continue
+                matched, modified, upserted_id, before, after = self._update(
+                    op_filter, op_doc, upsert=bool(operation.get("upsert")), multi=kind == "UpdateMany",
+                    replace=kind == "ReplaceOne", batch=batch)
+                batch.check_unique(checkpoint)
+                result["nMatched"] += matched
+                result["nModified"] += modified
+                if upserted_id is not None:
+                    result["nUpserted"] += 1
+                    result["upserted"].append({"index": position, "_id": upserted_id})
+            except DuplicateKeyError as e:
+                batch.rollback(checkpoint)
+                result["writeErrors"].append({"index": position, "code": 11000, "errmsg": str(e), "op": op_doc or op_filter})
+                if ordered:
+                    break
+        batch.commit()
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+def _set_path(doc, path, value):
+    """Set a dotted path on doc, copying nested dicts so stored documents are never mutated"""
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        child = target.get(part)
+        child = dict(child) if isinstance(child, dict) else {}
+        target[part] = child
+        target = child
+    target[parts[-1]] = value
+
+def _get_path(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def _unset_path(doc, path):
+    parts = path.split(".")
+    target = doc
+    for part in parts[:-1]:
+        child = target.get(part)
+        if not isinstance(child, dict):
+            return
+        child = dict(child)
+        target[part] = child
+        target = child
+    target.pop(parts[-1], None)
+
+def _apply_update(doc, update_dict, inserting=False):
+    """Return a new document with a Mongo-style update applied to doc"""
+    updated = dict(doc)
+    if not any(key.startswith("$") for key in update_dict):
+        # Direct update: merge the fields in
+        updated.update(update_dict)
+        return updated
+    for op, fields in update_dict.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            if op in ("$set", "$setOnInsert"):
+                _set_path(updated, path, value)
+            elif op == "$unset":
+                _unset_path(updated, path)
+            elif op == "$inc":
+                _set_path(updated, path, (_get_path(updated, path) or 0) + value)
+            elif op == "$push":
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                _set_path(updated, path, list(_get_path(updated, path) or []) + list(items))
+            elif op == "$addToSet":
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                current = list(_get_path(updated, path) or [])
+                current.extend(item for item in items if item not in current)
+                _set_path(updated, path, current)
+            elif op == "$pull":
+                current = _get_path(updated, path) or []
+                _set_path(updated, path, [item for item in current if item != value])
+            else:
+                raise ValueError(f"Unsupported update operator: {op}")
+    return updated
+
+def _replacement(doc_id, replacement):
+    if any(key.startswith("$") for key in replacement):
+        raise ValueError("Replacement document must not contain update operators")
+    new_doc = dict(replacement)
+    new_doc["_id"] = doc_id
+    return new_doc
+
+def _upsert_seed(filter_dict):
+    """Start an upserted document from the filter's equality conditions"""
+    seed = {}
+    for field, condition in filter_dict.items():
+        if field.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            if "$eq" in condition:
+                _set_path(seed, field, condition["$eq"])
+            continue
+        _set_path(seed, field, condition)
+    return seed
+
+async def ensure_indexes(database):
+    """Create the indexes the routes rely on for their equality lookups"""
+    await database.users.create_index("email", unique=True)
+    await database.bookings.create_index("user_id")
+    await database.bookings.create_index("provider_id")
+    target = database.target if isinstance(database, DatabaseProxy) else database
+    if not isinstance(target, (InMemoryDB, RemoteDB)):
+        # Serves the time range of the booking overlap check (in-memory indexes are single-field)
+        await database.bookings.create_index([("provider_id", 1), ("appointment_time", 1)])
+    await database.intake.create_index("user_id")
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool event counters, reported by /health"""
+    def __init__(self):
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pools_cleared = 0
+    
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        self.pools_cleared += 1
+    
+    def pool_closed(self, event):
+        pass
+    
+    def connection_created(self, event):
+        self.created += 1
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_closed(self, event):
+        self.closed += 1
+    
+    def connection_check_out_started(self, event):
+        pass
+    
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+    
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+        self.checkouts += 1
+    
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+    
+    def snapshot(self):
+        return {
+            "open_connections": self.created - self.closed,
+            "in_use": self.checked_out,
+            "idle": self.created - self.closed - self.checked_out,
+            "connections_created": self.created,
+            "connections_closed": self.closed,
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "pools_cleared": self.pools_cleared,
+        }
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+def mongo_client_settings():
+    """Connection pool settings for AsyncIOMotorClient, tunable through MONGODB_* env vars"""
+    settings = {
+        "maxPoolSize": _env_int("MONGODB_MAX_POOL_SIZE", 100),
+        "minPoolSize": _env_int("MONGODB_MIN_POOL_SIZE", 10),
+        "maxIdleTimeMS": _env_int("MONGODB_MAX_IDLE_TIME_MS", 300000),
+        "connectTimeoutMS": _env_int("MONGODB_CONNECT_TIMEOUT_MS", 10000),
+        "serverSelectionTimeoutMS": _env_int("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 5000),
+        "waitQueueTimeoutMS": _env_int("MONGODB_WAIT_QUEUE_TIMEOUT_MS", 10000),
+    }
+    socket_timeout = _env_int("MONGODB_SOCKET_TIMEOUT_MS", 0)
+    if socket_timeout:
+        settings["socketTimeoutMS"] = socket_timeout
+    compressors = os.getenv("MONGODB_COMPRESSORS", "zlib")
+    if compressors:
+        settings["compressors"] = compressors
+    return settings
+
+class DatabaseProxy:
+    """The db handle routes import at load time; the real backend is bound in the app lifespan"""
+    def __init__(self):
+        self._target = None
+    
+    @property
+    def target(self):
+        if self._target is None:
+            raise RuntimeError("Database is not connected yet; it is bound when the app starts")
+        return self._target
+    
+    def bind(self, target):
+        self._target = target
+    
+    def __getattr__(self, collection_name):
+        return getattr(self.target, collection_name)
+    
+    def __getitem__(self, collection_name):
+        return self.target[collection_name]
+
+# Workers that share a data server (see data_server.py) skip MongoDB entirely
+DATA_SERVER_SOCKET = os.getenv("DATA_SERVER_SOCKET")
+
+db = DatabaseProxy()
+client = None
+backend = None
+pool_stats = PoolStats()
+
+async def connect_database():
+    """Open the database backend: data server, MongoDB (with a warmed pool) or in-memory fallback"""
+    global client, backend
+    if DATA_SERVER_SOCKET:
+        logger.info(f"Using shared data server at {DATA_SERVER_SOCKET}")
+        remote = RemoteDB(DATA_SERVER_SOCKET)
+        await remote.ping()
+        db.bind(remote)
+        backend = "data-server"
+        return db
+    settings = mongo_client_settings()
+    logger.info(f"Connecting to MongoDB: {MONGODB_URI}")
+    logger.info(f"Database name: {DB_NAME}")
+    try:
+        client = AsyncIOMotorClient(MONGODB_URI, event_listeners=[pool_stats], **settings)
+        # Test the connection
+        await client.admin.command('ping')
+        # Warm the pool: concurrent pings each check out their own connection
+        warmup = min(_env_int("MONGODB_WARMUP_CONNECTIONS", settings["minPoolSize"]), settings["maxPoolSize"])
+        if warmup > 1:
+            await asyncio.gather(*[client.admin.command('ping') for _ in range(warmup)])
+        logger.info(f"Successfully connected to MongoDB ({pool_stats.snapshot()['open_connections']} pooled connections)")
+        db.bind(client[DB_NAME])
+        backend = "mongodb"
+    except Exception as e:
+        logger.error(f"Failed to connect to MongoDB: {e}")
+        logger.info("Using in-memory storage for development")
+        if client is not None:
+            client.close()
+        # For development, we'll use a simple in-memory storage
+        client = None
+        db.bind(InMemoryDB(store=open_store_from_env()))
+        backend = "in-memory"
+    return db
+
+async def close_database():
+    global client
+    target = db._target
+    if client is not None:
+        client.close()
+        client = None
+    elif isinstance(target, (InMemoryDB, RemoteDB)):
+        # Flush the in-memory storage write-ahead log / close the data server connection
+        target.close()
+
+async def database_health():
+    """Backend name, a live ping and, for MongoDB, pool statistics"""
+    health = {"database": backend or "not connected"}
+    if backend == "mongodb":
+        start = time.perf_counter()
+        await client.admin.command('ping')
+        health["ping_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        health["pool"] = {**pool_stats.snapshot(),
+                          "max_pool_size": client.options.pool_options.max_pool_size,
+                          "min_pool_size": client.options.pool_options.min_pool_size}
+    elif backend == "data-server":
+        start = time.perf_counter()
+        await db.target.ping()
+        health["ping_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return health
@@ -0,0 +1,111 @@
+"""
+Spatial lookups over provider coordinates.
+
+Points are bucketed into a fixed grid of latitude/longitude cells, so a
+radius query only visits the cells overlapping the circle's bounding box
+instead of every provider.
+"""
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Roughly 11 km per cell at the equator
+CELL_DEGREES = 0.1
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def coordinates(doc):
+    """(lat, lng) of a provider document, or None if it has no usable location"""
+    lat = doc.get("location_lat")
+    lng = doc.get("location_lng")
+    try:
+        lat = float(lat)
+        lng = float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+class GridIndex:
+    def __init__(self, cell_degrees=CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.columns = int(round(360 / cell_degrees))
+        self.rows = int(round(180 / cell_degrees))
+        self.cells = {}
+        self.points = {}
+
+    def __len__(self):
+        return len(self.points)
+
+    def _row(self, lat):
+        return min(int(math.floor((lat + 90) / self.cell_degrees)), self.rows - 1)
+
+    def _column(self, lng):
+        return int(math.floor((lng + 180) / self.cell_degrees)) % self.columns
+
+    def clear(self):
+        self.cells.clear()
+        self.points.clear()
+
+    def add(self, key, lat, lng):
+        self.remove(key)
+        cell = (self._row(lat), self._column(lng))
+        self.cells.setdefault(cell, set()).add(key)
+        self.points[key] = (lat, lng, cell)
+
+    def remove(self, key):
+        point = self.points.pop(key, None)
+        if point is None:
+            return
+        cell = point[2]
+        keys = self.cells[cell]
+        keys.discard(key)
+        if not keys:
+            del self.cells[cell]
+
+    def _cells_in_box(self, lat, lng, radius_km):
+        lat_span = radius_km / KM_PER_DEGREE
+        low_row = self._row(max(-90.0, lat - lat_span))
+        high_row = self._row(min(90.0, lat + lat_span))
+        # A box touching a pole covers every longitude
+        widest_lat = min(90.0, abs(lat) + lat_span)
+        if widest_lat >= 90.0:
+            columns = range(self.columns)
+        else:
+            lng_span = radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest_lat)))
+            if lng_span >= 180:
+                columns = range(self.columns)
+            else:
+                first = self._column(lng - lng_span)
+                count = (self._column(lng + lng_span) - first) % self.columns + 1
+                columns = [(first + i) % self.columns for i in range(count)]
+        for row in range(low_row, high_row + 1):
+            for column in columns:
+                yield row, column
+
+    def within(self, lat, lng, radius_km):
+        """(distance_km, key) pairs within radius_km of a point, nearest first"""
+        results = []
+        box_cells = (radius_km / KM_PER_DEGREE / self.cell_degrees * 2 + 1) ** 2
+        if box_cells > len(self.cells):
+            # Huge radius: walking the occupied cells is cheaper than the bounding box
+            keys = (key for keys in self.cells.values() for key in keys)
+        else:
+            keys = (key for cell in self._cells_in_box(lat, lng, radius_km) for key in self.cells.get(cell, ()))
+        for key in keys:
+            point_lat, point_lng, _ = self.points[key]
+            distance = haversine_km(lat, lng, point_lat, point_lng)
+            if distance <= radius_km:
+                results.append((distance, key))
+        results.sort()
+        return results
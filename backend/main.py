@@ -3,13 +3,49 @@ from fastapi.middleware.cors import CORSMiddleware
 from routes import users, providers, bookings, intake, insurance , ai_gemini
 from email_service import send_email
 from email_templates import EmailTemplate
+from database import connect_database, close_database, database_health, ensure_indexes
+from provider_index import provider_index
+from booking_slots import slot_index
+from match_cache import match_cache
+from user_cache import user_cache
+from token_cache import token_cache
+from password_hashing import password_hasher
+from admission import auth_admission
+from contextlib import asynccontextmanager
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Smart Care Routing API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await password_hasher.start()
+    except Exception as e:
+        logger.error(f"Failed to start password hashing workers: {e}")
+    # Connect (and warm the connection pool) before the first request is served
+    database = await connect_database()
+    try:
+        await ensure_indexes(database)
+    except Exception as e:
+        logger.error(f"Failed to create database indexes: {e}")
+    try:
+        await provider_index.start(database)
+    except Exception as e:
+        logger.error(f"Failed to build provider index: {e}")
+    user_cache.attach(database)
+    try:
+        await slot_index.start(database)
+    except Exception as e:
+        logger.error(f"Failed to build booking slot index: {e}")
+    yield
+    await slot_index.stop()
+    password_hasher.stop()
+    await provider_index.stop()
+    await close_database()
+
+app = FastAPI(title="Smart Care Routing API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -56,20 +92,14 @@ def root():
 async def health_check():
     """Health check endpoint to verify database connectivity"""
     try:
-        from database import db
-        # Try to access the database
-        if hasattr(db, 'users'):
-            return {
-                "status": "healthy",
-                "database": "connected",
-                "message": "Backend and database are working correctly"
-            }
+        health = await database_health()
+        if health["database"] == "in-memory":
+            message = "Backend is running with in-memory storage"
         else:
-            return {
-                "status": "healthy",
-                "database": "in-memory",
-                "message": "Backend is running with in-memory storage"
-            }
+            message = "Backend and database are working correctly"
+        return {"status": "healthy", **health, "match_cache": match_cache.stats(),
+                "user_cache": user_cache.stats(), "token_cache": token_cache.stats(), "password_hashing": password_hasher.stats(),
+                "auth_admission": auth_admission.stats(password_hasher.average_cpu_seconds()), "message": message}
     except Exception as e:
         logger.error(f"Health check failed: {e}")
         return {
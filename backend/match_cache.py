@@ -0,0 +1,77 @@
+"""
+Cache of provider match rankings.
+
+Entries are keyed by the normalized query and tagged with the provider
+index version they were computed against. Any provider write bumps the
+version, which drops the whole cache the next time it is consulted.
+"""
+import os
+import time
+from collections import OrderedDict
+
+MATCH_CACHE_SIZE = int(os.getenv("MATCH_CACHE_SIZE", "1024"))
+MATCH_CACHE_TTL_SECONDS = float(os.getenv("MATCH_CACHE_TTL_SECONDS", "60"))
+
+def query_key(symptoms_list, insurance=None, location=None, urgency=None, limit=3, near=None, radius_km=None):
+    """Cache key for a match query: symptom order, duplicates and letter case don't matter"""
+    return (
+        tuple(sorted(set(symptoms_list))),
+        insurance.casefold() if insurance else None,
+        location.casefold() if location else None,
+        urgency,
+        limit,
+        near,
+        radius_km if near is not None else None,
+    )
+
+class MatchCache:
+    def __init__(self, maxsize=MATCH_CACHE_SIZE, ttl=MATCH_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, version):
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+                self.entries.clear()
+            self.version = version
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, version, value):
+        if self.maxsize <= 0 or version != self.version:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+match_cache = MatchCache()
@@ -0,0 +1,211 @@
+"""
+Provider matching: scores providers against symptoms, insurance and location.
+
+Scoring (normalized to 100):
+  - insurance accepted: 35
+  - same city: 20, or up to 20 decaying with distance in `near` mode
+  - specialty treats a symptom: 35 (30 for generalists)
+  - bonus for rating, short wait and experience: up to 10
+
+With NumPy available, every provider is scored at once from the index's
+feature arrays and only the top `limit` get their reasons built. Otherwise
+only providers reachable through the ProviderIndex from the query can get
+any of the first three; everyone else can score at most the bonus, so the
+rest of the directory is only consulted to fill up a short result list.
+Either way providers are scored without reasons and kept in a heap of
+size `limit`, so nothing proportional to the directory is built per query.
+"""
+import heapq
+
+from specialties import GENERALISTS, SYMPTOM_SPECIALTIES
+from match_cache import query_key
+from provider_normalization import is_normalized, normalize_provider
+
+def parse_symptoms(symptoms):
+    if not symptoms:
+        return []
+    if isinstance(symptoms, str):
+        return [s.strip().lower() for s in symptoms.split(",")]
+    return [s.strip().lower() for s in symptoms]
+
+def score_provider(provider, symptoms_list, insurance=None, location=None, distance_km=None, radius_km=None,
+                   explain=True):
+    """
+    Score one provider; returns (percent_score, reasons). Reads the derived fields set at ingest.
+    With explain=False no reasons are built and the list comes back empty.
+    """
+    if not is_normalized(provider):
+        provider = normalize_provider(provider)
+    reasons = []
+    insurance_score = 0
+    location_score = 0
+    symptom_score = 0
+    # Insurance matching (up to 35 points) - Case-insensitive
+    if insurance and provider["insurance_keys"]:
+        insurance_key = insurance.casefold()
+        if any(insurance_key in ins for ins in provider["insurance_keys"]):
+            insurance_score = 35
+            if explain:
+                reasons.append(f"Accepts {insurance}")
+    # Location matching (up to 20 points) - Case-insensitive
+    if location and provider.get("city"):
+        if location.casefold() == provider.get("city").casefold():
+            location_score = 20
+            if explain:
+                reasons.append(f"Located in {provider['city']}")
+    # Proximity (up to 20 points, falling linearly to 0 at the search radius)
+    if distance_km is not None and radius_km:
+        proximity_score = round(20 * max(0.0, 1 - distance_km / radius_km), 2)
+        if proximity_score > location_score:
+            location_score = proximity_score
+            if explain:
+                reasons.append(f"{distance_km:.1f} km away")
+    # Symptom-specialty matching (up to 35 points for mapped, 30 for generalist)
+    specialty = provider["specialty_code"]
+    if symptoms_list and specialty is not None:
+        for symptom in symptoms_list:
+            if symptom in SYMPTOM_SPECIALTIES:
+                if specialty in SYMPTOM_SPECIALTIES[symptom]:
+                    symptom_score = max(symptom_score, 35)
+                    if explain:
+                        reasons.append(f"Specializes in {symptom} treatment")
+                elif specialty in GENERALISTS:
+                    symptom_score = max(symptom_score, 30)
+                    if explain:
+                        reasons.append(f"Can treat {symptom}")
+    # Calculate base score (insurance + location + symptom)
+    base_score = insurance_score + location_score + symptom_score
+    # Bonus: rating, wait time, experience (up to 10 points, but capped so total is 100)
+    bonus_points = 0
+    if provider.get("rating"):
+        try:
+            bonus_points += min(float(provider["rating"]) * 2, 6)  # up to 6 points
+            if explain:
+                reasons.append(f"High rating: {provider['rating']}")
+        except Exception:
+            pass
+    if provider["wait_minutes"] is not None and provider["wait_minutes"] <= 10:
+        bonus_points += 2
+        if explain:
+            reasons.append("Quick wait time")
+    if provider["experience_years"] is not None and provider["experience_years"] >= 15:
+        bonus_points += 2
+        if explain:
+            reasons.append("Highly experienced")
+    # Cap bonus so total does not exceed 100
+    max_bonus = max(0, 100 - base_score)
+    bonus_score = min(bonus_points, max_bonus)
+    total_score = base_score + bonus_score
+    return round(total_score, 2), reasons
+
+def rank_near(index, near, radius_km, symptoms_list, insurance=None, location=None, limit=3):
+    """Best providers within radius_km of near=(lat, lng) as (id, distance) pairs; ties go to the closer provider"""
+    scored = (
+        (-score_provider(index.providers[provider_id], symptoms_list, insurance, location, distance, radius_km,
+                         explain=False)[0], distance, index.sequence[provider_id], provider_id)
+        for distance, provider_id in index.nearby(near[0], near[1], radius_km)
+    )
+    return [(provider_id, distance) for _, distance, _, provider_id in heapq.nsmallest(limit, scored)]
+
+def rank(index, symptoms_list, insurance=None, location=None, limit=3, near=None, radius_km=None, memo=None):
+    """
+    Rank providers for a query without building the response.
+    Returns (hits, fallback): hits is a list of (provider_id, distance_km or None), best first,
+    and fallback is True when nothing matched and hits are the top providers by rating.
+    """
+    if not index.providers:
+        return [], False
+    if near is not None:
+        return rank_near(index, near, radius_km, symptoms_list, insurance, location, limit), False
+    if index.features is not None and limit > 0:
+        top = index.features.top(symptoms_list, insurance, location, limit, memo)
+    else:
+        candidates = set()
+        if symptoms_list:
+            candidates |= index.specialty_candidates(symptoms_list)
+        if insurance:
+            candidates |= index.insurance_candidates(insurance.casefold())
+        if location:
+            candidates |= index.city_candidates(location.casefold())
+
+        # Keep only the best `limit` in a bounded heap rather than sorting every candidate
+        scored = (
+            (-score_provider(index.providers[provider_id], symptoms_list, insurance, location, explain=False)[0],
+             index.sequence[provider_id], provider_id)
+            for provider_id in candidates
+        )
+        top = [provider_id for score, _, provider_id in heapq.nsmallest(limit, scored) if score < 0]
+
+        # Providers outside the candidate set only earn the bonus (at most 10), which is below
+        # any candidate's score, so they can only fill the remaining slots, in bonus order
+        if len(top) < limit:
+            for provider_id in index.bonus_order():
+                if provider_id in candidates:
+                    continue
+                top.append(provider_id)
+                if len(top) >= limit:
+                    break
+    if top:
+        return [(provider_id, None) for provider_id in top], False
+    # If no providers matched, return top N by rating as fallback
+    ordered = heapq.nsmallest(limit, index.providers,
+                              key=lambda provider_id: (-(index.providers[provider_id].get("rating") or 0),
+                                                       index.sequence[provider_id]))
+    return [(provider_id, None) for provider_id in ordered], True
+
+def present(index, ranked, symptoms_list, insurance=None, location=None, radius_km=None):
+    """Turn ranked ids into response dicts, building match reasons only for these providers"""
+    hits, fallback = ranked
+    results = []
+    for provider_id, distance in hits:
+        provider = index.providers[provider_id]
+        if fallback:
+            results.append({**provider, "match_score": provider.get("match_score", 0),
+                            "match_reasons": provider.get("match_reasons", ["Selected based on high rating"])})
+            continue
+        score, reasons = score_provider(provider, symptoms_list, insurance, location, distance, radius_km)
+        result = {**provider, "match_score": score, "match_reasons": reasons}
+        if distance is not None:
+            result["distance_km"] = round(distance, 2)
+        results.append(result)
+    return results
+
+def match(index, symptoms=None, insurance=None, location=None, urgency=None, limit=3, near=None, radius_km=None, cache=None):
+    """Return the top `limit` providers for a query, best first, as dicts with match_score/match_reasons"""
+    symptoms_list = parse_symptoms(symptoms)
+    ranked = None
+    if cache is not None:
+        key = query_key(symptoms_list, insurance, location, urgency, limit, near, radius_km)
+        ranked = cache.get(key, index.version)
+    if ranked is None:
+        ranked = rank(index, symptoms_list, insurance, location, limit, near, radius_km)
+        if cache is not None:
+            cache.put(key, index.version, ranked)
+    # Reasons echo the query as typed, so they're built per request rather than cached
+    return present(index, ranked, symptoms_list, insurance, location, radius_km)
+
+def match_many(index, queries, cache=None):
+    """
+    match() for a list of query dicts, results in the same order.
+    Identical queries are ranked once, and the per-insurance, per-city and per-symptom
+    score vectors are shared across the whole batch.
+    """
+    memo = {}
+    ranked_by_key = {}
+    results = []
+    for query in queries:
+        symptoms_list = parse_symptoms(query.get("symptoms"))
+        insurance = query.get("insurance")
+        location = query.get("location")
+        limit = query.get("limit", 3)
+        key = query_key(symptoms_list, insurance, location, query.get("urgency"), limit)
+        ranked = ranked_by_key.get(key)
+        if ranked is None and cache is not None:
+            ranked = cache.get(key, index.version)
+        if ranked is None:
+            ranked = rank(index, symptoms_list, insurance, location, limit, memo=memo)
+            if cache is not None:
+                cache.put(key, index.version, ranked)
+        ranked_by_key[key] = ranked
+        results.append(present(index, ranked, symptoms_list, insurance, location))
+    return results
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+One-shot migration: backfill derived matching fields (wait_minutes,
+experience_years, insurance_keys, specialty_code) on existing providers.
+
+Safe to re-run; documents that are already up to date are left alone.
+"""
+import os
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+from provider_normalization import derived_fields
+
+load_dotenv()
+
+MONGODB_URI = os.getenv("MONGODB_URI")
+DB_NAME = os.getenv("MONGODB_DB", "smartcare")
+BATCH_SIZE = 1000
+
+async def backfill(db):
+    """Write derived fields on every provider that is missing or out of date; returns (scanned, updated)"""
+    scanned = 0
+    updated = 0
+    batch = []
+    async for provider in db.providers.find():
+        scanned += 1
+        fields = derived_fields(provider)
+        if any(provider.get(field, object()) != value for field, value in fields.items()):
+            batch.append(UpdateOne({"_id": provider["_id"]}, {"$set": fields}))
+        if len(batch) >= BATCH_SIZE:
+            result = await db.providers.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+            batch = []
+    if batch:
+        result = await db.providers.bulk_write(batch, ordered=False)
+        updated += result.modified_count
+    return scanned, updated
+
+async def migrate():
+    try:
+        print("Connecting to MongoDB...")
+        client = AsyncIOMotorClient(MONGODB_URI)
+        db = client[DB_NAME]
+        await client.admin.command('ping')
+        print("✓ Connected to MongoDB successfully!")
+
+        print("Backfilling derived provider fields...")
+        scanned, updated = await backfill(db)
+        print(f"✓ Scanned {scanned} providers, updated {updated}")
+
+        client.close()
+
+    except Exception as e:
+        print(f"❌ Error migrating providers: {e}")
+        print("Make sure MongoDB is running and accessible.")
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
@@ -34,6 +34,17 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     user_id: Optional[str] = None
+    # Login the token descends from (the "fam" claim)
+    family: Optional[str] = None
+    # Signed into access tokens at login; missing from older tokens
+    name: Optional[str] = None
+    email: Optional[str] = None
+
+class UserClaims(BaseModel):
+    """The caller as described by their access token, for routes that don't need the user document"""
+    id: str
+    name: str
+    email: str
 
 class RefreshToken(BaseModel):
     refresh_token: str
@@ -92,6 +103,15 @@ class Provider(BaseModel):
     education: Optional[str] = None
     match_score: Optional[float] = None
     match_reasons: Optional[List[str]] = None
+    distance_km: Optional[float] = None
+
+class MatchQuery(BaseModel):
+    symptoms: Optional[str] = None  # Comma-separated, as in /api/providers/match/
+    symptom_codes: Optional[List[int]] = None
+    insurance: Optional[str] = None
+    location: Optional[str] = None
+    urgency: Optional[str] = None
+    limit: int = 3
 
 class IntakeForm(BaseModel):
     user_id: str
@@ -107,10 +127,13 @@ class IntakeForm(BaseModel):
     insuranceProvider: str
     insurancePlan: str
     memberId: Optional[str] = None
+    symptomCodes: Optional[List[int]] = None  # Extracted from the free-text fields by the route
 
 class BookingCreate(BaseModel):
     provider_id: str
     appointment_time: datetime
+    # Appointment length; APPOINTMENT_MINUTES when not given
+    duration_minutes: Optional[int] = Field(None, gt=0, le=24 * 60)
     status: str = "pending"
     # Insurance details
     insurance_provider: Optional[str] = None
@@ -122,6 +145,7 @@ class Booking(BaseModel):
     user_id: str
     provider_id: str
     appointment_time: datetime
+    duration_minutes: Optional[int] = None
     status: str = "pending"
     # Provider details stored when booking is made
     provider_details: Optional[dict] = None
@@ -0,0 +1,119 @@
+"""
+Password hashing off the event loop.
+
+sha256_crypt runs thousands of rounds per hash, so hashing or verifying a
+password inline blocks every other request on the worker while it runs.
+hash_password() and verify_password() hand the work to a small process
+pool instead and await the result. The number of calls waiting on the pool
+is capped; past the cap they fail fast with HashingOverloaded rather than
+queueing without bound.
+"""
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+pwd_context = CryptContext(schemes=["sha256_crypt"], deprecated="auto")
+
+# Worker processes; 0 hashes inline on the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hash/verify calls allowed in flight (running or queued) before new ones are turned away
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(max(1, PASSWORD_HASH_WORKERS) * 16)))
+
+class HashingOverloaded(Exception):
+    """Too many password hashes are already waiting"""
+
+# Run in the workers; each returns its result and the CPU time it took
+def _hash(password):
+    start = time.process_time()
+    return pwd_context.hash(password), time.process_time() - start
+
+def _verify(password, hashed):
+    start = time.process_time()
+    return pwd_context.verify(password, hashed), time.process_time() - start
+
+class PasswordHasher:
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.cpu_seconds = 0.0
+        self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def _run(self, fn, *args):
+        if self.workers <= 0:
+            self.completed += 1
+            return self._account(*fn(*args))
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HashingOverloaded(f"{self.pending} password hashes already in flight")
+        self.pending += 1
+        try:
+            return self._account(*await asyncio.get_running_loop().run_in_executor(self._executor(), fn, *args))
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next call
+            logger.error("Password hashing pool broke; restarting it")
+            self._pool = None
+            raise
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    def _account(self, result, cpu_seconds):
+        self.cpu_seconds += cpu_seconds
+        return result
+
+    def average_cpu_seconds(self):
+        """CPU time one hash or verify costs, as measured so far"""
+        return self.cpu_seconds / self.completed if self.completed else 0.0
+
+    async def hash(self, password):
+        return await self._run(_hash, password)
+
+    async def verify(self, password, hashed):
+        return await self._run(_verify, password, hashed)
+
+    async def start(self):
+        """
+        Start the worker processes now rather than on the first login. Call it before the
+        database connection is opened, so forked workers don't inherit its sockets and threads.
+        """
+        if self.workers > 0:
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[loop.run_in_executor(self._executor(), os.getpid) for _ in range(self.workers)])
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "avg_cpu_ms": round(self.average_cpu_seconds() * 1000, 1),
+        }
+
+password_hasher = PasswordHasher()
+
+async def hash_password(password):
+    return await password_hasher.hash(password)
+
+async def verify_password(password, hashed):
+    return await password_hasher.verify(password, hashed)
@@ -0,0 +1,277 @@
+"""
+Optional durability for the in-memory storage backend.
+
+Every mutation is appended to a write-ahead log (WAL) that is fsynced in
+batches by a background thread. Once the log grows past a threshold it is
+compacted into a binary snapshot. Opening the store only memory-maps the
+snapshot and reads its directory, so it takes the same time however much
+data there is; each collection is deserialized (and its WAL records
+replayed) the first time it is used. The app's lifespan touches users,
+providers and bookings while building its indexes, so those are loaded
+before the first request is served.
+
+Enable it by pointing INMEMORY_DATA_DIR at a writable directory.
+"""
+import os
+import mmap
+import glob
+import pickle
+import struct
+import zlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"MCSNAP01"
+SNAPSHOT_FILE = "snapshot.bin"
+WAL_PATTERN = "wal-{:08d}.log"
+
+# Each WAL record is prefixed with its payload length and CRC32
+_RECORD_HEADER = struct.Struct("<II")
+_SNAPSHOT_FOOTER = struct.Struct("<Q")
+
+class DurableStore:
+    def __init__(self, directory, fsync_interval=0.05, compact_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.compact_bytes = compact_bytes
+        self.db = None
+        self._lock = threading.RLock()
+        self._wal = None
+        self._wal_seq = 0
+        self._wal_bytes = 0
+        self._dirty = False
+        self._compacting = False
+        self._closed = False
+        self._stop = threading.Event()
+        # Snapshot state: the mapped file and where each collection lives in it
+        self._snapshot_file = None
+        self._snapshot_map = None
+        self._snapshot_collections = {}
+        # WAL records replayed at startup, waiting for their collection to be loaded
+        self._pending = {}
+        self._flusher = None
+
+    def open(self, db):
+        """Load the snapshot directory, read the WAL tail and start a fresh WAL segment"""
+        self.db = db
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot_seq = self._map_snapshot(os.path.join(self.directory, SNAPSHOT_FILE))
+        last_seq = snapshot_seq
+        for seq, path in self._wal_segments():
+            if seq <= snapshot_seq:
+                # Left behind by a compaction that finished writing the snapshot
+                os.remove(path)
+                continue
+            if os.path.getsize(path) == 0:
+                # Opened by an earlier run that never wrote to it
+                os.remove(path)
+                continue
+            for collection, op, args in self._read_wal(path):
+                self._pending.setdefault(collection, []).append((op, args))
+            self._wal_bytes += os.path.getsize(path)
+            last_seq = seq
+        self._open_segment(last_seq + 1)
+        self._flusher = threading.Thread(target=self._flush_loop, name="inmemory-wal-flusher", daemon=True)
+        self._flusher.start()
+        logger.info(f"Durable in-memory storage opened at {self.directory} "
+                    f"({len(self._snapshot_collections)} snapshot collections)")
+
+    # Loading
+
+    def _map_snapshot(self, path):
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return 0
+        snapshot_file = open(path, "rb")
+        try:
+            snapshot_map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # mmap isn't available everywhere; fall back to reading the file
+            snapshot_map = snapshot_file.read()
+        if snapshot_map[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not an in-memory storage snapshot")
+        end = len(snapshot_map) - _SNAPSHOT_FOOTER.size
+        (start,) = _SNAPSHOT_FOOTER.unpack_from(snapshot_map, end)
+        directory = pickle.loads(snapshot_map[start:end])
+        self._snapshot_file = snapshot_file
+        self._snapshot_map = snapshot_map
+        self._snapshot_collections = directory["collections"]
+        return directory["wal_seq"]
+
+    def _wal_segments(self):
+        segments = []
+        for path in glob.glob(os.path.join(self.directory, "wal-*.log")):
+            try:
+                segments.append((int(os.path.basename(path)[4:-4]), path))
+            except ValueError:
+                continue
+        return sorted(segments)
+
+    def _read_wal(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        position = 0
+        while position + _RECORD_HEADER.size <= len(data):
+            length, checksum = _RECORD_HEADER.unpack_from(data, position)
+            start = position + _RECORD_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                # A torn write at the tail of the log; everything before it is intact
+                logger.warning(f"Ignoring incomplete WAL record at {path}:{position}")
+                break
+            yield pickle.loads(payload)
+            position = start + length
+
+    def restore(self, collection):
+        """Fill a newly created collection from the snapshot and any logged changes"""
+        with self._lock:
+            name = collection.name
+            indexes = []
+            entry = self._snapshot_collections.get(name)
+            if entry is not None:
+                blob = self._snapshot_map[entry["offset"]:entry["offset"] + entry["length"]]
+                collection.documents = pickle.loads(blob)
+                indexes = list(entry["indexes"])
+            for op, args in self._pending.pop(name, ()):
+                if op == "write":
+                    puts, deletes = args
+                    collection.documents.update(puts)
+                    for doc_id in deletes:
+                        collection.documents.pop(doc_id, None)
+                elif op == "index":
+                    indexes.append(args)
+                elif op == "clear":
+                    collection.documents = {}
+            for field, unique in indexes:
+                collection._build_index(field, unique)
+
+    # Logging
+
+    def _open_segment(self, seq):
+        self._wal_seq = seq
+        self._wal = open(os.path.join(self.directory, WAL_PATTERN.format(seq)), "ab")
+
+    def log(self, collection, op, *args):
+        payload = pickle.dumps((collection, op, args), protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self._closed:
+                return
+            self._wal.write(_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+            self._wal.write(payload)
+            self._wal_bytes += _RECORD_HEADER.size + len(payload)
+            self._dirty = True
+            if self._wal_bytes >= self.compact_bytes and not self._compacting:
+                self._start_compaction()
+
+    def _sync(self):
+        if self._dirty:
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._dirty = False
+
+    def _flush_loop(self):
+        # Group commit: one fsync covers every record written during the interval
+        while not self._stop.wait(self.fsync_interval):
+            with self._lock:
+                if not self._closed:
+                    self._sync()
+
+    # Compaction
+
+    def _start_compaction(self):
+        # Anything logged with a WAL record still waiting must be loaded so it lands in the snapshot
+        for name in list(self._pending):
+            self.db[name]
+        self._sync()
+        self._wal.close()
+        covered_seq = self._wal_seq
+        self._open_segment(covered_seq + 1)
+        self._wal_bytes = 0
+        # Stored documents are replaced on write, never mutated, so shallow copies are a consistent view
+        frozen = {}
+        for name, collection in self.db.collections.items():
+            frozen[name] = (dict(collection.documents), [(f, i.unique) for f, i in collection.indexes.items()])
+        for name, entry in self._snapshot_collections.items():
+            if name not in frozen:
+                blob = bytes(self._snapshot_map[entry["offset"]:entry["offset"] + entry["length"]])
+                frozen[name] = (blob, list(entry["indexes"]))
+        self._compacting = True
+        threading.Thread(target=self._compact, args=(frozen, covered_seq), name="inmemory-compactor", daemon=True).start()
+
+    def _compact(self, frozen, covered_seq):
+        try:
+            path = os.path.join(self.directory, SNAPSHOT_FILE)
+            self.write_snapshot(path, frozen, covered_seq)
+            with self._lock:
+                old_file, old_map = self._snapshot_file, self._snapshot_map
+                self._snapshot_collections = {}
+                self._map_snapshot(path)
+                for seq, segment in self._wal_segments():
+                    if seq <= covered_seq:
+                        os.remove(segment)
+            if isinstance(old_map, mmap.mmap):
+                old_map.close()
+            if old_file is not None:
+                old_file.close()
+            logger.info(f"Compacted in-memory storage WAL into snapshot (through segment {covered_seq})")
+        except Exception as e:
+            logger.error(f"In-memory storage compaction failed: {e}")
+        finally:
+            self._compacting = False
+
+    @staticmethod
+    def write_snapshot(path, frozen, wal_seq):
+        """Write collections to a snapshot file atomically"""
+        collections = {}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            offset = len(SNAPSHOT_MAGIC)
+            for name, (documents, indexes) in frozen.items():
+                blob = documents if isinstance(documents, bytes) else pickle.dumps(documents, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(blob)
+                collections[name] = {"offset": offset, "length": len(blob), "indexes": indexes}
+                offset += len(blob)
+            # The directory goes last, followed by its offset, so blobs can be streamed out first
+            f.write(pickle.dumps({"wal_seq": wal_seq, "collections": collections}, protocol=pickle.HIGHEST_PROTOCOL))
+            f.write(_SNAPSHOT_FOOTER.pack(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(os.path.dirname(path) or ".", os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def compact(self):
+        """Force a compaction and wait for it to finish"""
+        with self._lock:
+            if not self._compacting:
+                self._start_compaction()
+        while self._compacting:
+            self._stop.wait(0.01)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._sync()
+            self._closed = True
+            self._wal.close()
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=1)
+
+def open_store_from_env():
+    """Create a DurableStore from INMEMORY_* environment variables, or None if persistence is off"""
+    directory = os.getenv("INMEMORY_DATA_DIR")
+    if not directory:
+        return None
+    return DurableStore(
+        directory,
+        fsync_interval=float(os.getenv("INMEMORY_FSYNC_INTERVAL_MS", "50")) / 1000,
+        compact_bytes=int(float(os.getenv("INMEMORY_COMPACT_MB", "64")) * 1024 * 1024),
+    )
@@ -0,0 +1,219 @@
+"""
+Bitmap indexes for filtering and faceting the provider directory.
+
+Every provider gets a row number. Each categorical value (a specialty, a
+city, a state, a pincode, an accepted insurance) has a bitset of the rows
+that carry it, and numeric fields (rating, wait minutes) have one bitset per
+bucket. A filter is a few bitwise ORs within a field and ANDs across
+fields, and a facet count is the popcount of a value's bitset ANDed with
+the filter.
+"""
+from provider_normalization import parse_rating
+from specialties import specialty_code, specialty_name
+
+CATEGORICAL_FIELDS = ("specialty", "city", "state", "pincode", "insurance")
+
+# Fields reported by facets(); pincodes are too many to be useful as facets
+FACET_FIELDS = ("specialty", "city", "state", "insurance")
+
+RATING_BUCKET = 0.5
+WAIT_BUCKET = 5
+
+class Bitset:
+    """A growable bitset kept as a bytearray, with its int form cached for bitwise operations"""
+    __slots__ = ("bits", "_value")
+
+    def __init__(self):
+        self.bits = bytearray()
+        self._value = 0
+
+    def add(self, row):
+        byte = row >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte + 1 - len(self.bits), len(self.bits))))
+        self.bits[byte] |= 1 << (row & 7)
+        self._value = None
+
+    def discard(self, row):
+        byte = row >> 3
+        if byte < len(self.bits):
+            self.bits[byte] &= ~(1 << (row & 7)) & 0xFF
+            self._value = None
+
+    def value(self):
+        if self._value is None:
+            self._value = int.from_bytes(self.bits, "little")
+        return self._value
+
+def iter_rows(bitmap):
+    """Row numbers set in an int bitmap, ascending"""
+    bits = bin(bitmap)[:1:-1]
+    row = bits.find("1")
+    while row != -1:
+        yield row
+        row = bits.find("1", row + 1)
+
+def popcount(bitmap):
+    return bitmap.bit_count()
+
+class BitmapIndex:
+    def __init__(self):
+        self.rows = {}
+        self.ids = []
+        self._free = []
+        self.all = Bitset()
+        self.values = {field: {} for field in CATEGORICAL_FIELDS}
+        # How each value was first written, for facet labels
+        self.labels = {field: {} for field in CATEGORICAL_FIELDS}
+        self.rating_buckets = {}
+        self.wait_buckets = {}
+        self.ratings = []
+        self.waits = []
+        self._keys = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    # Maintenance
+
+    def _row_keys(self, provider):
+        keys = {
+            "specialty": [] if provider["specialty_code"] is None else [provider["specialty_code"]],
+            "city": [provider["city"].casefold()] if provider.get("city") else [],
+            "state": [provider["state"].casefold()] if provider.get("state") else [],
+            "pincode": [str(provider["pincode"]).strip()] if provider.get("pincode") else [],
+            "insurance": list(provider["insurance_keys"]),
+        }
+        labels = {
+            "city": provider.get("city"),
+            "state": provider.get("state"),
+            "pincode": provider.get("pincode"),
+        }
+        return keys, labels
+
+    def upsert(self, provider_id, provider):
+        """Index a provider; the document must already carry its derived fields"""
+        if provider_id in self.rows:
+            self.remove(provider_id)
+        if self._free:
+            row = self._free.pop()
+            self.ids[row] = provider_id
+        else:
+            row = len(self.ids)
+            self.ids.append(provider_id)
+            self.ratings.append(None)
+            self.waits.append(None)
+        self.rows[provider_id] = row
+        self.all.add(row)
+
+        keys, labels = self._row_keys(provider)
+        for original in provider.get("accepted_insurances") or []:
+            self.labels["insurance"].setdefault(original.casefold(), original)
+        for field, values in keys.items():
+            for value in values:
+                self.values[field].setdefault(value, Bitset()).add(row)
+                self.labels[field].setdefault(value, labels.get(field) or value)
+
+        rating = parse_rating(provider.get("rating"))
+        self.ratings[row] = rating
+        rating_bucket = int(rating // RATING_BUCKET)
+        self.rating_buckets.setdefault(rating_bucket, Bitset()).add(row)
+        wait = provider["wait_minutes"]
+        wait_bucket = None
+        self.waits[row] = wait
+        if wait is not None:
+            wait_bucket = wait // WAIT_BUCKET
+            self.wait_buckets.setdefault(wait_bucket, Bitset()).add(row)
+        self._keys[provider_id] = (keys, rating_bucket, wait_bucket)
+
+    def remove(self, provider_id):
+        row = self.rows.pop(provider_id, None)
+        if row is None:
+            return
+        keys, rating_bucket, wait_bucket = self._keys.pop(provider_id)
+        for field, values in keys.items():
+            for value in values:
+                self.values[field][value].discard(row)
+        self.rating_buckets[rating_bucket].discard(row)
+        if wait_bucket is not None:
+            self.wait_buckets[wait_bucket].discard(row)
+        self.all.discard(row)
+        self.ids[row] = None
+        self.ratings[row] = None
+        self.waits[row] = None
+        self._free.append(row)
+
+    # Queries
+
+    def _any_of(self, field, keys):
+        bitmap = 0
+        for key in keys:
+            bitset = self.values[field].get(key)
+            if bitset is not None:
+                bitmap |= bitset.value()
+        return bitmap
+
+    def _range(self, buckets, values, width, low=None, high=None):
+        """Rows whose value is within [low, high]; only buckets straddling a bound are checked row by row"""
+        bitmap = 0
+        partial = Bitset()
+        for bucket, bitset in buckets.items():
+            start, end = bucket * width, (bucket + 1) * width
+            if (low is not None and end <= low) or (high is not None and start > high):
+                continue
+            if (low is None or start >= low) and (high is None or end <= high):
+                bitmap |= bitset.value()
+                continue
+            for row in iter_rows(bitset.value()):
+                value = values[row]
+                if (low is None or value >= low) and (high is None or value <= high):
+                    partial.add(row)
+        return bitmap | partial.value()
+
+    def filter(self, specialty=None, city=None, state=None, pincode=None, insurance=None,
+               min_rating=None, max_wait=None):
+        """
+        Bitmap of providers matching every given criterion. List criteria match any of
+        their values; pincode values are prefixes. Returns None when nothing is filtered.
+        """
+        bitmap = None
+        criteria = []
+        if specialty:
+            criteria.append(self._any_of("specialty", [specialty_code(s) for s in specialty]))
+        if city:
+            criteria.append(self._any_of("city", [c.casefold() for c in city]))
+        if state:
+            criteria.append(self._any_of("state", [s.casefold() for s in state]))
+        if insurance:
+            criteria.append(self._any_of("insurance", [i.casefold() for i in insurance]))
+        if pincode:
+            prefixes = tuple(p.strip() for p in pincode)
+            criteria.append(self._any_of("pincode", [key for key in self.values["pincode"] if key.startswith(prefixes)]))
+        if min_rating is not None:
+            criteria.append(self._range(self.rating_buckets, self.ratings, RATING_BUCKET, low=min_rating))
+        if max_wait is not None:
+            criteria.append(self._range(self.wait_buckets, self.waits, WAIT_BUCKET, high=max_wait))
+        for criterion in criteria:
+            bitmap = criterion if bitmap is None else bitmap & criterion
+        return bitmap
+
+    def facets(self, bitmap=None):
+        """Per facet field, how many of the providers in `bitmap` have each value"""
+        if bitmap is None:
+            bitmap = self.all.value()
+        facets = {}
+        for field in FACET_FIELDS:
+            counts = {}
+            for key, bitset in self.values[field].items():
+                count = popcount(bitset.value() & bitmap)
+                if count:
+                    label = specialty_name(key) if field == "specialty" else self.labels[field][key]
+                    counts[label] = counts.get(label, 0) + count
+            facets[field] = dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+        return facets
+
+    def count(self, bitmap=None):
+        return popcount(self.all.value() if bitmap is None else bitmap)
+
+    def provider_ids(self, bitmap):
+        return [self.ids[row] for row in iter_rows(bitmap)]
@@ -0,0 +1,186 @@
+"""
+Array-backed provider features for vectorized match scoring.
+
+Each provider occupies one row of a set of NumPy columns (insurance bitmask,
+city code, specialty code, rating, wait minutes, experience years). The
+ProviderIndex keeps the rows in sync with provider writes, and a query is
+scored over every row at once, with argpartition picking the top k.
+"""
+import numpy as np
+
+from provider_normalization import parse_rating
+from specialties import GENERALISTS, SPECIALTIES, SYMPTOM_SPECIALTIES
+
+INITIAL_CAPACITY = 1024
+
+# Specialty codes index straight into per-query score tables; code -1 (none) lands on the extra last slot
+_TABLE_SIZE = max(SPECIALTIES) + 2
+_GENERALIST_CODES = sorted(GENERALISTS)
+
+class ProviderFeatures:
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.rows = {}
+        self.ids = []
+        self._free = []
+        self.size = 0
+        self.city_codes = {}
+        self.insurance_bits = {}
+        self._bonus = None
+        self._allocate(capacity, 1)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _allocate(self, capacity, insurance_words):
+        old_size = self.size
+        columns = {
+            "active": np.zeros(capacity, dtype=bool),
+            "sequence": np.zeros(capacity, dtype=np.int64),
+            "insurance": np.zeros((capacity, insurance_words), dtype=np.uint64),
+            "city": np.full(capacity, -1, dtype=np.int32),
+            "specialty": np.full(capacity, -1, dtype=np.int32),
+            "rating": np.zeros(capacity, dtype=np.float64),
+            "wait_minutes": np.full(capacity, -1, dtype=np.int64),
+            "experience_years": np.full(capacity, -1, dtype=np.int64),
+        }
+        for name, column in columns.items():
+            old = getattr(self, name, None)
+            if old is not None and old_size:
+                if column.ndim == 2:
+                    column[:old_size, :old.shape[1]] = old[:old_size]
+                else:
+                    column[:old_size] = old[:old_size]
+            setattr(self, name, column)
+
+    def clear(self):
+        self.__init__(len(self.active))
+
+    # Maintenance
+
+    def _code(self, codes, key):
+        code = codes.get(key)
+        if code is None:
+            code = codes[key] = len(codes)
+        return code
+
+    def upsert(self, provider_id, provider, sequence):
+        """Write a provider's row; the document must already carry its derived fields"""
+        row = self.rows.get(provider_id)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                if self.size == len(self.active):
+                    self._allocate(self.size * 2, self.insurance.shape[1])
+                row = self.size
+                self.size += 1
+                self.ids.append(None)
+            self.rows[provider_id] = row
+            self.ids[row] = provider_id
+
+        mask = [0] * self.insurance.shape[1]
+        for ins in provider["insurance_keys"]:
+            bit = self._code(self.insurance_bits, ins)
+            if bit // 64 >= len(mask):
+                self._allocate(len(self.active), bit // 64 + 1)
+                mask.append(0)
+            mask[bit // 64] |= 1 << (bit % 64)
+
+        specialty = provider["specialty_code"]
+        city = provider.get("city")
+
+        self.active[row] = True
+        self.sequence[row] = sequence
+        self.insurance[row] = mask
+        self.city[row] = self._code(self.city_codes, city.casefold()) if city else -1
+        self.specialty[row] = -1 if specialty is None else specialty
+        self.rating[row] = parse_rating(provider.get("rating"))
+        wait = provider["wait_minutes"]
+        self.wait_minutes[row] = -1 if wait is None else wait
+        experience = provider["experience_years"]
+        self.experience_years[row] = -1 if experience is None else experience
+        self._bonus = None
+
+    def remove(self, provider_id):
+        row = self.rows.pop(provider_id, None)
+        if row is None:
+            return
+        self.active[row] = False
+        self.ids[row] = None
+        self._free.append(row)
+        self._bonus = None
+
+    # Scoring
+
+    def bonus(self):
+        """Rating/wait/experience bonus per row; doesn't depend on the query, so it's cached until a write"""
+        if self._bonus is None:
+            n = self.size
+            rating = self.rating[:n]
+            wait = self.wait_minutes[:n]
+            experience = self.experience_years[:n]
+            self._bonus = (np.where(rating != 0, np.minimum(rating * 2, 6), 0.0)
+                           + np.where((wait >= 0) & (wait <= 10), 2.0, 0.0)
+                           + np.where(experience >= 15, 2.0, 0.0))
+        return self._bonus
+
+    def _insurance_points(self, insurance):
+        # Scoring treats the query as a substring of an accepted insurance
+        query = np.zeros(self.insurance.shape[1], dtype=np.uint64)
+        for key, bit in self.insurance_bits.items():
+            if insurance in key:
+                query[bit // 64] |= np.uint64(1 << (bit % 64))
+        if not query.any():
+            return None
+        return np.where(((self.insurance[:self.size] & query) != 0).any(axis=1), 35, 0).astype(np.int32)
+
+    def _city_points(self, city):
+        code = self.city_codes.get(city)
+        if code is None:
+            return None
+        return np.where(self.city[:self.size] == code, 20, 0).astype(np.int32)
+
+    def _symptom_points(self, mapped):
+        """Symptom points per row for a set of mapped symptoms"""
+        table = np.zeros(_TABLE_SIZE, dtype=np.int32)
+        table[_GENERALIST_CODES] = 30
+        for symptom in mapped:
+            table[list(SYMPTOM_SPECIALTIES[symptom])] = 35
+        # Code -1 (no specialty) indexes the table's last slot, which is always 0
+        return table[self.specialty[:self.size]]
+
+    def scores(self, symptoms_list, insurance=None, location=None, memo=None):
+        """
+        Match score of every row (inactive rows get -1). Queries scored together can share
+        a memo dict so each distinct insurance, city and symptom set is only worked out once.
+        """
+        if memo is None:
+            memo = {}
+        parts = []
+        if insurance:
+            parts.append(("insurance", insurance.casefold(), self._insurance_points))
+        if location:
+            parts.append(("city", location.casefold(), self._city_points))
+        mapped = frozenset(s for s in symptoms_list if s in SYMPTOM_SPECIALTIES)
+        if mapped:
+            parts.append(("symptoms", mapped, self._symptom_points))
+        base = np.zeros(self.size, dtype=np.int32)
+        for kind, key, points in parts:
+            if (kind, key) not in memo:
+                memo[(kind, key)] = points(key)
+            if memo[(kind, key)] is not None:
+                base += memo[(kind, key)]
+        total = base + np.minimum(self.bonus(), np.maximum(0, 100 - base))
+        return np.where(self.active[:self.size], np.round(total, 2), -1.0)
+
+    def top(self, symptoms_list, insurance=None, location=None, limit=3, memo=None):
+        """Ids of the best `limit` providers scoring above 0, best first, ties in collection order"""
+        scores = self.scores(symptoms_list, insurance, location, memo)
+        positive = np.flatnonzero(scores > 0)
+        if len(positive) > limit:
+            # Everything tied with the k-th best score stays in, so ties can be broken by sequence
+            candidates = -scores[positive]
+            kth = candidates[np.argpartition(candidates, limit - 1)[limit - 1]]
+            positive = positive[candidates <= kth]
+        order = np.lexsort((self.sequence[positive], -scores[positive]))[:limit]
+        return [self.ids[row] for row in positive[order]]
@@ -0,0 +1,311 @@
+"""
+In-process index over the providers collection used by provider matching.
+
+The index is built once at startup and kept up to date on provider writes:
+in-memory backend listeners, the shared data server's change feed, or
+MongoDB change streams. A standalone MongoDB server has no change streams;
+there each request checks the provider count and the index's age, and
+rebuilds it when either shows it may be out of date. A match request looks
+up only the providers reachable from its symptoms, insurance, city or
+coordinates instead of loading and scoring the whole directory.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from geo import GridIndex, coordinates
+from matching import score_provider
+from provider_bitmaps import BitmapIndex
+from provider_normalization import is_normalized, normalize_provider
+from specialties import GENERALISTS, SYMPTOM_SPECIALTIES
+
+logger = logging.getLogger(__name__)
+
+# When provider writes can't be observed, the longest a request may be served from an index this old
+REFRESH_SECONDS = float(os.getenv("PROVIDER_INDEX_REFRESH_SECONDS", "10"))
+# Seconds between attempts to resubscribe to a lost change feed
+RESUBSCRIBE_SECONDS = 1.0
+
+class ProviderIndex:
+    def __init__(self):
+        self.providers = {}
+        # Position of each provider in collection order, used to break score ties like the original scan
+        self.sequence = {}
+        self._next_sequence = 0
+        self.by_specialty = {}
+        self.generalists = set()
+        self.by_insurance = {}
+        self.by_city = {}
+        self.geo = GridIndex()
+        self.bitmaps = BitmapIndex()
+        # Array-backed copy of the scoring features, when NumPy is available
+        self.features = _new_features()
+        # Providers with a non-zero match bonus, best first; computed on demand, dropped on every change
+        self._bonus_order = None
+        self.built = False
+        # No change feed: check for outside writes on every request
+        self.polling = False
+        self._built_at = 0.0
+        self._built_count = 0
+        self._build_lock = None
+        self._sync_task = None
+        # Bumped on every change so derived structures (and caches) know to refresh
+        self.version = 0
+
+    def __len__(self):
+        return len(self.providers)
+
+    # Maintenance
+
+    def clear(self):
+        self.providers.clear()
+        self.sequence.clear()
+        self._next_sequence = 0
+        self.by_specialty.clear()
+        self.generalists.clear()
+        self.by_insurance.clear()
+        self.by_city.clear()
+        self.geo.clear()
+        self.bitmaps = BitmapIndex()
+        if self.features is not None:
+            self.features.clear()
+        self._bonus_order = None
+        self.version += 1
+
+    def upsert(self, provider):
+        # Documents written before the derived fields existed get them computed here
+        provider = dict(provider) if is_normalized(provider) else normalize_provider(provider)
+        provider["_id"] = str(provider["_id"])
+        provider_id = provider["_id"]
+        if provider_id in self.providers:
+            self._unlink(provider_id, self.providers[provider_id])
+        else:
+            self.sequence[provider_id] = self._next_sequence
+            self._next_sequence += 1
+        self.providers[provider_id] = provider
+        self._link(provider_id, provider)
+        if self.features is not None:
+            self.features.upsert(provider_id, provider, self.sequence[provider_id])
+        self._bonus_order = None
+        self.version += 1
+
+    def remove(self, provider_id):
+        provider_id = str(provider_id)
+        provider = self.providers.pop(provider_id, None)
+        if provider is not None:
+            self._unlink(provider_id, provider)
+            del self.sequence[provider_id]
+            if self.features is not None:
+                self.features.remove(provider_id)
+            self._bonus_order = None
+            self.version += 1
+
+    def _keys(self, provider):
+        specialty = provider["specialty_code"]
+        insurances = set(provider["insurance_keys"])
+        city = provider["city"].casefold() if provider.get("city") else None
+        return specialty, insurances, city
+
+    def _link(self, provider_id, provider):
+        specialty, insurances, city = self._keys(provider)
+        if specialty is not None:
+            self.by_specialty.setdefault(specialty, set()).add(provider_id)
+            if specialty in GENERALISTS:
+                self.generalists.add(provider_id)
+        for insurance in insurances:
+            self.by_insurance.setdefault(insurance, set()).add(provider_id)
+        if city:
+            self.by_city.setdefault(city, set()).add(provider_id)
+        point = coordinates(provider)
+        if point:
+            self.geo.add(provider_id, *point)
+        self.bitmaps.upsert(provider_id, provider)
+
+    def _unlink(self, provider_id, provider):
+        specialty, insurances, city = self._keys(provider)
+        if specialty is not None:
+            _discard(self.by_specialty, specialty, provider_id)
+        self.generalists.discard(provider_id)
+        for insurance in insurances:
+            _discard(self.by_insurance, insurance, provider_id)
+        if city:
+            _discard(self.by_city, city, provider_id)
+        self.geo.remove(provider_id)
+        self.bitmaps.remove(provider_id)
+
+    def on_write(self, puts, deletes):
+        """Listener for InMemoryCollection writes"""
+        for doc_id in deletes:
+            self.remove(doc_id)
+        for doc_id, doc in puts:
+            self.upsert(doc)
+
+    # Lookups
+
+    def specialty_candidates(self, symptoms):
+        ids = set()
+        mapped = False
+        for symptom in symptoms:
+            codes = SYMPTOM_SPECIALTIES.get(symptom)
+            if not codes:
+                continue
+            mapped = True
+            for code in codes:
+                ids.update(self.by_specialty.get(code, ()))
+        if mapped:
+            ids.update(self.generalists)
+        return ids
+
+    def insurance_candidates(self, insurance):
+        # Scoring treats the query as a substring of an accepted insurance, so match against the vocabulary
+        ids = set()
+        for key, provider_ids in self.by_insurance.items():
+            if insurance in key:
+                ids.update(provider_ids)
+        return ids
+
+    def city_candidates(self, city):
+        return set(self.by_city.get(city, ()))
+
+    def filtered(self, **criteria):
+        """Providers matching the bitmap filter criteria, in collection order"""
+        bitmap = self.bitmaps.filter(**criteria)
+        ids = self.bitmaps.provider_ids(bitmap) if bitmap is not None else list(self.providers)
+        ids.sort(key=self.sequence.__getitem__)
+        return [self.providers[provider_id] for provider_id in ids]
+
+    def bonus_order(self):
+        """Provider ids with a non-zero rating/wait/experience bonus, best first, ties in collection order"""
+        if self._bonus_order is None:
+            ranked = []
+            for provider_id, provider in self.providers.items():
+                bonus, _ = score_provider(provider, [], explain=False)
+                if bonus > 0:
+                    ranked.append((-bonus, self.sequence[provider_id], provider_id))
+            ranked.sort()
+            self._bonus_order = [provider_id for _, _, provider_id in ranked]
+        return self._bonus_order
+
+    def nearby(self, lat, lng, radius_km):
+        """(distance_km, provider_id) pairs within radius_km, nearest first"""
+        return self.geo.within(lat, lng, radius_km)
+
+    # Building and syncing
+
+    async def build(self, db):
+        """Load every provider from the database"""
+        providers = []
+        async for p in db.providers.find():
+            providers.append(p)
+        self.clear()
+        for p in providers:
+            self.upsert(p)
+        self.built = True
+        self._built_at = time.monotonic()
+        self._built_count = len(providers)
+        logger.info(f"Provider index built with {len(self.providers)} providers")
+
+    async def ensure_built(self, db):
+        """Build the index if it isn't, or rebuild it if it may have missed writes; call before each lookup"""
+        if self.built and not (self.polling and await self._stale(db)):
+            return
+        if self._build_lock is None:
+            self._build_lock = asyncio.Lock()
+        async with self._build_lock:
+            if not self.built or (self.polling and await self._stale(db)):
+                await self.build(db)
+
+    async def _stale(self, db):
+        if time.monotonic() - self._built_at >= REFRESH_SECONDS:
+            return True
+        # Catches inserts and deletes right away; updates wait for the age limit
+        return await db.providers.estimated_document_count() != self._built_count
+
+    async def start(self, db):
+        """Build the index and keep it in sync with provider writes"""
+        from database import InMemoryCollection
+        from data_server import RemoteCollection
+        providers = db.providers
+        if isinstance(providers, InMemoryCollection):
+            await self.build(db)
+            providers.listeners.append(self.on_write)
+        elif isinstance(providers, RemoteCollection):
+            # Writes happen in the data server process; subscribe before building so none are missed
+            stream = await providers.watch().open()
+            await self.build(db)
+            self._sync_task = asyncio.ensure_future(self._follow(db, stream))
+        else:
+            await self.build(db)
+            self._sync_task = asyncio.ensure_future(self._watch(db))
+
+    async def stop(self):
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    def apply_change(self, change):
+        """Apply a change stream event"""
+        if change["operationType"] in ("insert", "update", "replace") and change.get("fullDocument"):
+            self.upsert(change["fullDocument"])
+        elif change["operationType"] == "delete":
+            self.remove(change["documentKey"]["_id"])
+        elif change["operationType"] in ("drop", "invalidate"):
+            self.clear()
+
+    async def _watch(self, db):
+        try:
+            async with db.providers.watch(full_document="updateLookup") as stream:
+                async for change in stream:
+                    self.apply_change(change)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Change streams need a replica set; on a standalone server requests check for writes instead
+            logger.warning(f"Provider change stream unavailable ({e}); checking for provider writes on each "
+                           f"request and rebuilding at least every {REFRESH_SECONDS}s")
+            self.polling = True
+
+    async def _follow(self, db, stream):
+        """Apply the data server's provider changes; if the feed drops, resubscribe and rebuild"""
+        while True:
+            try:
+                async with stream:
+                    async for change in stream:
+                        self.apply_change(change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Provider change feed lost ({e}); resubscribing")
+            # Until the feed is back, requests check for writes themselves
+            self.polling = True
+            stream = None
+            while stream is None:
+                await asyncio.sleep(RESUBSCRIBE_SECONDS)
+                try:
+                    stream = await db.providers.watch().open()
+                    await self.build(db)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Provider change feed resubscribe failed: {e}")
+                    if stream is not None:
+                        await stream.close()
+                        stream = None
+            self.polling = False
+
+def _discard(mapping, key, value):
+    ids = mapping.get(key)
+    if ids is not None:
+        ids.discard(value)
+        if not ids:
+            del mapping[key]
+
+def _new_features():
+    try:
+        from provider_features import ProviderFeatures
+    except ImportError:
+        return None
+    return ProviderFeatures()
+
+provider_index = ProviderIndex()
@@ -0,0 +1,57 @@
+"""
+Derived provider fields, computed once when a provider is written.
+
+Provider documents carry free-form strings ("20 mins", "15 years",
+"Cardiologist"). Matching needs numbers and normalized keys, so they are
+worked out here at ingest time and stored on the document alongside the
+originals:
+
+  - wait_minutes: first number in wait_time, or None
+  - experience_years: first number in experience, or None
+  - insurance_keys: casefolded accepted_insurances
+  - specialty_code: canonical specialty code (see specialties.py), or None
+
+Anything that writes providers should go through normalize_provider (or
+$set derived_fields) whenever it touches the source fields. Existing data
+can be backfilled with migrate_provider_features.py.
+"""
+import re
+
+from specialties import specialty_code
+
+DERIVED_FIELDS = ("wait_minutes", "experience_years", "insurance_keys", "specialty_code")
+
+_NUMBER = re.compile(r'\d+')
+
+def first_int(value):
+    """First run of digits in a value like "20 mins" or "15 years", or None"""
+    if not value:
+        return None
+    digits = _NUMBER.search(str(value))
+    return int(digits.group()) if digits else None
+
+def parse_rating(value):
+    """Numeric rating, or 0.0 when missing or unparseable"""
+    if not value:
+        return 0.0
+    try:
+        rating = float(value)
+    except Exception:
+        return 0.0
+    return rating if rating == rating else 0.0
+
+def derived_fields(provider):
+    """The derived fields for a provider document"""
+    return {
+        "wait_minutes": first_int(provider.get("wait_time")),
+        "experience_years": first_int(provider.get("experience")),
+        "insurance_keys": [ins.casefold() for ins in provider.get("accepted_insurances") or []],
+        "specialty_code": specialty_code(provider.get("specialty")),
+    }
+
+def normalize_provider(provider):
+    """A copy of a provider document with its derived fields filled in"""
+    return {**provider, **derived_fields(provider)}
+
+def is_normalized(provider):
+    return all(field in provider for field in DERIVED_FIELDS)
@@ -0,0 +1,261 @@
+"""
+Query engine for the in-memory storage backend.
+
+Mongo-style filters are compiled into predicate functions and cached by
+shape: the fields and operators used, not the values. Lookups such as
+{"email": ...} or {"_id": ...} therefore compile once and reuse that plan
+with each request's values, and repeated queries skip re-parsing the
+filter.
+"""
+import re
+import itertools
+from collections import OrderedDict
+
+# Number of compiled filter shapes kept around
+QUERY_CACHE_SIZE = 512
+
+_REGEX_FLAGS = {"i": re.IGNORECASE, "m": re.MULTILINE, "s": re.DOTALL, "x": re.VERBOSE}
+
+_LOGICAL = ("$and", "$or", "$nor")
+
+class CompiledQuery:
+    """A compiled filter: a plan, the values it runs with, and the equality lookups an index can answer"""
+    def __init__(self, plan, params, index_keys):
+        self.plan = plan
+        # The filter's values, in the order the plan reads them
+        self.params = params
+        # field -> list of values, any of which the document must have
+        self.index_keys = index_keys
+
+    def matches(self, doc):
+        return self.plan(doc, self.params)
+
+_cache = OrderedDict()
+
+def compile_filter(filter_dict):
+    """Compile a filter, reusing the cached plan when a filter of the same shape was seen before"""
+    filter_dict = filter_dict or {}
+    params = []
+    key = _shape_document(filter_dict, params)
+    plan = _cache.get(key)
+    if plan is None:
+        plan = _compile_document(filter_dict, itertools.count())
+        _cache[key] = plan
+        if len(_cache) > QUERY_CACHE_SIZE:
+            _cache.popitem(last=False)
+    else:
+        _cache.move_to_end(key)
+    return CompiledQuery(plan, params, _index_keys(filter_dict))
+
+# The shape of a filter is its fields and operators. Walking it collects the values into
+# params, in the same order _compile_document hands out their slots.
+
+def _is_operators(condition):
+    return isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition)
+
+def _shape_document(filter_dict, params):
+    return tuple((field, _shape_clause(field, condition, params)) for field, condition in filter_dict.items())
+
+def _shape_clause(field, condition, params):
+    if field in _LOGICAL:
+        return tuple(_shape_document(sub, params) for sub in condition)
+    if _is_operators(condition):
+        return _shape_operators(condition, params)
+    params.append(condition)
+    return _kind(condition)
+
+def _shape_operators(condition, params):
+    shape = []
+    if "$regex" in condition:
+        params.append(_regex(condition))
+        shape.append("$regex")
+    for op, operand in condition.items():
+        if op in ("$regex", "$options"):
+            continue
+        if op == "$not" and isinstance(operand, dict):
+            shape.append((op, _shape_operators(operand, params)))
+            continue
+        if op in ("$in", "$nin"):
+            operand = list(operand)
+        elif op == "$exists":
+            operand = bool(operand)
+        params.append(operand)
+        shape.append((op, _kind(operand)) if op in ("$eq", "$ne") else op)
+    return tuple(shape)
+
+def _kind(value):
+    """Equality against a regex, None or anything else compiles differently, so it is part of the shape"""
+    if isinstance(value, re.Pattern):
+        return "regex"
+    if value is None:
+        return "null"
+    return "value"
+
+def _regex(condition):
+    pattern = condition["$regex"]
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    for option in condition.get("$options", ""):
+        flags |= _REGEX_FLAGS.get(option, 0)
+    # re keeps its own cache of compiled patterns
+    return re.compile(pattern, flags)
+
+def _index_keys(filter_dict):
+    keys = {}
+    for field, condition in filter_dict.items():
+        if field.startswith("$") or "." in field:
+            continue
+        if isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+            if "$eq" in condition and not isinstance(condition["$eq"], re.Pattern):
+                keys[field] = [condition["$eq"]]
+            elif "$in" in condition and not isinstance(condition["$in"], re.Pattern):
+                values = list(condition["$in"])
+                # A regex alternative can't be looked up in a hash index; leave the field to the scan
+                if not any(isinstance(value, re.Pattern) for value in values):
+                    keys[field] = values
+        elif not isinstance(condition, re.Pattern):
+            keys[field] = [condition]
+    return keys
+
+def _resolve(doc, parts):
+    """Collect the values at a dotted path, descending into arrays like MongoDB does"""
+    values = [doc]
+    for part in parts:
+        next_values = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    next_values.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    next_values.append(value[int(part)])
+                for item in value:
+                    if isinstance(item, dict) and part in item:
+                        next_values.append(item[part])
+        values = next_values
+        if not values:
+            break
+    return values
+
+def _expand(values):
+    """Values to test a condition against: each value plus the elements of array values"""
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+def _compile_document(filter_dict, slots):
+    predicates = [_compile_clause(field, condition, slots) for field, condition in filter_dict.items()]
+    if not predicates:
+        return lambda doc, params: True
+    if len(predicates) == 1:
+        return predicates[0]
+    return lambda doc, params: all(predicate(doc, params) for predicate in predicates)
+
+def _compile_clause(field, condition, slots):
+    if field in _LOGICAL:
+        parts = [_compile_document(sub, slots) for sub in condition]
+        if field == "$and":
+            return lambda doc, params: all(part(doc, params) for part in parts)
+        if field == "$or":
+            return lambda doc, params: any(part(doc, params) for part in parts)
+        return lambda doc, params: not any(part(doc, params) for part in parts)
+    if field.startswith("$"):
+        raise ValueError(f"Unsupported query operator: {field}")
+
+    if "." in field:
+        parts = field.split(".")
+        getter = lambda doc: _resolve(doc, parts)
+    else:
+        getter = lambda doc: [doc[field]] if field in doc else []
+
+    if _is_operators(condition):
+        tests = _compile_operators(condition, slots)
+        return lambda doc, params: all(test(getter(doc), params) for test in tests)
+    test = _equality_test(_kind(condition), next(slots))
+    return lambda doc, params: test(getter(doc), params)
+
+def _equality_test(kind, slot):
+    if kind == "regex":
+        return lambda values, params: _search(values, params[slot])
+    if kind == "null":
+        return lambda values, params: _is_null(values)
+    return lambda values, params: _equal(values, params[slot])
+
+def _equals(values, expected):
+    """Equality test for values only known at match time ($in and $nin elements)"""
+    if isinstance(expected, re.Pattern):
+        return _search(values, expected)
+    if expected is None:
+        return _is_null(values)
+    return _equal(values, expected)
+
+def _is_null(values):
+    # Mongo treats {field: None} as "null or missing"
+    return not values or any(value is None for value in _expand(values))
+
+def _equal(values, expected):
+    for value in _expand(values):
+        try:
+            if value == expected:
+                return True
+        except Exception:
+            pass
+    return False
+
+def _search(values, pattern):
+    return any(isinstance(value, str) and pattern.search(value) for value in _expand(values))
+
+_COMPARE = {
+    "$gt": lambda a, b: a > b,
+    "$gte": lambda a, b: a >= b,
+    "$lt": lambda a, b: a < b,
+    "$lte": lambda a, b: a <= b,
+}
+
+def _compare(values, compare, bound):
+    for value in _expand(values):
+        if value is None or isinstance(value, list):
+            continue
+        try:
+            if compare(value, bound):
+                return True
+        except TypeError:
+            # Mongo only compares values of the same type
+            continue
+    return False
+
+def _compile_operators(condition, slots):
+    tests = []
+    if "$regex" in condition:
+        slot = next(slots)
+        tests.append(lambda values, params: _search(values, params[slot]))
+    for op, operand in condition.items():
+        if op in ("$regex", "$options"):
+            continue
+        if op == "$not" and isinstance(operand, dict):
+            inner = _compile_operators(operand, slots)
+            tests.append(lambda values, params, inner=inner: not all(test(values, params) for test in inner))
+        else:
+            tests.append(_operator_test(op, operand, next(slots)))
+    return tests
+
+def _operator_test(op, operand, slot):
+    if op == "$eq":
+        return _equality_test(_kind(operand), slot)
+    if op == "$ne":
+        eq = _equality_test(_kind(operand), slot)
+        return lambda values, params: not eq(values, params)
+    if op == "$in":
+        return lambda values, params: any(_equals(values, expected) for expected in params[slot])
+    if op == "$nin":
+        return lambda values, params: not any(_equals(values, expected) for expected in params[slot])
+    if op in _COMPARE:
+        compare = _COMPARE[op]
+        return lambda values, params: _compare(values, compare, params[slot])
+    if op == "$exists":
+        return lambda values, params: bool(values) == params[slot]
+    if op == "$not":
+        return lambda values, params: not _search(values, params[slot])
+    raise ValueError(f"Unsupported query operator: {op}")
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from models import Booking, BookingCreate, User
-from auth import get_current_user
+from models import Booking, BookingCreate, User, UserClaims
+from auth import get_current_user, get_current_claims
 from database import db
-from typing import List
+from booking_slots import slot_index, SlotConflict
+from typing import List, Optional
 from datetime import datetime
 import logging
 from email_service import send_confirmation_email, send_cancellation_email, send_rescheduled_email
@@ -11,8 +12,28 @@ from email_templates import EmailTemplate
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+async def claim_slot(provider_id, appointment_time, duration_minutes=None, booking_id=None):
+    """
+    Reserve the provider's time for a booking, or answer 409 if it overlaps another appointment.
+    The caller writes the booking, then commits the slot, or releases it if the write doesn't happen.
+    """
+    await slot_index.ensure_built(db)
+    try:
+        slot = slot_index.claim(provider_id, appointment_time, duration_minutes, booking_id)
+        checked = False
+        try:
+            # The index holds this worker's claims; the database also has other workers' bookings
+            await slot_index.check_database(db, slot, booking_id)
+            checked = True
+        finally:
+            if not checked:
+                slot_index.release(slot)
+    except SlotConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return slot
+
 @router.post("/", response_model=Booking)
-async def create_booking(booking: BookingCreate, current_user: User = Depends(get_current_user)):
+async def create_booking(booking: BookingCreate, current_user: UserClaims = Depends(get_current_claims)):
     """Create a new booking using the authenticated user's ID"""
     logger.info(f"=== BOOKING REQUEST RECEIVED ===")
     logger.info(f"Current user: {current_user.email} (ID: {current_user.id})")
@@ -66,9 +87,17 @@ async def create_booking(booking: BookingCreate, current_user: User = Depends(ge
             "education": provider.get("education")
         }
 
-        # Insert booking into the database
+        # Hold the slot while the booking is written, so a concurrent request can't take it too
+        slot = await claim_slot(booking.provider_id, booking.appointment_time, booking.duration_minutes)
         logger.info(f"Inserting booking into database...")
-        result = await db.bookings.insert_one(booking_dict)
+        committed = False
+        try:
+            result = await db.bookings.insert_one(booking_dict)
+            slot_index.commit(slot, result.inserted_id)
+            committed = True
+        finally:
+            if not committed:
+                slot_index.release(slot)
         booking_dict["_id"] = str(result.inserted_id)
         
         logger.info(f"Booking created successfully with ID: {booking_dict['_id']}")
@@ -110,34 +139,44 @@ async def confirm_booking(
             if not provider:
                 raise HTTPException(status_code=404, detail="Provider not found")
             
-            # Update the existing booking status to confirmed with provider details
-            result = await db.bookings.update_one(
-                {"_id": existing_booking["_id"]},
-                {"$set": {
-                    "status": "confirmed", 
-                    "confirmed_at": datetime.utcnow(),
-                    "appointment_time": booking.appointment_time,
-                    "provider_details": {
-                        "name": provider["name"],
-                        "specialty": provider["specialty"],
-                        "address": provider["address"],
-                        "city": provider.get("city"),
-                        "state": provider.get("state"),
-                        "pincode": provider.get("pincode"),
-                        "phone": provider["phone"],
-                        "email": provider["email"],
-                        "rating": provider["rating"],
-                        "wait_time": provider["wait_time"],
-                        "accepted_insurances": provider["accepted_insurances"],
-                        "experience": provider.get("experience"),
-                        "education": provider.get("education")
-                    },
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-            
-            if result.modified_count == 0:
-                raise HTTPException(status_code=400, detail="Failed to confirm booking")
+            duration_minutes = booking.duration_minutes or existing_booking.get("duration_minutes")
+            slot = await claim_slot(booking.provider_id, booking.appointment_time, duration_minutes,
+                                    booking_id=existing_booking["_id"])
+            committed = False
+            try:
+                # Update the existing booking status to confirmed with provider details
+                result = await db.bookings.update_one(
+                    {"_id": existing_booking["_id"]},
+                    {"$set": {
+                        "status": "confirmed", 
+                        "confirmed_at": datetime.utcnow(),
+                        "appointment_time": booking.appointment_time,
+                        "duration_minutes": duration_minutes,
+                        "provider_details": {
+                            "name": provider["name"],
+                            "specialty": provider["specialty"],
+                            "address": provider["address"],
+                            "city": provider.get("city"),
+                            "state": provider.get("state"),
+                            "pincode": provider.get("pincode"),
+                            "phone": provider["phone"],
+                            "email": provider["email"],
+                            "rating": provider["rating"],
+                            "wait_time": provider["wait_time"],
+                            "accepted_insurances": provider["accepted_insurances"],
+                            "experience": provider.get("experience"),
+                            "education": provider.get("education")
+                        },
+                        "updated_at": datetime.utcnow()
+                    }}
+                )
+                if result.modified_count == 0:
+                    raise HTTPException(status_code=400, detail="Failed to confirm booking")
+                slot_index.commit(slot, existing_booking["_id"])
+                committed = True
+            finally:
+                if not committed:
+                    slot_index.release(slot)
             
             # Prepare email data
             intake_form_data = await db.intake.find_one({"user_id": current_user.id})
@@ -201,7 +240,15 @@ async def confirm_booking(
                 "education": provider.get("education")
             }
             
-            result = await db.bookings.insert_one(booking_dict)
+            slot = await claim_slot(booking.provider_id, booking.appointment_time, booking.duration_minutes)
+            committed = False
+            try:
+                result = await db.bookings.insert_one(booking_dict)
+                slot_index.commit(slot, result.inserted_id)
+                committed = True
+            finally:
+                if not committed:
+                    slot_index.release(slot)
             booking_dict["_id"] = str(result.inserted_id)
 
             # Prepare email data
@@ -233,7 +280,7 @@ async def confirm_booking(
 @router.get("/user/{user_id}", response_model=List[Booking])
 async def get_user_bookings(
     user_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: UserClaims = Depends(get_current_claims)
 ):
     """Get all bookings for a user (only for the current user)"""
     try:
@@ -264,10 +311,28 @@ async def get_provider_bookings(provider_id: str):
         logger.error(f"Error fetching provider bookings: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.get("/provider/{provider_id}/availability")
+async def check_provider_availability(
+    provider_id: str,
+    time: datetime = Query(..., description="Appointment time in ISO format"),
+    duration_minutes: Optional[int] = Query(None, gt=0, le=24 * 60, description="Appointment length in minutes"),
+):
+    """Whether the provider is free for an appointment at the given time"""
+    try:
+        await slot_index.ensure_built(db)
+        taken = slot_index.conflict(provider_id, time, duration_minutes)
+        availability = {"provider_id": provider_id, "appointment_time": time, "available": taken is None}
+        if taken is not None:
+            availability["conflict"] = {"start": taken.start, "end": taken.end}
+        return availability
+    except Exception as e:
+        logger.error(f"Error checking provider availability: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.delete("/cancel/{booking_id}")
 async def cancel_booking(
     booking_id: str,
-    current_user: User = Depends(get_current_user)
+    current_user: UserClaims = Depends(get_current_claims)
 ):
     """Cancel a booking (only for the booking owner)"""
     try:
@@ -296,6 +361,7 @@ async def cancel_booking(
         result = await db.bookings.delete_one({"_id": booking_object_id})
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Booking not found or already cancelled")
+        slot_index.remove(booking["_id"])
         
         # Send cancellation email
         try:
@@ -328,7 +394,7 @@ async def cancel_booking(
 async def reschedule_booking(
     booking_id: str, 
     new_time: str = Query(..., description="New appointment time in ISO format"),
-    current_user: User = Depends(get_current_user)
+    current_user: UserClaims = Depends(get_current_claims)
 ):
     """Reschedule a booking (only for the booking owner)"""
     try:
@@ -360,17 +426,26 @@ async def reschedule_booking(
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid date/time format. Use ISO format: YYYY-MM-DDTHH:MM:SS")
         
-        result = await db.bookings.update_one(
-            {"_id": booking_object_id},
-            {"$set": {
-                "appointment_time": new_time_dt, 
-                "status": "pending", 
-                "rescheduled_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }}
-        )
-        if result.modified_count == 0:
-            raise HTTPException(status_code=404, detail="Booking not found or could not be rescheduled")
+        slot = await claim_slot(booking["provider_id"], new_time_dt, booking.get("duration_minutes"),
+                                booking_id=booking["_id"])
+        committed = False
+        try:
+            result = await db.bookings.update_one(
+                {"_id": booking_object_id},
+                {"$set": {
+                    "appointment_time": new_time_dt, 
+                    "status": "pending", 
+                    "rescheduled_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow()
+                }}
+            )
+            if result.modified_count == 0:
+                raise HTTPException(status_code=404, detail="Booking not found or could not be rescheduled")
+            slot_index.commit(slot, booking["_id"])
+            committed = True
+        finally:
+            if not committed:
+                slot_index.release(slot)
         
         # Send rescheduled email
         try:
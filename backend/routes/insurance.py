@@ -2,8 +2,8 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from typing import List, Optional
 from datetime import datetime
 from database import db
-from models import InsurancePlan, InsurancePlanCreate
-from auth import get_current_user
+from models import InsurancePlan, InsurancePlanCreate, UserClaims
+from auth import get_current_claims
 import logging
 
 logger = logging.getLogger(__name__)
@@ -51,7 +51,7 @@ async def get_insurance_plan(plan_id: str):
 @router.post("/", response_model=InsurancePlan)
 async def create_insurance_plan(
     plan: InsurancePlanCreate,
-    current_user: dict = Depends(get_current_user)
+    current_user: UserClaims = Depends(get_current_claims)
 ):
     """Create a new insurance plan (admin only)"""
     try:
@@ -75,7 +75,7 @@ async def create_insurance_plan(
 async def update_insurance_plan(
     plan_id: str,
     plan_update: InsurancePlanCreate,
-    current_user: dict = Depends(get_current_user)
+    current_user: UserClaims = Depends(get_current_claims)
 ):
     """Update an existing insurance plan"""
     try:
@@ -107,7 +107,7 @@ async def update_insurance_plan(
 @router.delete("/{plan_id}")
 async def delete_insurance_plan(
     plan_id: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: UserClaims = Depends(get_current_claims)
 ):
     """Delete an insurance plan"""
     try:
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from database import db
 from models import IntakeForm
+from symptoms import extract_symptoms
 
 router = APIRouter()
 
@@ -18,6 +19,10 @@ async def submit_intake(form: IntakeForm):
         else:
             # Single symptom, convert to list
             form_dict["primarySymptoms"] = [symptoms_str.strip()] if symptoms_str.strip() else []
+
+    # Canonical symptom codes recognized in the free text, usable as /api/providers/match/?symptom_codes=
+    form.symptomCodes = extract_symptoms(form.primarySymptoms, form.detailedDescription)
+    form_dict["symptomCodes"] = form.symptomCodes
     
     existing = await db.intake.find_one({"user_id": form.user_id})
     if existing:
@@ -1,196 +1,148 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from database import db
-from models import Provider
+from models import Provider, MatchQuery
 from typing import List, Optional
-import re
-import logging
-from collections.abc import AsyncIterable
 import asyncio
+import json
+import logging
+from provider_index import provider_index
+from matching import match, match_many, parse_symptoms
+from match_cache import match_cache
+from symptoms import symptom_name
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Batch queries ranked between yields to the event loop
+MATCH_BATCH_CHUNK = 256
+
+def with_symptom_codes(symptoms, codes):
+    """Symptoms list extended with the canonical names of symptom codes"""
+    return parse_symptoms(symptoms) + [symptom_name(code) for code in codes if symptom_name(code)]
+
+def provider_filters(
+    specialty: Optional[List[str]] = Query(None, description="Specialty (any of, synonyms accepted)"),
+    city: Optional[List[str]] = Query(None, description="City (any of)"),
+    state: Optional[List[str]] = Query(None, description="State (any of)"),
+    pincode: Optional[List[str]] = Query(None, description="Pincode prefix (any of)"),
+    insurance: Optional[List[str]] = Query(None, description="Accepted insurance (any of)"),
+    min_rating: Optional[float] = Query(None, description="Minimum rating"),
+    max_wait: Optional[int] = Query(None, description="Maximum wait time in minutes"),
+):
+    return {"specialty": specialty, "city": city, "state": state, "pincode": pincode,
+            "insurance": insurance, "min_rating": min_rating, "max_wait": max_wait}
+
 @router.get("/", response_model=List[Provider])
-async def list_providers():
-    """Get all available providers"""
+async def list_providers(filters: dict = Depends(provider_filters)):
+    """Get all available providers, optionally filtered (criteria are ANDed, repeated values ORed)"""
     try:
+        if any(value is not None for value in filters.values()):
+            await provider_index.ensure_built(db)
+            providers = provider_index.filtered(**filters)
+            return [Provider(**p).dict(by_alias=True) for p in providers]
         providers = []
-        find_result = db.providers.find()
-        # If Motor, find_result is async iterable; if in-memory, it's a coroutine returning a list
-        if isinstance(find_result, AsyncIterable):
-            async for p in find_result:
-                p["_id"] = str(p["_id"])
-                providers.append(Provider(**p).dict(by_alias=True))
-        else:
-            # Await coroutine and iterate as list
-            for p in await find_result:
-                p["_id"] = str(p["_id"])
-                providers.append(Provider(**p).dict(by_alias=True))
+        async for p in db.providers.find():
+            p["_id"] = str(p["_id"])
+            providers.append(Provider(**p).dict(by_alias=True))
         return providers
     except Exception as e:
         logger.error(f"Error fetching providers: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.get("/facets")
+async def provider_facets(filters: dict = Depends(provider_filters)):
+    """Number of providers matching the filters, and how they break down by specialty, city, state and insurance"""
+    try:
+        await provider_index.ensure_built(db)
+        bitmap = provider_index.bitmaps.filter(**filters)
+        return {"total": provider_index.bitmaps.count(bitmap), "facets": provider_index.bitmaps.facets(bitmap)}
+    except Exception as e:
+        logger.error(f"Error computing provider facets: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.get("/match/", response_model=List[Provider])
 async def match_providers(
     symptoms: Optional[str] = Query(None, description="Comma-separated symptoms"),
+    symptom_codes: Optional[str] = Query(None, description="Comma-separated symptom codes, e.g. an intake form's symptomCodes"),
     insurance: Optional[str] = Query(None, description="Insurance provider"),
     location: Optional[str] = Query(None, description="City or location"),
     urgency: Optional[str] = Query(None, description="Urgency level"),
-    limit: int = Query(3, description="Number of providers to return")
+    limit: int = Query(3, description="Number of providers to return"),
+    near: Optional[str] = Query(None, description="Search around a point, as 'lat,lng'"),
+    radius_km: float = Query(25, gt=0, description="Search radius in km when 'near' is given")
 ):
     """
     Match providers based on symptoms, insurance, and location.
     Returns top providers that best match the criteria, with scores normalized to 100%.
     This endpoint only returns provider information without storing it.
+    Candidates come from the in-process provider index instead of a full collection scan,
+    and rankings are cached per normalized query until a provider changes.
+    With `near`, only providers within `radius_km` are returned, and closer ones score higher.
     """
+    point = None
+    if near:
+        try:
+            lat, lng = (float(part) for part in near.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="near must be 'lat,lng'")
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise HTTPException(status_code=400, detail="near is out of range")
+        point = (lat, lng)
+    if symptom_codes:
+        try:
+            codes = [int(code) for code in symptom_codes.split(",") if code.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="symptom_codes must be comma-separated integers")
+        symptoms = with_symptom_codes(symptoms, codes)
     try:
-        all_providers = []
-        find_result = db.providers.find()
-        if isinstance(find_result, AsyncIterable):
-            async for p in find_result:
-                p["_id"] = str(p["_id"])
-                all_providers.append(p)
-        else:
-            for p in await find_result:
-                p["_id"] = str(p["_id"])
-                all_providers.append(p)
-        if not all_providers:
-            return []
-
-        scored_providers = []
-        for provider in all_providers:
-            reasons = []
-            insurance_score = 0
-            location_score = 0
-            symptom_score = 0
-            bonus_score = 0
-            # Insurance matching (up to 35 points) - Case-insensitive
-            if insurance and provider.get("accepted_insurances"):
-                insurance_lower = insurance.lower()
-                provider_insurances = [ins.lower() for ins in provider["accepted_insurances"]]
-                if any(insurance_lower in ins for ins in provider_insurances):
-                    insurance_score = 35
-                    reasons.append(f"Accepts {insurance}")
-            # Location matching (up to 20 points) - Case-insensitive
-            if location and provider.get("city"):
-                if location.lower() == provider.get("city").lower():
-                    location_score = 20
-                    reasons.append(f"Located in {provider['city']}")
-            # Symptom-specialty matching (up to 35 points for mapped, 30 for generalist)
-            if symptoms and provider.get("specialty"):
-                if isinstance(symptoms, str):
-                    symptoms_list = [s.strip().lower() for s in symptoms.split(",")]
-                else:
-                    symptoms_list = [s.strip().lower() for s in symptoms]
-                specialty_lower = provider["specialty"].lower()
-                generalist_terms = ["general physician", "internal medicine", "family medicine"]
-                symptom_specialty_map = {
-                    "rash": ["dermatology", "general physician", "internal medicine"],
-                    "diarrhea": ["gastroenterology", "internal medicine", "general physician", "family medicine"],
-                    "fever": ["internal medicine", "general physician", "family medicine", "pediatrics"],
-                    "cough": ["pulmonologist", "internal medicine", "general physician", "family medicine"],
-                    "headache": ["neurology", "internal medicine", "general physician"],
-                    "chest pain": ["cardiology", "internal medicine", "general physician"],
-                    "back pain": ["orthopedics", "general physician", "internal medicine"],
-                    "joint pain": ["orthopedics", "rheumatology", "general physician"],
-                    "fatigue": ["internal medicine", "general physician", "family medicine"],
-                    "shortness of breath": ["pulmonologist", "cardiology", "internal medicine"],
-                    "abdominal pain": ["gastroenterology", "internal medicine", "general physician"],
-                    "dizziness": ["neurology", "internal medicine", "general physician"],
-                    "sore throat": ["ent", "internal medicine", "general physician"],
-                    "vomiting": ["gastroenterology", "internal medicine", "general physician"],
-                    "nausea": ["gastroenterology", "internal medicine", "general physician"]
-                }
-                for symptom in symptoms_list:
-                    if symptom in symptom_specialty_map:
-                        if specialty_lower in symptom_specialty_map[symptom]:
-                            symptom_score = max(symptom_score, 35)
-                            reasons.append(f"Specializes in {symptom} treatment")
-                        elif any(term in specialty_lower for term in generalist_terms):
-                            symptom_score = max(symptom_score, 30)
-                            reasons.append(f"Can treat {symptom}")
-            # Calculate base score (insurance + location + symptom)
-            base_score = insurance_score + location_score + symptom_score
-            # Bonus: rating, wait time, experience (up to 10 points, but capped so total is 100)
-            bonus_points = 0
-            if provider.get("rating"):
-                try:
-                    bonus_points += min(float(provider["rating"]) * 2, 6)  # up to 6 points
-                    reasons.append(f"High rating: {provider['rating']}")
-                except Exception:
-                    pass
-            if provider.get("wait_time"):
-                wait_time_str = str(provider["wait_time"])
-                wait_minutes = re.findall(r'\d+', wait_time_str)
-                if wait_minutes:
-                    try:
-                        wait_time = int(wait_minutes[0])
-                        if wait_time <= 10:
-                            bonus_points += 2
-                            reasons.append("Quick wait time")
-                    except Exception:
-                        pass
-            if provider.get("experience"):
-                exp_str = str(provider["experience"])
-                exp_years = re.findall(r'\d+', exp_str)
-                if exp_years:
-                    try:
-                        years = int(exp_years[0])
-                        if years >= 15:
-                            bonus_points += 2
-                            reasons.append("Highly experienced")
-                    except Exception:
-                        pass
-            # Cap bonus so total does not exceed 100
-            max_bonus = max(0, 100 - base_score)
-            bonus_score = min(bonus_points, max_bonus)
-            total_score = base_score + bonus_score
-            percent_score = round(total_score, 2)
-            if percent_score > 0:
-                scored_providers.append({
-                    **provider,
-                    "match_score": percent_score,
-                    "match_reasons": reasons
-                })
-        # Sort by normalized score (highest first) and return top providers
-        scored_providers.sort(key=lambda x: x["match_score"], reverse=True)
-        top_providers = scored_providers[:limit]
-
-        # If no providers matched, return top N by rating as fallback
-        if not top_providers:
-            fallback = sorted(all_providers, key=lambda x: x.get("rating", 0), reverse=True)[:limit]
-            for p in fallback:
-                p["_id"] = str(p["_id"])
-                if "match_score" not in p:
-                    p["match_score"] = 0
-                if "match_reasons" not in p:
-                    p["match_reasons"] = ["Selected based on high rating"]
-            return fallback
-
-        return top_providers
+        await provider_index.ensure_built(db)
+        return match(provider_index, symptoms, insurance, location, urgency, limit, point, radius_km, cache=match_cache)
     except Exception as e:
         logger.error(f"Error in provider matching: {e}")
         # Fallback: return all providers if matching fails
         providers = []
-        find_result = db.providers.find()
-        if isinstance(find_result, AsyncIterable):
-            async for p in find_result:
-                p["_id"] = str(p["_id"])
-                if "match_score" not in p:
-                    p["match_score"] = 0
-                if "match_reasons" not in p:
-                    p["match_reasons"] = ["Selected as fallback"]
-                providers.append(Provider(**p).dict(by_alias=True))
-        else:
-            for p in await find_result:
-                p["_id"] = str(p["_id"])
-                if "match_score" not in p:
-                    p["match_score"] = 0
-                if "match_reasons" not in p:
-                    p["match_reasons"] = ["Selected as fallback"]
-                providers.append(Provider(**p).dict(by_alias=True))
-        return providers[:limit]
+        async for p in db.providers.find().limit(limit):
+            p["_id"] = str(p["_id"])
+            if "match_score" not in p:
+                p["match_score"] = 0
+            if "match_reasons" not in p:
+                p["match_reasons"] = ["Selected as fallback"]
+            providers.append(Provider(**p).dict(by_alias=True))
+        return providers
+
+@router.post("/match/batch")
+async def match_providers_batch(queries: List[MatchQuery]):
+    """
+    Match providers for many queries in one request.
+    Providers are indexed once and queries are ranked together, sharing work between
+    queries with the same insurance, city or symptoms. Results stream back as NDJSON,
+    one line per query in input order: {"index": i, "providers": [...]}.
+    """
+    await provider_index.ensure_built(db)
+
+    def as_dict(query):
+        symptoms = query.symptoms
+        if query.symptom_codes:
+            symptoms = with_symptom_codes(symptoms, query.symptom_codes)
+        return {"symptoms": symptoms, "insurance": query.insurance, "location": query.location,
+                "urgency": query.urgency, "limit": query.limit}
+
+    async def results():
+        for start in range(0, len(queries), MATCH_BATCH_CHUNK):
+            chunk = queries[start:start + MATCH_BATCH_CHUNK]
+            try:
+                matches = match_many(provider_index, [as_dict(query) for query in chunk], cache=match_cache)
+                lines = [{"index": start + offset, "providers": [Provider(**p).dict(by_alias=True) for p in providers]}
+                         for offset, providers in enumerate(matches)]
+            except Exception as e:
+                logger.error(f"Error in batch provider matching: {e}")
+                lines = [{"index": start + offset, "error": "Internal server error"} for offset in range(len(chunk))]
+            yield "".join(json.dumps(line) + "\n" for line in lines)
+            # Let other requests run between chunks of a large batch
+            await asyncio.sleep(0)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 @router.get("/{provider_id}", response_model=Provider)
 async def get_provider(provider_id: str):
@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Request
+from fastapi.security import HTTPAuthorizationCredentials
 from pydantic import EmailStr
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
 from database import db
-from models import UserCreate, UserLogin, UserOut, Token, RefreshToken
-from auth import get_password_hash, verify_password, create_access_token, create_refresh_token, verify_refresh_token, get_current_user, ACCESS_TOKEN_EXPIRE_HOURS
+from models import UserCreate, UserLogin, UserOut, Token, RefreshToken, UserClaims
+from user_cache import user_cache
+from password_hashing import hash_password, verify_password, HashingOverloaded
+from admission import auth_admission, client_ip, Rejected
+from auth import create_access_token, create_refresh_token, verify_refresh_token, verify_access_token, get_current_user, get_current_claims, security, new_token_family, revoke_token_family, revoke_user_tokens, ACCESS_TOKEN_EXPIRE_HOURS
 from email_service import send_welcome_email
 from email_templates import EmailTemplate
 import logging
@@ -13,12 +18,23 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+def admit(request: Request, email: str):
+    """Admission ticket for a request that will hash a password, or a 429 before any hashing happens"""
+    ip = client_ip(request.client.host if request.client else "unknown", request.headers.get("x-forwarded-for"))
+    try:
+        return auth_admission.admit(ip, email)
+    except Rejected as e:
+        logger.warning(f"Turned away {request.url.path} for {email} from {ip}: {e.reason}")
+        raise HTTPException(status_code=429, detail=f"{e.reason}, please try again later",
+                            headers={"Retry-After": str(e.retry_after)})
+
 @router.get("/me", response_model=UserOut)
 async def get_current_user_info(current_user: UserOut = Depends(get_current_user)):
     return current_user.dict(by_alias=True)
 
 @router.post("/register", response_model=UserOut)
-async def register(user: UserCreate):
+async def register(user: UserCreate, request: Request):
+    ticket = admit(request, user.email)
     try:
         logger.info(f"Attempting to register user: {user.email}")
         
@@ -30,12 +46,19 @@ async def register(user: UserCreate):
         
         # Prepare user data
         user_dict = user.dict()
-        user_dict["password"] = get_password_hash(user.password)
+        user_dict["password"] = await hash_password(user.password)
+        ticket.release()
         user_dict["created_at"] = datetime.utcnow()
         
-        # Insert user into database
-        result = await db.users.insert_one(user_dict)
+        # Insert user into database (the unique email index catches concurrent registrations)
+        try:
+            result = await db.users.insert_one(user_dict)
+        except DuplicateKeyError:
+            logger.warning(f"Registration failed: Email already exists - {user.email}")
+            raise HTTPException(status_code=400, detail="Email already registered")
         user_dict["_id"] = str(result.inserted_id)
+        # Forget any "no such user" entry cached for this id
+        user_cache.invalidate(result.inserted_id)
         
         # Send welcome email
         try:
@@ -57,12 +80,18 @@ async def register(user: UserCreate):
         
     except HTTPException:
         raise
+    except HashingOverloaded as e:
+        logger.warning(f"Registration turned away: {e}")
+        raise HTTPException(status_code=503, detail="Server busy, please try again", headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Registration error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error during registration")
+    finally:
+        ticket.release()
 
 @router.post("/login", response_model=Token)
-async def login(user: UserLogin):
+async def login(user: UserLogin, request: Request):
+    ticket = admit(request, user.email)
     try:
         logger.info(f"Login attempt for user: {user.email}")
         
@@ -73,13 +102,17 @@ async def login(user: UserLogin):
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         # Verify password
-        if not verify_password(user.password, db_user["password"]):
+        password_ok = await verify_password(user.password, db_user["password"])
+        ticket.release()
+        if not password_ok:
             logger.warning(f"Login failed: Invalid password - {user.email}")
             raise HTTPException(status_code=401, detail="Invalid credentials")
         
         # Create access and refresh tokens with extended expiration
-        access_token = create_access_token({"sub": str(db_user["_id"])})
-        refresh_token = create_refresh_token({"sub": str(db_user["_id"])})
+        claims = {"sub": str(db_user["_id"]), "fam": new_token_family()}
+        # The access token also carries who the user is, for routes that only need that
+        access_token = create_access_token({**claims, "name": db_user.get("name"), "email": db_user.get("email")})
+        refresh_token = create_refresh_token(claims)
         
         logger.info(f"User logged in successfully: {user.email}")
         logger.info(f"Access token expires in {ACCESS_TOKEN_EXPIRE_HOURS} hours")
@@ -93,9 +126,14 @@ async def login(user: UserLogin):
         
     except HTTPException:
         raise
+    except HashingOverloaded as e:
+        logger.warning(f"Login turned away: {e}")
+        raise HTTPException(status_code=503, detail="Server busy, please try again", headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error during login")
+    finally:
+        ticket.release()
 
 @router.post("/refresh", response_model=Token)
 async def refresh_token(refresh_token_data: RefreshToken):
@@ -111,8 +149,10 @@ async def refresh_token(refresh_token_data: RefreshToken):
             raise HTTPException(status_code=401, detail="User not found")
         
         # Create new access and refresh tokens
-        access_token = create_access_token({"sub": token_data.user_id})
-        new_refresh_token = create_refresh_token({"sub": token_data.user_id})
+        # New tokens stay in the same family, so logging out revokes the whole chain
+        claims = {"sub": token_data.user_id, "fam": token_data.family or new_token_family()}
+        access_token = create_access_token({**claims, "name": user.get("name"), "email": user.get("email")})
+        new_refresh_token = create_refresh_token(claims)
         
         logger.info(f"Token refreshed successfully for user: {user.get('email')}")
         
@@ -128,8 +168,20 @@ async def refresh_token(refresh_token_data: RefreshToken):
         logger.error(f"Token refresh error: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error during token refresh")
 
+@router.post("/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Revoke the access and refresh tokens from the current login; revocations are per worker process"""
+    token_data = verify_access_token(credentials.credentials)
+    if token_data.family:
+        revoke_token_family(token_data.family)
+    else:
+        # Tokens from before token families can only be revoked all at once
+        revoke_user_tokens(token_data.user_id)
+    logger.info(f"User {token_data.user_id} logged out")
+    return {"message": "Logged out successfully"}
+
 @router.get("/token-status")
-async def check_token_status(current_user: UserOut = Depends(get_current_user)):
+async def check_token_status(current_user: UserClaims = Depends(get_current_claims)):
     """Check if the current token is valid"""
     return {
         "valid": True,
@@ -142,7 +194,7 @@ async def check_token_status(current_user: UserOut = Depends(get_current_user)):
     }
 
 @router.get("/test-auth")
-async def test_auth(current_user: UserOut = Depends(get_current_user)):
+async def test_auth(current_user: UserClaims = Depends(get_current_claims)):
     """Test endpoint to verify authentication is working"""
     return {
         "message": "Authentication successful!",
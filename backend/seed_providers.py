@@ -5,6 +5,7 @@ Script to seed the database with sample healthcare providers
 import os
 import asyncio
 from motor.motor_asyncio import AsyncIOMotorClient
+from provider_normalization import normalize_provider
 
 MONGODB_URI = os.getenv("MONGODB_URI")
 DB_NAME = "smartcare"
@@ -672,7 +673,7 @@ async def seed():
         
         # Insert new providers
         print("Inserting new providers...")
-        result = await db.providers.insert_many(providers)
+        result = await db.providers.insert_many([normalize_provider(p) for p in providers])
         print(f"✓ Successfully inserted {len(result.inserted_ids)} providers")
         
         # Verify insertion
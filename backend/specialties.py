@@ -0,0 +1,131 @@
+"""
+Canonical specialty taxonomy.
+
+Providers list their specialty in free form ("Cardiologist", "Cardiology",
+"Orthopedic Surgeon", "ENT Specialist"). specialty_code() maps any of those
+to one integer code, once, when a provider is written. Matching then works
+on codes: each symptom maps to a set of specialty codes and a provider
+treats it if its code is in that set.
+"""
+import re
+
+GENERAL_PHYSICIAN = 1
+INTERNAL_MEDICINE = 2
+FAMILY_MEDICINE = 3
+PEDIATRICS = 4
+CARDIOLOGY = 5
+DERMATOLOGY = 6
+GASTROENTEROLOGY = 7
+PULMONOLOGY = 8
+NEUROLOGY = 9
+ORTHOPEDICS = 10
+RHEUMATOLOGY = 11
+ENT = 12
+GENERAL_SURGERY = 13
+GYNECOLOGY = 14
+OPHTHALMOLOGY = 15
+PSYCHIATRY = 16
+DENTISTRY = 17
+UROLOGY = 18
+NEPHROLOGY = 19
+ONCOLOGY = 20
+ENDOCRINOLOGY = 21
+
+# Canonical name and the other ways the same specialty gets written
+SPECIALTIES = {
+    GENERAL_PHYSICIAN: ("general physician", ["general practitioner", "gp", "general medicine", "primary care physician",
+                                              "primary care"]),
+    INTERNAL_MEDICINE: ("internal medicine", ["internist", "internal medicine physician"]),
+    FAMILY_MEDICINE: ("family medicine", ["family physician", "family practice", "family doctor"]),
+    PEDIATRICS: ("pediatrics", ["paediatrics", "pediatrician", "paediatrician", "child specialist"]),
+    CARDIOLOGY: ("cardiology", ["cardiologist", "heart specialist"]),
+    DERMATOLOGY: ("dermatology", ["dermatologist", "skin specialist"]),
+    GASTROENTEROLOGY: ("gastroenterology", ["gastroenterologist", "gastro"]),
+    PULMONOLOGY: ("pulmonology", ["pulmonologist", "pulmonary medicine", "chest physician", "respiratory medicine"]),
+    NEUROLOGY: ("neurology", ["neurologist"]),
+    ORTHOPEDICS: ("orthopedics", ["orthopaedics", "orthopedic", "orthopaedic", "orthopedic surgeon",
+                                  "orthopaedic surgeon", "orthopedist", "orthopedic surgery"]),
+    RHEUMATOLOGY: ("rheumatology", ["rheumatologist"]),
+    ENT: ("ent", ["ent specialist", "otolaryngology", "otolaryngologist", "otorhinolaryngology", "ear nose throat"]),
+    GENERAL_SURGERY: ("general surgery", ["general surgeon", "surgeon", "surgery"]),
+    GYNECOLOGY: ("gynecology", ["gynaecology", "gynecologist", "gynaecologist", "obstetrics and gynecology",
+                                "obstetrics gynecology", "obgyn", "ob gyn", "obstetrician"]),
+    OPHTHALMOLOGY: ("ophthalmology", ["ophthalmologist", "eye specialist"]),
+    PSYCHIATRY: ("psychiatry", ["psychiatrist"]),
+    DENTISTRY: ("dentistry", ["dentist", "dental surgeon", "dental"]),
+    UROLOGY: ("urology", ["urologist"]),
+    NEPHROLOGY: ("nephrology", ["nephrologist"]),
+    ONCOLOGY: ("oncology", ["oncologist"]),
+    ENDOCRINOLOGY: ("endocrinology", ["endocrinologist"]),
+}
+
+# Generalists can treat any mapped symptom, for 30 points instead of 35
+GENERALISTS = frozenset([GENERAL_PHYSICIAN, INTERNAL_MEDICINE, FAMILY_MEDICINE])
+
+SYMPTOM_SPECIALTIES = {
+    "rash": frozenset([DERMATOLOGY, GENERAL_PHYSICIAN, INTERNAL_MEDICINE]),
+    "diarrhea": frozenset([GASTROENTEROLOGY, INTERNAL_MEDICINE, GENERAL_PHYSICIAN, FAMILY_MEDICINE]),
+    "fever": frozenset([INTERNAL_MEDICINE, GENERAL_PHYSICIAN, FAMILY_MEDICINE, PEDIATRICS]),
+    "cough": frozenset([PULMONOLOGY, INTERNAL_MEDICINE, GENERAL_PHYSICIAN, FAMILY_MEDICINE]),
+    "headache": frozenset([NEUROLOGY, INTERNAL_MEDICINE, GENERAL_PHYSICIAN]),
+    "chest pain": frozenset([CARDIOLOGY, INTERNAL_MEDICINE, GENERAL_PHYSICIAN]),
+    "back pain": frozenset([ORTHOPEDICS, GENERAL_PHYSICIAN, INTERNAL_MEDICINE]),
+    "joint pain": frozenset([ORTHOPEDICS, RHEUMATOLOGY, GENERAL_PHYSICIAN]),
+    "fatigue": frozenset([INTERNAL_MEDICINE, GENERAL_PHYSICIAN, FAMILY_MEDICINE]),
+    "shortness of breath": frozenset([PULMONOLOGY, CARDIOLOGY, INTERNAL_MEDICINE]),
+    "abdominal pain": frozenset([GASTROENTEROLOGY, INTERNAL_MEDICINE, GENERAL_PHYSICIAN]),
+    "dizziness": frozenset([NEUROLOGY, INTERNAL_MEDICINE, GENERAL_PHYSICIAN]),
+    "sore throat": frozenset([ENT, INTERNAL_MEDICINE, GENERAL_PHYSICIAN]),
+    "vomiting": frozenset([GASTROENTEROLOGY, INTERNAL_MEDICINE, GENERAL_PHYSICIAN]),
+    "nausea": frozenset([GASTROENTEROLOGY, INTERNAL_MEDICINE, GENERAL_PHYSICIAN]),
+}
+
+# Words that say nothing about the specialty itself
+_FILLER_WORDS = {"specialist", "consultant", "doctor", "dr", "senior", "junior", "department", "of"}
+
+# Suffix variants, tried in order on each word: "cardiologist" -> "cardiology", "pediatrician" -> "pediatrics"
+_SUFFIXES = [("ologist", "ology"), ("ician", "ics"), ("iatrist", "iatry")]
+
+_NON_LETTERS = re.compile(r"[^a-z]+")
+
+def normalize_name(name):
+    return _NON_LETTERS.sub(" ", name.lower()).strip()
+
+def _stem(word):
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix):
+            return word[:-len(suffix)] + replacement
+    return word
+
+_BY_NAME = {}
+for _code, (_name, _synonyms) in SPECIALTIES.items():
+    for _variant in [_name] + _synonyms:
+        _BY_NAME[normalize_name(_variant)] = _code
+
+_GENERALIST_NAMES = [normalize_name(name) for code in GENERALISTS
+                     for name in [SPECIALTIES[code][0]] + SPECIALTIES[code][1] if len(name) > 2]
+
+_cache = {}
+
+def specialty_code(specialty):
+    """Integer code for a free-form specialty, or None if it isn't recognized"""
+    if not specialty:
+        return None
+    if specialty in _cache:
+        return _cache[specialty]
+    name = normalize_name(specialty)
+    code = _BY_NAME.get(name)
+    if code is None:
+        words = [word for word in name.split() if word not in _FILLER_WORDS]
+        code = _BY_NAME.get(" ".join(words))
+        if code is None:
+            code = _BY_NAME.get(" ".join(_stem(word) for word in words))
+    if code is None:
+        # Longer titles that still name a generalist, e.g. "Senior General Physician & Diabetologist"
+        code = next((_BY_NAME[g] for g in _GENERALIST_NAMES if f" {g} " in f" {name} "), None)
+    if len(_cache) < 10000:
+        _cache[specialty] = code
+    return code
+
+def specialty_name(code):
+    return SPECIALTIES[code][0] if code in SPECIALTIES else None
@@ -0,0 +1,131 @@
+"""
+Canonical symptoms and free-text symptom extraction.
+
+Each symptom the matcher understands has an integer code, a canonical name
+(the key used in specialties.SYMPTOM_SPECIALTIES) and the phrases patients
+actually write for it. All phrases are compiled once, at import, into an
+Aho-Corasick automaton over words, so extracting symptoms from a
+description is a single pass over its words no matter how many phrases
+there are.
+"""
+import re
+from collections import deque
+
+RASH = 1
+DIARRHEA = 2
+FEVER = 3
+COUGH = 4
+HEADACHE = 5
+CHEST_PAIN = 6
+BACK_PAIN = 7
+JOINT_PAIN = 8
+FATIGUE = 9
+SHORTNESS_OF_BREATH = 10
+ABDOMINAL_PAIN = 11
+DIZZINESS = 12
+SORE_THROAT = 13
+VOMITING = 14
+NAUSEA = 15
+
+# Canonical name and the other ways patients describe the same symptom
+SYMPTOMS = {
+    RASH: ("rash", ["rashes", "skin rash", "hives", "itchy skin", "skin irritation", "red spots", "eczema"]),
+    DIARRHEA: ("diarrhea", ["diarrhoea", "loose motion", "loose motions", "loose stools", "watery stools", "runny stomach"]),
+    FEVER: ("fever", ["high temperature", "temperature", "feverish", "febrile", "chills", "pyrexia"]),
+    COUGH: ("cough", ["coughing", "dry cough", "wet cough", "chesty cough", "coughs"]),
+    HEADACHE: ("headache", ["headaches", "head ache", "head pain", "migraine", "migraines", "head hurts"]),
+    CHEST_PAIN: ("chest pain", ["chest ache", "chest tightness", "tight chest", "chest discomfort", "pain in my chest",
+                                "pain in chest", "chest hurts", "angina"]),
+    BACK_PAIN: ("back pain", ["backache", "back ache", "lower back pain", "back hurts", "sore back", "pain in my back"]),
+    JOINT_PAIN: ("joint pain", ["joint pains", "joint ache", "aching joints", "sore joints", "knee pain", "arthritis",
+                                "stiff joints"]),
+    FATIGUE: ("fatigue", ["tired", "tiredness", "exhausted", "exhaustion", "weakness", "lethargy", "no energy"]),
+    SHORTNESS_OF_BREATH: ("shortness of breath", ["breathless", "breathlessness", "short of breath",
+                                                  "difficulty breathing", "trouble breathing", "hard to breathe",
+                                                  "cant breathe", "wheezing"]),
+    ABDOMINAL_PAIN: ("abdominal pain", ["stomach ache", "stomachache", "stomach pain", "tummy ache", "belly pain",
+                                        "stomach cramps", "abdominal cramps", "pain in my stomach", "stomach hurts"]),
+    DIZZINESS: ("dizziness", ["dizzy", "lightheaded", "light headed", "vertigo", "head spinning"]),
+    SORE_THROAT: ("sore throat", ["throat pain", "scratchy throat", "painful swallowing", "throat hurts", "strep throat"]),
+    VOMITING: ("vomiting", ["vomit", "vomited", "throwing up", "threw up", "puking"]),
+    NAUSEA: ("nausea", ["nauseous", "nauseated", "queasy", "feel sick", "feeling sick"]),
+}
+
+_BY_NAME = {name: code for code, (name, _) in SYMPTOMS.items()}
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+def normalize_text(text):
+    """Lowercase and collapse punctuation/whitespace runs to single spaces"""
+    return _NON_WORD.sub(" ", text.lower().replace("'", ""))
+
+def symptom_name(code):
+    return SYMPTOMS[code][0] if code in SYMPTOMS else None
+
+def symptom_code(name):
+    return _BY_NAME.get(name)
+
+class PhraseMatcher:
+    """Aho-Corasick automaton over phrases, stepping a word at a time so matches always fall on word boundaries"""
+    def __init__(self, phrases):
+        self.transitions = [{}]
+        self.outputs = [[]]
+        for phrase, value in phrases:
+            state = 0
+            for word in phrase.split():
+                next_state = self.transitions[state].get(word)
+                if next_state is None:
+                    next_state = len(self.transitions)
+                    self.transitions[state][word] = next_state
+                    self.transitions.append({})
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append(value)
+        self._link()
+
+    def _link(self):
+        # Breadth-first, so every state's failure target is already complete when it's reached
+        self.failure = [0] * len(self.transitions)
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, next_state in self.transitions[state].items():
+                queue.append(next_state)
+                fallback = self.failure[state]
+                while fallback and word not in self.transitions[fallback]:
+                    fallback = self.failure[fallback]
+                target = self.transitions[fallback].get(word, 0)
+                self.failure[next_state] = target if target != next_state else 0
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.failure[next_state]]
+
+    def find(self, words):
+        """Values of every phrase found in a list of words, in order of appearance"""
+        transitions = self.transitions
+        failure = self.failure
+        outputs = self.outputs
+        found = []
+        state = 0
+        for word in words:
+            while state and word not in transitions[state]:
+                state = failure[state]
+            state = transitions[state].get(word, 0)
+            if outputs[state]:
+                found.extend(outputs[state])
+        return found
+
+_matcher = PhraseMatcher(
+    (normalize_text(phrase), code)
+    for code, (name, synonyms) in SYMPTOMS.items()
+    for phrase in [name] + synonyms
+)
+
+def extract_symptoms(*texts):
+    """Canonical symptom codes mentioned in free text, in order of first mention"""
+    codes = []
+    for text in texts:
+        if not text:
+            continue
+        for code in _matcher.find(normalize_text(text).split()):
+            if code not in codes:
+                codes.append(code)
+    return codes
@@ -0,0 +1,136 @@
+"""
+Cache of verified access tokens, and token revocation.
+
+The frontend sends the same bearer token on every request, so once a token
+has been decoded and its signature checked, its claims are kept until the
+token expires, keyed by a digest of the token (the token itself is never
+stored). A repeat verification is then a dict lookup.
+
+Tokens can be revoked for a whole user (every token issued before now) or
+for one token family: the access and refresh tokens descending from a
+single login. Revocation evicts the cached entries and remembers the
+revocation until any token it covers would have expired anyway. Both are
+per process: a revocation only applies on the worker that handled it, and
+other workers keep accepting the token until it expires.
+"""
+import os
+import time
+import hashlib
+from collections import OrderedDict
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+def token_digest(token):
+    return hashlib.sha256(token.encode()).digest()
+
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        # digest -> (exp, claims, user_id, family)
+        self.entries = OrderedDict()
+        self.by_user = {}
+        self.by_family = {}
+        # family -> time the revocation can be forgotten
+        self.revoked_families = {}
+        # user_id -> (revoked at, time the revocation can be forgotten)
+        self.revoked_users = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revocations = 0
+
+    def get(self, token):
+        """Claims cached for a token that hasn't expired, or None"""
+        digest = token_digest(token)
+        entry = self.entries.get(digest)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= time.time():
+            self._drop(digest)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(digest)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, token, claims, exp, user_id, family=None):
+        if self.maxsize <= 0:
+            return
+        digest = token_digest(token)
+        if digest in self.entries:
+            self._drop(digest)
+        self.entries[digest] = (exp, claims, user_id, family)
+        self.by_user.setdefault(user_id, set()).add(digest)
+        if family is not None:
+            self.by_family.setdefault(family, set()).add(digest)
+        while len(self.entries) > self.maxsize:
+            self._drop(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _drop(self, digest):
+        exp, claims, user_id, family = self.entries.pop(digest)
+        _discard(self.by_user, user_id, digest)
+        if family is not None:
+            _discard(self.by_family, family, digest)
+
+    # Revocation
+
+    def is_revoked(self, user_id, family=None, issued_at=None):
+        """Whether a token with these claims has been revoked; tokens without iat predate any revocation"""
+        if family is not None and family in self.revoked_families:
+            return True
+        revoked = self.revoked_users.get(user_id)
+        return revoked is not None and (issued_at is None or issued_at <= revoked[0])
+
+    def revoke_user(self, user_id, until):
+        """Reject every token issued to the user so far; `until` is when the last of them expires"""
+        now = time.time()
+        self._forget_expired(now)
+        self.revoked_users[user_id] = (now, until)
+        for digest in list(self.by_user.get(user_id, ())):
+            self._drop(digest)
+        self.revocations += 1
+
+    def revoke_family(self, family, until):
+        """Reject every token descended from one login; `until` is when the last of them expires"""
+        self._forget_expired(time.time())
+        self.revoked_families[family] = until
+        for digest in list(self.by_family.get(family, ())):
+            self._drop(digest)
+        self.revocations += 1
+
+    def _forget_expired(self, now):
+        # Revocations are only needed while a token they cover could still be presented
+        for family in [f for f, until in self.revoked_families.items() if until <= now]:
+            del self.revoked_families[family]
+        for user_id in [u for u, (_, until) in self.revoked_users.items() if until <= now]:
+            del self.revoked_users[user_id]
+
+    def clear(self):
+        self.entries.clear()
+        self.by_user.clear()
+        self.by_family.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "revocations": self.revocations,
+            "revoked_families": len(self.revoked_families),
+            "revoked_users": len(self.revoked_users),
+        }
+
+def _discard(mapping, key, value):
+    values = mapping.get(key)
+    if values is not None:
+        values.discard(value)
+        if not values:
+            del mapping[key]
+
+token_cache = TokenCache()
@@ -0,0 +1,104 @@
+"""
+Cache of authenticated users, keyed by user id.
+
+get_current_user runs on every protected request; with the cache, a user
+is looked up in the database at most once per TTL instead. Ids that don't
+exist are cached too, for a shorter time, so a token for a deleted user
+doesn't cost a lookup per request either. Entries are dropped when the
+user document is written (in-memory backend) or explicitly through
+invalidate(); the TTL bounds staleness for writes made by other workers.
+"""
+import os
+import time
+from collections import OrderedDict
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "4096"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("USER_CACHE_NEGATIVE_TTL_SECONDS", "5"))
+
+# Returned by get() when the cache has nothing for an id; None means "cached as not found"
+MISS = object()
+
+class UserCache:
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS, negative_ttl=USER_CACHE_NEGATIVE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        # Database lookups made on misses, to estimate the time hits save
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return MISS
+        self.entries.move_to_end(user_id)
+        if entry[1] is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return entry[1]
+
+    def put(self, user_id, user):
+        """Cache a user, or None for an id with no user"""
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if user is not None else self.negative_ttl
+        self.entries[user_id] = (time.monotonic() + ttl, user)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def record_lookup(self, seconds):
+        self.lookups += 1
+        self.lookup_seconds += seconds
+
+    def invalidate(self, user_id):
+        if self.entries.pop(str(user_id), None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def on_write(self, puts, deletes):
+        """Listener for InMemoryCollection writes to users"""
+        for doc_id, doc in puts:
+            self.invalidate(doc_id)
+        for doc_id in deletes:
+            self.invalidate(doc_id)
+
+    def attach(self, db):
+        """Drop entries as soon as their user documents change, where the backend reports writes"""
+        from database import InMemoryCollection
+        users = db.users
+        if isinstance(users, InMemoryCollection) and self.on_write not in users.listeners:
+            users.listeners.append(self.on_write)
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        average_lookup = self.lookup_seconds / self.lookups if self.lookups else 0.0
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "negative_ttl_seconds": self.negative_ttl,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "avg_lookup_ms": round(average_lookup * 1000, 3),
+            # Database time hits would have cost, at the average lookup latency
+            "saved_ms": round((self.hits + self.negative_hits) * average_lookup * 1000, 1),
+        }
+
+user_cache = UserCache()